@@ -1,17 +1,25 @@
 from datetime import datetime
 from functools import wraps
-import json
 from math import ceil
-from bson import ObjectId, json_util
+from bson import ObjectId
 from bson.errors import InvalidId
 from flask import Blueprint
-from flask import render_template, request, jsonify, redirect, url_for, flash, session, current_app
+from flask import abort, render_template, request, jsonify, redirect, url_for, flash, session, current_app
 import jwt
 from pymongo import MongoClient
 from forms import AdminLoginForm, AdminUserForm
-from utils.email_service import send_bulk_emails, send_ca_approval_email, send_reg_verification_email
+from utils.cache import cached_count
+from utils.checkin import touch_attendees
+from utils.email_outbox import TERMINAL_STATUSES, cancel_email, enqueue_email, enqueue_emails, get_job_statuses
+from utils.export_jobs import EXPORT_KINDS, clean_filters, enqueue_export, export_documents, export_file_response, export_job_status, get_export_job
 from utils.export_service import export_bob_to_excel, export_ca_to_csv, export_ca_to_excel, export_to_csv, export_to_excel
+from utils.pagination import keyset_page
+from utils.rollups import get_reconcile_report, get_rollups
+from utils.search import search_query
 from utils.security import hash_password, verify_password
+from utils.stats import get_dashboard_snapshot
+from utils.segment_catalog import get_segment_catalog
+from utils.tickets import ticket_public_key
 from extensions import db
 
 
@@ -196,13 +204,9 @@ def admin_logout():
 @admin_bp.route('/dashboard')
 @role_required('admin', 'executive', 'organizer', 'moderator')
 def admin_dashboard():
-    """Admin dashboard overview"""
-    # Get statistics
-    total_registrations = db.registrations.count_documents({})
-    total_bob_registrations = db.bob_registrations.count_documents({})
-    verified_registrations = db.registrations.count_documents({'verified': True})
-    ca_registrations = db.ca_registrations.count_documents({})
-    bob_tickets = db.bob_ticket.count_documents({})
+    """Admin dashboard overview, read from the periodically refreshed stats snapshot"""
+    snapshot = get_dashboard_snapshot()
+    stats = snapshot['stats']
     
     # total_money = 0
     # regs = db.registrations.find({})
@@ -215,74 +219,34 @@ def admin_dashboard():
     #             total_money += segment['price']
                 
     # print(total_money)
-    
-    # Get contact message statistics
-    contact_messages_count = db.contact_messages.count_documents({})
-    unread_contact_messages = db.contact_messages.count_documents({
-        'status': 'unread',
-    })
-    
-    # Get recent registrations
-    recent_registrations = list(db.registrations.find().sort('registration_date', -1).limit(10))
-    
-    # Get segment statistics
-    segments = list(db.segments.find({}))
-    segments = json.loads(json_util.dumps(list(segments)))
 
     return render_template('admin/dashboard.html',
-                         total_registrations=total_registrations,
-                         verified_registrations=verified_registrations,
-                         contact_messages_count=contact_messages_count,
-                         unread_contact_messages=unread_contact_messages,
-                         recent_registrations=recent_registrations,
-                         segments=segments,
-                         ca_registrations=ca_registrations,
-                         total_bob_registrations=total_bob_registrations,
-                         bob_tickets=bob_tickets)
+                         total_registrations=stats['total_registrations'],
+                         verified_registrations=stats['verified_registrations'],
+                         contact_messages_count=stats['contact_messages_count'],
+                         unread_contact_messages=stats['unread_contact_messages'],
+                         recent_registrations=stats['recent_registrations'],
+                         segments=stats['segments'],
+                         ca_registrations=stats['ca_registrations'],
+                         total_bob_registrations=stats['total_bob_registrations'],
+                         bob_tickets=stats['bob_tickets'],
+                         stats_computed_at=snapshot['computed_at'],
+                         stats_age=int((datetime.utcnow() - snapshot['computed_at']).total_seconds()))
 
 
 @admin_bp.route('/analytics')
 @role_required('admin', 'executive', 'organizer', 'moderator')
 def admin_analytics():
-    """Analytics dashboard"""
-    # Registration statistics by day
-    pipeline = [
-        {
-            '$group': {
-                '_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$registration_date'}},
-                'count': {'$sum': 1}
-            }
-        },
-        {'$sort': {'_id': 1}}
-    ]
-    daily_stats = list(db.registrations.aggregate(pipeline))
-    
-    # Category distribution
-    category_pipeline = [
-        {'$group': {'_id': '$category', 'count': {'$sum': 1}}},
-        {'$sort': {'count': -1}}
-    ]
-    category_stats = list(db.registrations.aggregate(category_pipeline))
-    
-    # Segment distribution
-    segment_pipeline = [
-        {'$group': {'_id': '$segment_name', 'count': {'$sum': 1}}},
-        {'$sort': {'count': -1}}
-    ]
-    segment_stats = list(db.registrations.aggregate(segment_pipeline))
-
-    ca_pipeline = [
-        {'$group': {'_id': '$ca_ref', 'count': {'$sum': 1}}},
-        {'$sort': {'count': -1}}
-    ]
-    ca_stats = list(db.registrations.aggregate(ca_pipeline))
-    
+    """Analytics dashboard, read from the incrementally maintained rollups"""
+    reconcile_report = get_reconcile_report()
+    rollups = get_rollups()
     
     return render_template('admin/analytics.html',
-                         daily_stats=daily_stats,
-                         category_stats=category_stats,
-                         segment_stats=segment_stats,
-                         ca_stats=ca_stats)
+                         daily_stats=rollups['day'],
+                         category_stats=rollups['category'],
+                         segment_stats=rollups['segment'],
+                         ca_stats=rollups['ca_ref'],
+                         reconcile_report=reconcile_report)
 
 
 ####  Contact Message Routes
@@ -362,7 +326,9 @@ def admin_registrations():
     segment_id = request.args.get('segment_id')
     verified_filter = request.args.get('verified')
     search = request.args.get('search')
-    page = int(request.args.get('page', 1))
+    after = request.args.get('after')
+    before = request.args.get('before')
+    page = max(int(request.args.get('page', 1)), 1)
 
     per_page = 40
     query = {}
@@ -378,32 +344,23 @@ def admin_registrations():
 
     if search:
         search = search.strip()
-        or_conditions = [
-            {"full_name": {"$regex": search, "$options": "i"}},
-            {"email": {"$regex": search, "$options": "i"}},
-            {"bkash_number": {"$regex": search, "$options": "i"}},
-            {"transaction_id": {"$regex": search, "$options": "i"}},
-        ]
-
-        try:
-            or_conditions.append({"_id": ObjectId(search)})
-        except InvalidId:
-            pass
-
-        query["$or"] = or_conditions
+        query.update(search_query(search))
 
-    # total count
-    total = db.registrations.count_documents(query)
-    total_pages = ceil(total / per_page)
+    # total count, recounted at most once a minute per worker
+    total = cached_count(db.registrations, query)
+    total_pages = max(ceil(total / per_page), 1)
 
-    registrations = list(
-        db.registrations.find(query)
-        .sort('registration_date', -1)
-        .skip((page - 1) * per_page)
-        .limit(per_page)
+    # Seek from the previous page's last (or first) row instead of skipping
+    registrations, prev_cursor, next_cursor = keyset_page(
+        db.registrations, query, 'registration_date', per_page, after=after, before=before
     )
+    if not prev_cursor:
+        page = 1
+    elif not next_cursor:
+        page = total_pages
+    page = min(page, total_pages)
 
-    segments = list(db.segments.find({}))
+    segments = get_segment_catalog().segments
 
     return render_template(
         'admin/registrations.html',
@@ -413,7 +370,10 @@ def admin_registrations():
         verified_filter=verified_filter,
         search=search,
         page=page,
-        total_pages=total_pages
+        total=total,
+        total_pages=total_pages,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor
     )
 
 
@@ -422,21 +382,15 @@ def admin_registrations():
 def verify_registration(registration_id):
     """Verify a single registration"""
     try:
+        registration = db.registrations.find_one({'_id': ObjectId(registration_id)}, {'_id': 1})
+        if not registration:
+            return jsonify({'success': False, 'message': 'Registration not found'}), 404
         
-        # Get registration to send email
-        registration = db.registrations.find_one({'_id': ObjectId(registration_id)})
-        if registration:
-            print('a')
-            _reg = send_reg_verification_email(registration)
-            if _reg:
-                print('b')
-                db.registrations.update_one(
-                    {'_id': ObjectId(registration_id)},
-                    {'$set': {'verified': True, 'verified_at': datetime.utcnow()}}
-                )
-                print('c')
-                flash(f"verified registration {registration['_id']}", 'success')
-                return jsonify({'success': True})
+        # The email worker sends the mail and marks the registration verified once it went out;
+        # resend=true mails an already verified registration again
+        resend = bool((request.get_json(silent=True) or {}).get('resend'))
+        job = enqueue_email('reg_verification', registration['_id'], session.get('admin_email'), resend)
+        return jsonify({'success': True, 'job_id': str(job['_id']), 'status': job['status']})
     except Exception as e:
         print(e)
         return jsonify({'success': False}), 500
@@ -452,26 +406,39 @@ def bulk_verify():
     
     try:
         object_ids = [ObjectId(rid) for rid in registration_ids]
+        existing_ids = [reg['_id'] for reg in db.registrations.find({'_id': {'$in': object_ids}}, {'_id': 1})]
         
-        # Update all selected registrations
-        result = db.registrations.update_many(
-            {'_id': {'$in': object_ids}},
-            {'$set': {'verified': True, 'verified_at': datetime.utcnow()}}
-        )
-        
-        # Send emails to verified registrations
-        verified_registrations = list(db.registrations.find({'_id': {'$in': object_ids}}))
-        succ = send_bulk_emails(verified_registrations)
-        if succ:
-            result = db.registrations.update_many(
-            {'_id': {'$in': object_ids}},
-            {'$set': {'verified': True, 'verified_at': datetime.utcnow()}})
-            return jsonify({'success': True, 'verified_count': result.modified_count})
-        
-        
+        # Each registration is marked verified by the email worker once its mail went out
+        jobs = enqueue_emails('reg_verification', existing_ids, session.get('admin_email'))
+        return jsonify({
+            'success': True,
+            'queued_count': len(jobs),
+            'job_ids': [str(job['_id']) for job in jobs]
+        })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@admin_bp.route('/email-jobs', methods=['POST'])
+@role_required('admin', 'executive')
+def email_job_status():
+    """Poll the status of queued verification/approval emails"""
+    job_ids = request.json.get('job_ids', [])
+    
+    try:
+        jobs = get_job_statuses(job_ids)
+    except InvalidId:
+        return jsonify({'success': False, 'message': 'Invalid job ID'}), 400
+    
+    pending = sum(1 for job in jobs if job['status'] not in TERMINAL_STATUSES)
+    return jsonify({
+        'success': True,
+        'jobs': jobs,
+        'sent': sum(1 for job in jobs if job['status'] == 'sent'),
+        'dead': sum(1 for job in jobs if job['status'] == 'dead'),
+        'cancelled': sum(1 for job in jobs if job['status'] == 'cancelled'),
+        'pending': pending
+    })
+
 @admin_bp.route('/bob-registrations')
 @role_required('admin', 'executive', 'organizer', 'moderator')
 def admin_bob_registrations():
@@ -515,24 +482,10 @@ def admin_ca_registrations():
     if status_filter != 'all':
         query['status'] = status_filter
 
-    # Search filter (same input for _id or other fields)
+    # Search filter (same input for _id or other fields), served by the search_keys index
     if search:
         search = search.strip()
-        or_conditions = [
-            {"full_name": {"$regex": search, "$options": "i"}},
-            {"email": {"$regex": search, "$options": "i"}},
-            {"phone": {"$regex": search, "$options": "i"}},
-            {"institution": {"$regex": search, "$options": "i"}},
-            {"ca_code": {"$regex": search, "$options": "i"}},
-        ]
-
-        # If valid ObjectId, also search by _id
-        try:
-            or_conditions.append({"_id": ObjectId(search)})
-        except InvalidId:
-            pass
-
-        query["$or"] = or_conditions
+        query.update(search_query(search))
 
     ca_registrations = list(
         db.ca_registrations.find(query).sort('registration_date', -1)
@@ -555,18 +508,26 @@ def update_ca_status(ca_id):
         return jsonify({'success': False, 'message': 'Invalid status'}), 400
     
     try:
+        ca = db.ca_registrations.find_one({'_id': ObjectId(ca_id)}, {'_id': 1, 'user_id': 1})
+        if not ca:
+            return jsonify({'success': False, 'message': 'CA not found'}), 404
+        
+        changed = db.ca_registrations.update_one(
+            {'_id': ca['_id'], 'status': {'$ne': status}},
+            {'$set': {'status': status, 'status_updated_at': datetime.utcnow()}}
+        ).modified_count
+        if changed:
+            touch_attendees([ca.get('user_id')])
+        
         if status == 'approved':
-            # Send approval email
-            ca = db.ca_registrations.find_one({'_id': ObjectId(ca_id)})
-            if ca:
-                _ca = send_ca_approval_email(ca)
-                if _ca:
-                    db.ca_registrations.update_one(
-                        {'_id': ObjectId(ca_id)},
-                        {'$set': {'status': status, 'status_updated_at': datetime.utcnow()}}
-                    )
-                    flash(f"verified reg of {ca['full_name']}", 'success')
-                    return jsonify({'success': True})
+            # The email worker sends the approval mail while the CA is still approved;
+            # a new approval gets a new mail even if an earlier one went out
+            job = enqueue_email('ca_approval', ca['_id'], session.get('admin_email'),
+                                bool(changed or request.json.get('resend')))
+            return jsonify({'success': True, 'job_id': str(job['_id']), 'status': job['status']})
+        
+        cancel_email('ca_approval', ca['_id'])
+        return jsonify({'success': True})
     except Exception as e:
         print(e)
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -575,7 +536,7 @@ def update_ca_status(ca_id):
 @admin_bp.route('/export')
 @role_required('admin', 'executive', 'organizer', 'moderator')
 def admin_export():
-    segments = list(db.segments.find({}))
+    segments = get_segment_catalog().segments
     return render_template(
         'admin/export.html',
         segments=segments
@@ -585,18 +546,9 @@ def admin_export():
 @role_required('admin', 'executive', 'organizer', 'moderator')
 def admin_reg_export():
     format_type = request.args.get('format', 'csv')
-    verified = request.args.get('verified')  # "true", "false", or None
-    segment_id = request.args.get('segment_id')
-
-    query = {}
-
-    if segment_id:
-        query['segment_id'] = ObjectId(segment_id)
-
-    if verified in ('true', 'false'):
-        query['verified'] = True if verified == 'true' else False
-
-    registrations = list(db.registrations.find(query))
+    
+    # Stream straight from the cursor, reading only the exported fields
+    registrations = export_documents('registrations', clean_filters('registrations', request.args))
 
     if format_type == 'csv':
         return export_to_csv(registrations)
@@ -609,24 +561,9 @@ def admin_reg_export():
 def admin_ca_export():
     """Export data page"""
     format_type = request.args.get('format', 'csv')
-    status = request.args.get('status')
-    
-    query = {}
-    if status:
-        query['status'] = status
-    
-    ca_data = list(db.ca_registrations.find(query))
-    for ca_item in ca_data:
-        user_id = ca_item.get('user_id')
-        if user_id:
-            user_data = db.users.find_one({'_id': user_id})
-            if user_data and 'facebook_link' in user_data:
-                ca_item['facebook_link'] = user_data['facebook_link']
-            else:
-                ca_item['facebook_link'] = None  # or handle missing case as needed
-        else:
-            ca_item['facebook_link'] = None  # handle case where user_id is missing
     
+    # Facebook links live on the user; fetch them per batch rather than per CA
+    ca_data = export_documents('ca_registrations', clean_filters('ca_registrations', request.args))
     
     if format_type == 'csv':
         csv_data = export_ca_to_csv(ca_data)
@@ -638,16 +575,56 @@ def admin_ca_export():
 @admin_bp.route('/bob-export')
 @role_required('admin', 'executive', 'organizer', 'moderator')
 def admin_bob_export():
-    status = request.args.get('status')
-    
-    query = {}
-    if status:
-        query['status'] = status
-    
-    bob_data = list(db.bob_registrations.find(query))
+    bob_data = export_documents('bob_registrations', clean_filters('bob_registrations', request.args))
     excel_data = export_bob_to_excel(bob_data)
     return excel_data
 
+@admin_bp.route('/export-jobs', methods=['POST'])
+@role_required('admin', 'executive', 'organizer', 'moderator')
+def create_export_job():
+    """Queue an export for export_worker.py, reusing a recent identical one"""
+    data = request.json or {}
+    kind = data.get('kind')
+    format_type = data.get('format', 'csv')
+    if format_type == 'excel':
+        format_type = 'xlsx'
+    
+    if kind not in EXPORT_KINDS:
+        return jsonify({'success': False, 'message': 'Unknown export'}), 400
+    
+    try:
+        job, reused = enqueue_export(kind, format_type, clean_filters(kind, data), session.get('admin_email'))
+    except (ValueError, InvalidId) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    return jsonify({'success': True, 'reused': reused, 'job': export_job_status(job)})
+
+@admin_bp.route('/export-jobs/<job_id>')
+@role_required('admin', 'executive', 'organizer', 'moderator')
+def export_job_progress(job_id):
+    """Poll an export job's progress"""
+    try:
+        job = get_export_job(job_id)
+    except InvalidId:
+        return jsonify({'success': False, 'message': 'Invalid job ID'}), 400
+    if not job:
+        return jsonify({'success': False, 'message': 'Export not found'}), 404
+    
+    return jsonify({'success': True, 'job': export_job_status(job)})
+
+@admin_bp.route('/export-jobs/<job_id>/download')
+@role_required('admin', 'executive', 'organizer', 'moderator')
+def download_export_job(job_id):
+    """Download a finished export; supports Range requests for resumed downloads"""
+    try:
+        job = get_export_job(job_id)
+    except InvalidId:
+        abort(404)
+    if not job or job['status'] != 'done':
+        abort(404)
+    
+    return export_file_response(job)
+
 # Replace both admin_users and add_admin_user routes with this combined route:
 @admin_bp.route('/users', methods=['GET', 'POST'])
 @role_required('admin', 'executive')  # Only admin and executive can manage users
@@ -795,4 +772,5 @@ def admin_settings():
 @admin_bp.route('/scanner', methods=['GET', 'POST'])
 @role_required('admin', 'executive', 'organizer', 'moderator')
 def admin_scanner():
-    return render_template('admin/scanner.html')
\ No newline at end of file
+    segments = [seg['name'] for seg in get_segment_catalog().segments]
+    return render_template('admin/scanner.html', segments=segments, ticket_public_key=ticket_public_key())
\ No newline at end of file
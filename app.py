@@ -1,20 +1,34 @@
 from functools import wraps
 import os
-import random
-import string
-import uuid
-from flask import Flask, json, render_template, request, jsonify, redirect, url_for, flash, session, blueprints
+from flask import Flask, abort, json, render_template, request, jsonify, redirect, url_for, flash, session, blueprints, send_file
 from flask_wtf.csrf import CSRFProtect
 import jwt
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError, OperationFailure
 from datetime import datetime, timedelta
 from bson.objectid import ObjectId
 from config import Config
 from forms import BobTicketForm, ChangePasswordForm, ForgotPasswordForm, ProfileUpdateForm, RegistrationForm, CARegistrationForm, ContactForm, UserLoginForm, UserSignupForm
 from utils.security import hash_password, generate_csrf_token
+from utils.cache import cache_stats, get_system_settings, invalidate_system_settings
+from utils.segment_catalog import get_segment_catalog
+from utils.http_client import http_metrics
+from utils.email_outbox import ensure_outbox_indexes
+from utils.export_jobs import ensure_export_indexes
+from utils.ca_codes import allocate_ca_code, ensure_ca_code_counters
+from utils.checkin import build_manifest, ensure_checkin_indexes, record_checkins, segment_headcounts
+from utils.participant_counters import ensure_participant_counters
+from utils.image_jobs import enqueue_image_job, ensure_image_indexes
+from utils.registration_commit import commit_registration
+from utils.rollups import ensure_rollup_indexes
+from utils.scan import resolve_scan
+from utils.search import ensure_search_indexes, with_search_keys
+from utils.tickets import InvalidTicket, document_ticket, parse_scan
+from utils.uploads import (UPLOAD_KINDS, InvalidUpload, claim_upload, ensure_upload_indexes, issue_upload_ticket,
+                           local_upload_path, release_upload, store_local_upload, verify_upload)
 import extensions
 from firebase_config import initialize_firebase
-from utils.firebase_helpers import firebase_get_user_info, firebase_verify_token
+from utils.firebase_helpers import firebase_get_user_info, firebase_verify_id_token
 from utils.firebase_helpers import (
     firebase_create_user, 
     firebase_login_user, 
@@ -23,12 +37,9 @@ from utils.firebase_helpers import (
     firebase_change_password,
     firebase_send_email_verification
 )
-import uuid
 from flask_cors import CORS
 import re
 import cloudinary
-import cloudinary.uploader
-import uuid
 from datetime import datetime
 import os
 
@@ -62,37 +73,9 @@ ca_collection = db.ca_registrations
 
 initialize_firebase()
 
-def allowed_file(filename):
-        return '.' in filename and \
-               filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
 def generate_ca_code(full_name):
     """Generate unique 4-letter CA code from name"""
-    # Get initials from name
-    initials = ''.join([word[0].upper() for word in full_name.split() if word])
-    
-    # If initials are less than 4 letters, add random letters
-    if len(initials) >= 4:
-        code = initials[:4]
-    else:
-        # Add random letters to make 4 characters
-        random_chars = ''.join(random.choices(string.ascii_uppercase, k=4-len(initials)))
-        code = initials + random_chars
-    
-    # Check if code already exists, if yes, add number
-    existing_ca = db.ca_registrations.find_one({'ca_code': code})
-    counter = 1
-    original_code = code
-    
-    while existing_ca:
-        if counter < 10:
-            code = f"{original_code[:3]}{counter}"
-        else:
-            code = f"{original_code[:2]}{counter:02d}"
-        existing_ca = db.ca_registrations.find_one({'ca_code': code})
-        counter += 1
-    
-    return code
+    return allocate_ca_code(full_name)
 
 def get_default_permissions(role):
     """Get default permissions based on role"""
@@ -141,25 +124,30 @@ def login_required(f):
         # Check if we have a refresh token and token is expired
         if 'refresh_token' in session:
             try:
-                # Try to verify current token
-                # Instead of using firebase_verify_token, use the REST API directly
-                decoded_token = firebase_verify_token(session['firebase_token'])
-                if not decoded_token:
-                    # Token expired, try to refresh it
-                    from utils.firebase_helpers import refresh_firebase_token
-                    new_tokens = refresh_firebase_token(session['refresh_token'])
-                    if new_tokens:
-                        session['firebase_token'] = new_tokens.get('id_token')
-                        session['refresh_token'] = new_tokens.get('refresh_token')
-                        # Also update the user's email_verified status using the new token
-                        user_info = firebase_verify_token(new_tokens.get('id_token'))
-                        if user_info:
-                            session['email_verified'] = user_info.get('emailVerified', False)
-                    else:
-                        # Refresh failed, clear session
-                        session.clear()
-                        flash('Session expired. Please login again.', 'error')
-                        return redirect(url_for('user_login'))
+                # Verify the ID token locally against Google's cached public keys
+                firebase_verify_id_token(session['firebase_token'])
+            except jwt.ExpiredSignatureError:
+                # Token expired, try to refresh it
+                from utils.firebase_helpers import refresh_firebase_token
+                new_tokens = refresh_firebase_token(session['refresh_token'])
+                if not new_tokens:
+                    # Refresh failed, clear session
+                    session.clear()
+                    flash('Session expired. Please login again.', 'error')
+                    return redirect(url_for('user_login'))
+                
+                try:
+                    claims = firebase_verify_id_token(new_tokens.get('id_token'))
+                except Exception as e:
+                    session.clear()
+                    print(e)
+                    flash('Session expired. Please login again.', 'error')
+                    return redirect(url_for('user_login'))
+                
+                session['firebase_token'] = new_tokens.get('id_token')
+                session['refresh_token'] = new_tokens.get('refresh_token')
+                # Also update the user's email_verified status using the new token
+                session['email_verified'] = claims.get('email_verified', False)
             except Exception as e:
                 # Token verification failed
                 session.clear()
@@ -272,46 +260,54 @@ def init_db():
     # Ensure collections exist and have indexes
     collections = {
         'users': [
-            [('email', 1), {'unique': True}],
-            [('firebase_uid', 1), {'unique': True}],
-            [('created_at', -1)],
-            [('institution', 1)],
-            [('mobile', 1)]
+            [[('email', 1)], {'unique': True}],
+            [[('firebase_uid', 1)], {'unique': True, 'sparse': True}],
+            [[('created_at', -1)]],
+            [[('institution', 1)]],
+            [[('mobile', 1)]]
         ],
         'registrations': [
-            [('user_id', 1)],
-            [('email', 1)],
-            [('segment_id', 1)],
-            [('registration_date', -1)],
-            [('verified', 1)],
-            [('transaction_id', 1), {'unique': True, 'sparse': True}]
+            [[('user_id', 1)]],
+            [[('email', 1)]],
+            [[('segment_id', 1)]],
+            [[('registration_date', -1)]],
+            [[('verified', 1)]],
+            [[('transaction_id', 1)], {'unique': True, 'sparse': True}],
+            # Keyset pagination in the admin list: each filter combination
+            # walks one of these in (registration_date, _id) order
+            [[('registration_date', -1), ('_id', -1)]],
+            [[('verified', 1), ('registration_date', -1), ('_id', -1)]],
+            [[('segment_id', 1), ('registration_date', -1), ('_id', -1)]],
+            [[('segment_id', 1), ('verified', 1), ('registration_date', -1), ('_id', -1)]]
         ],
         'ca_registrations': [
-            [('user_id', 1)],
-            [('email', 1)],
-            [('ca_code', 1), {'unique': True}],
-            [('registration_date', -1)],
-            [('status', 1)]
+            [[('user_id', 1)]],
+            [[('email', 1)]],
+            [[('ca_code', 1)], {'unique': True}],
+            [[('registration_date', -1)]],
+            [[('status', 1)]]
         ],
         'segments': [
-            [('name', 1)],
-            [('type', 1)],
-            [('price', 1)]
+            [[('name', 1)]],
+            [[('type', 1)]],
+            [[('price', 1)]]
         ],
         'contact_messages': [
-            [('email', 1)],
-            [('submitted_at', -1)],
-            [('status', 1)]
+            [[('email', 1)]],
+            [[('submitted_at', -1)]],
+            [[('status', 1)]]
         ]
     }
     
     for collection_name, indexes in collections.items():
         collection = db[collection_name]
         for index_spec in indexes:
+            keys, options = index_spec[0], index_spec[1] if len(index_spec) > 1 else {}
             try:
-                collection.create_index(index_spec[0], **index_spec[1] if len(index_spec) > 1 else {})
-            except:
-                pass
+                collection.create_index(keys, **options)
+            except OperationFailure as e:
+                # Existing data or an older index with other options; the app still runs without it
+                print(f"Could not create index {keys} on {collection_name}: {e}")
     # In your init_db function
     db.bob_ticket.create_index([('user_id', 1)])
     db.bob_ticket.create_index([('email', 1)])
@@ -337,9 +333,16 @@ def init_db():
     db.bob_registrations.create_index([('registration_date', -1)])
     db.bob_registrations.create_index([('status', 1)])
 
+    ensure_outbox_indexes()
+    ensure_export_indexes()
+    ensure_search_indexes()
+    ensure_rollup_indexes()
+    ensure_checkin_indexes()
+    ensure_ca_code_counters()
+    ensure_participant_counters()
+    ensure_image_indexes()
+    ensure_upload_indexes()
 
-ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
-MAX_FILE_SIZE = 2 * 1024 * 1024
 
 with app.app_context():
     init_db()
@@ -751,7 +754,7 @@ def ca_register():
         return redirect(url_for('user_login'))
     
     # Check if CA registration is enabled
-    settings = db.settings.find_one({'name': 'system_settings'})
+    settings = get_system_settings()
     if not settings or not settings.get('ca_registration_enabled', True):
         flash('CA registration is currently closed.', 'error')
         return redirect(url_for('ca_registration_closed'))
@@ -783,58 +786,17 @@ def ca_register():
         form.class_info.data = user.get('class_level', '')
     
     if form.validate_on_submit():
-        # Generate CA code
-        ca_code = generate_ca_code(form.full_name.data)
-        
-        # Handle profile picture upload
-        profile_pic_url = None
-        
-        if form.profile_picture.data:
-            file = form.profile_picture.data
-            
-            # Basic checks
-            if file.filename == '':
-                flash('Profile picture is required', 'error')
-                return redirect(url_for('ca_register'))
-            
-            # Check file extension
-            if not allowed_file(file.filename):
-                flash('Only JPG, JPEG, and PNG files are allowed', 'error')
-                return redirect(url_for('ca_register'))
-            
-            # Check file size (assuming MAX_FILE_SIZE is defined elsewhere)
-            file.seek(0, os.SEEK_END)
-            file_length = file.tell()
-            file.seek(0)
-            
-            if file_length > MAX_FILE_SIZE:
-                flash(f'File size exceeds {MAX_FILE_SIZE // (1024*1024)}MB limit', 'error')
-                return redirect(url_for('ca_register'))
-            
-            try:
-                # Generate a unique ID for the image
-                unique_id = uuid.uuid4().hex[:8]
-                timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-                public_id = f"ca_{timestamp}_{unique_id}"
-                
-                # Upload directly to Cloudinary
-                upload_result = cloudinary.uploader.upload(
-                    file,
-                    public_id=public_id,
-                    folder="profile_pictures"
-                )
-                
-                # Get the secure URL
-                profile_pic_url = upload_result['secure_url']
-                
-            except Exception as e:
-                app.logger.error(f'Upload error: {str(e)}')
-                flash('Error uploading file. Please try again.', 'error')
-                return redirect(url_for('ca_register'))
-        else:
-            flash('Profile picture is required', 'error')
+        # The browser uploaded the picture straight to storage; only check its signed reference
+        try:
+            profile_picture = verify_upload(form.profile_picture_ref.data, 'profile_picture', user['_id'])
+            claim_upload(profile_picture)
+        except InvalidUpload:
+            flash('Please upload your profile picture again.', 'error')
             return redirect(url_for('ca_register'))
         
+        # Generate CA code only once the form is going to be saved; each one uses up a counter slot
+        ca_code = generate_ca_code(form.full_name.data)
+        
         # Create CA registration
         ca_data = {
             'user_id': user['_id'],
@@ -845,7 +807,7 @@ def ca_register():
             'phone': form.phone.data,
             'email': form.email.data,
             'why_ca': form.why_ca.data,
-            'profile_picture': profile_pic_url,
+            'profile_picture': profile_picture['url'],
             'ca_code': ca_code,
             'status': 'pending',
             'registration_date': datetime.utcnow(),
@@ -853,9 +815,12 @@ def ca_register():
             'user_agent': request.user_agent.string,
             'user_email_verified': True
         }
+        with_search_keys(ca_data, 'ca_registrations')
         
         # Insert into database
         result = db.ca_registrations.insert_one(ca_data)
+        # Strip, downsize and thumbnail the picture in image_worker.py
+        enqueue_image_job('ca_registrations', result.inserted_id, profile_picture)
         
         # Add CA application ID to user's applications array
         db.users.update_one(
@@ -935,7 +900,7 @@ def register():
     if not user:
         return redirect(url_for('user_login'))
     
-    settings = db.settings.find_one({'name': 'system_settings'})
+    settings = get_system_settings()
     if not settings or not settings.get('registration_enabled', True):
         flash('Event registration is currently closed.', 'error')
         return redirect(url_for('registration_closed'))
@@ -943,17 +908,9 @@ def register():
     form = RegistrationForm()
     
     # Get segments for dropdown
-    segments = list(
-        segments_collection.find(
-            {'_id': {'$nin': [
-                ObjectId('6996cf26e7eb96d29e2010c6'),
-                ObjectId('6996cf26e7eb96d29e2010c8'),
-                ObjectId('6996cf26e7eb96d29e2010d4'),
-                # ObjectId('6996cf26e7eb96d29e2010cc')
-            ]}},
-            {'_id': 1, 'name': 1, 'price': 1, 'categories': 1}
-        ))
-    form.segment.choices = [(str(seg['_id']), f"{seg['name']} - ৳{seg['price']}") for seg in segments]
+    catalog = get_segment_catalog()
+    segments = catalog.register_segments
+    form.segment.choices = catalog.register_choices
     form.division.validate_choice = False
     # Get segment_id from query parameter
     segment_id = request.args.get('id')
@@ -965,14 +922,8 @@ def register():
         form.institution.data = user.get('institution', '')
         
         # Pre-select segment if segment_id is provided and valid
-        if segment_id:
-            try:
-                ObjectId(segment_id)
-                segment_exists = any(str(seg['_id']) == segment_id for seg in segments)
-                if segment_exists:
-                    form.segment.data = segment_id
-            except:
-                pass
+        if segment_id and segment_id in catalog.register_ids:
+            form.segment.data = segment_id
     
     if form.validate_on_submit():
         # Generate CSRF token for this submission
@@ -981,59 +932,23 @@ def register():
 
         
         receipt_url = None
-        segment = segments_collection.find_one({'_id': ObjectId(form.segment.data)})
+        segment = catalog.get(form.segment.data)
         
+        receipt = None
         if segment.get('price') == 0:
             receipt_url = ''
+        elif not form.receipt_ref.data:
+            flash('receipt screenshot is required', 'error')
+            return render_template('register.html', form=form, segments=segments, preselected_segment_id=form.segment.data)
         else:
-            if form.receipt.data:
-                file = form.receipt.data
-                
-                # Basic checks
-                if file.filename == '':
-                    flash('receipt screenshot is required', 'error')
-                    return render_template('register.html', form=form, segments=segments, preselected_segment_id=form.segment.data)
-                
-                # Check file extension
-                if not allowed_file(file.filename):
-                    flash('Only JPG, JPEG, and PNG files are allowed', 'error')
-                    return render_template('register.html', form=form, segments=segments, preselected_segment_id=form.segment.data)
-                
-                # Check file size (assuming MAX_FILE_SIZE is defined elsewhere)
-                file.seek(0, os.SEEK_END)
-                file_length = file.tell()
-                file.seek(0)
-                
-                if file_length > MAX_FILE_SIZE:
-                    flash(f'File size exceeds {MAX_FILE_SIZE // (1024*1024)}MB limit', 'error')
-                    return render_template('register.html', form=form, segments=segments, preselected_segment_id=form.segment.data)
-                
-                try:
-                    # Generate a unique ID for the image
-                    unique_id = uuid.uuid4().hex[:8]
-                    timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-                    public_id = f"{timestamp}_{unique_id}"
-                    
-                    # Upload directly to Cloudinary
-                    upload_result = cloudinary.uploader.upload(
-                        file,
-                        public_id=public_id,
-                        folder="receipt_pictures"
-                    )
-                    
-                    # Get the secure URL
-                    receipt_url = upload_result['secure_url']
-                    
-                except Exception as e:
-                    app.logger.error(f'Upload error: {str(e)}')
-                    flash('Error uploading file. Please try again.', 'error')
-                    return render_template('register.html', form=form, segments=segments, preselected_segment_id=form.segment.data)
-            else:
-                flash('receipt screenshot is required', 'error')
+            # The browser uploaded the receipt straight to storage; only check its signed reference
+            try:
+                receipt = verify_upload(form.receipt_ref.data, 'receipt', user['_id'])
+                receipt_url = receipt['url']
+            except InvalidUpload:
+                flash('Please upload the receipt screenshot again.', 'error')
                 return render_template('register.html', form=form, segments=segments, preselected_segment_id=form.segment.data)
         
-        
-
         # Conditional category validation
         if segment.get('categories') and not form.category.data:
             form.category.errors.append("Category is required for this segment.")
@@ -1093,23 +1008,28 @@ def register():
             'ip_address': request.remote_addr,
             'user_agent': request.user_agent.string
         }
+        with_search_keys(registration_data, 'registrations')
         
-        # Insert registration
-        result = registrations_collection.insert_one(registration_data)
-        
-        # Update segment participant count
-        segments_collection.update_one(
-            {'_id': ObjectId(form.segment.data)},
-            {'$inc': {'current_participants': 1}}
-        )
+        # Each uploaded receipt backs exactly one registration
+        if receipt:
+            try:
+                claim_upload(receipt)
+            except InvalidUpload:
+                flash('Please upload the receipt screenshot again.', 'error')
+                return render_template('register.html', form=form, segments=segments, preselected_segment_id=form.segment.data)
         
-        # Add registration ID to user's registrations array
-        db.users.update_one(
-            {'_id': user['_id']},
-            {'$push': {'registrations': result.inserted_id}}
-        )
+        # Insert, count on the segment and link to the user in one commit
+        try:
+            registration_id = commit_registration(registration_data)
+        except DuplicateKeyError:
+            if receipt:
+                release_upload(receipt)
+            form.transaction_id.errors.append("This transaction ID has already been used.")
+            return render_template('register.html', form=form, segments=segments, preselected_segment_id=form.segment.data)
+        if receipt:
+            enqueue_image_job('registrations', registration_id, receipt)
         
-        return redirect(url_for('registration_success', registration_id=str(result.inserted_id)))
+        return redirect(url_for('registration_success', registration_id=str(registration_id)))
     
     return render_template('register.html', 
                          form=form, 
@@ -1117,6 +1037,36 @@ def register():
                          preselected_segment_id=form.segment.data if form.segment.data else None)
 
 
+@app.route('/api/upload-ticket', methods=['POST'])
+@login_required
+def upload_ticket():
+    """Signed parameters for uploading an image straight to storage"""
+    user = get_current_user()
+    kind = (request.json or {}).get('kind')
+    if not user or kind not in UPLOAD_KINDS:
+        return jsonify({'success': False, 'message': 'Invalid upload request'}), 400
+    return jsonify(dict(issue_upload_ticket(kind, user['_id']), success=True))
+
+@app.route('/uploads/direct', methods=['POST'])
+@csrf.exempt
+def local_upload():
+    """Local stand-in for the storage upload endpoint (UPLOAD_BACKEND=local)"""
+    if Config.UPLOAD_BACKEND != 'local':
+        abort(404)
+    try:
+        return jsonify(store_local_upload(request.form, request.files.get('file')))
+    except InvalidUpload as e:
+        return jsonify({'error': {'message': str(e)}}), 400
+
+@app.route('/uploads/<path:asset>')
+def uploaded_file(asset):
+    """Serve an image stored by the local upload stand-in"""
+    path = local_upload_path(asset) if Config.UPLOAD_BACKEND == 'local' else None
+    if not path:
+        abort(404)
+    return send_file(path, max_age=31536000)
+
+
 @app.route('/registration-success/<registration_id>')
 def registration_success(registration_id):
     """Success page after registration"""
@@ -1125,7 +1075,7 @@ def registration_success(registration_id):
         flash('Registration not found', 'error')
         return redirect(url_for('index'))
     
-    return render_template('success.html', registration=registration)
+    return render_template('success.html', registration=registration, ticket=document_ticket(registration))
 
 @app.route('/battle-of-the-bands')
 @login_required
@@ -1136,7 +1086,7 @@ def bob_register_page():
     if not user:
         return redirect(url_for('user_login'))
     
-    settings = db.settings.find_one({'name': 'system_settings'})
+    settings = get_system_settings()
     if not settings or not settings.get('bob_registration_enabled', True):
         flash('Battle of the Bands registration is currently closed.', 'error')
         return redirect(url_for('registration_closed'))
@@ -1151,7 +1101,7 @@ def bob_register_page():
 @app.route('/bob-register', methods=['POST'])
 @login_required
 def bob_register():
-    settings = db.settings.find_one({'name': 'system_settings'})
+    settings = get_system_settings()
     if not settings or not settings.get('bob_registration_enabled', True):
         flash('Event registration is currently closed.', 'error')
         return redirect(url_for('registration_closed'))
@@ -1312,24 +1262,20 @@ def developers():
 
 @app.route('/events', methods=['GET'])
 def events():
-    events = list(segments_collection.find({}, {'_id': 1, 'name': 1, 'type': 1, 'img': 1}))
-    
-    signature_names = ['ব্যাটল অব দ্য ব্যান্ডস', 'বিটবক্স ব্রল']
-    signature_events = [e for e in events if e['name'] in signature_names]
-    solo_events = [e for e in events if e['type'] == 'Solo']
-    team_events = [e for e in events if e['type'] == 'Team']
-    submission_events = [e for e in events if e['type'] == 'Submission']
+    catalog = get_segment_catalog()
     return render_template(
         "events.html",
-        signature_events=signature_events,
-        solo_events=solo_events,
-        team_events=team_events,
-        submission_events=submission_events
+        signature_events=catalog.signature_events,
+        solo_events=catalog.solo_events,
+        team_events=catalog.team_events,
+        submission_events=catalog.submission_events
     )
     
 @app.route('/event/<_id>', methods=['GET'])
 def event(_id):
-    event = segments_collection.find_one({'_id': ObjectId(_id)})
+    event = get_segment_catalog().get(_id)
+    if not event:
+        abort(404)
     return render_template(
         "event.html", event=event
     )
@@ -1385,7 +1331,7 @@ def contact():
 def get_segment_categories(segment_id):
     """API endpoint to get categories for a segment"""
     try:
-        segment = segments_collection.find_one({'_id': ObjectId(segment_id)})
+        segment = get_segment_catalog().get(segment_id)
         if segment:
             return jsonify({'categories': segment.get('categories', [])})
         return jsonify({'categories': []})
@@ -1397,7 +1343,7 @@ def get_segment_categories(segment_id):
 def get_segment_sub_categories(segment_id):
     """API endpoint to get categories for a segment"""
     try:
-        segment = segments_collection.find_one({'_id': ObjectId(segment_id)})
+        segment = get_segment_catalog().get(segment_id)
         if segment:
             return jsonify({'sub_categories': segment.get('sub_categories', [])})
         return jsonify({'sub_categories': []})
@@ -1408,7 +1354,7 @@ def get_segment_sub_categories(segment_id):
 def get_segment_type(segment_id):
     """API endpoint to get categories for a segment"""
     try:
-        segment = segments_collection.find_one({'_id': ObjectId(segment_id)})
+        segment = get_segment_catalog().get(segment_id)
         if segment:
             return jsonify({'type': segment.get('type', '')})
         return jsonify({'type': ''})
@@ -1471,49 +1417,71 @@ def toggle_setting():
         {'$set': update_data},
         upsert=True
     )
+    invalidate_system_settings()
     
     return jsonify({'success': True, setting_name: new_value})
 
 
+@app.route('/api/cache-stats')
+@admin_required
+def api_cache_stats():
+    """API endpoint to inspect this worker's process-local cache counters"""
+    return jsonify({'success': True, 'pid': os.getpid(), 'caches': cache_stats()})
+
+
+@app.route('/api/http-metrics')
+@admin_required
+def api_http_metrics():
+    """API endpoint to inspect this worker's outbound HTTP latency per endpoint"""
+    return jsonify({'success': True, 'pid': os.getpid(), 'endpoints': http_metrics()})
+
+
 @app.route('/api/scan-user/<user_id>')
 @role_required('admin', 'executive', 'organizer', 'moderator')
 def get_user_by_scan(user_id):
     """Get user details by scanned ID"""
     try:
-        # Validate ObjectId
+        # Signed tickets are checked in memory; forged ones never reach the database.
+        # Plain ObjectId codes (ticket None) predate signing and are resolved below.
         try:
-            obj_id = ObjectId(user_id)
-        except:
+            obj_id, ticket = parse_scan(user_id)
+        except InvalidTicket:
             return jsonify({'success': False, 'message': 'Invalid QR code format'})
         
-        # Step 1: Try to find user
-        user = db.users.find_one({'_id': obj_id})
-        
-        # Step 2: If not user, try to find registration and get its user
-        if not user:
-            registration = db.registrations.find_one({'_id': obj_id})
-            if registration:
-                user = db.users.find_one({'_id': registration.get('user_id')})
-        
-        # Step 3: If still no user, try to find CA application and get its user
-        if not user:
-            ca_application = db.ca_registrations.find_one({'_id': obj_id})
-            if ca_application:
-                user = db.users.find_one({'_id': ca_application.get('user_id')})
-        
-        # Step 4: If still no user, return error
-        if not user:
+        # One round trip: resolve the scanned ID and join the user's registrations and CA applications
+        scan = resolve_scan(obj_id)
+        if not scan:
             return jsonify({'success': False, 'message': 'User not found'})
+        # A ticket admits the registrations / CA application it was issued for;
+        # a plain ObjectId code admits whatever document it names
+        scanned_ids = set(ticket['ref_ids']) if ticket else {obj_id}
         
-        # Get all registrations for this user
-        user_registrations = list(db.registrations.find(
-            {'user_id': user['_id']}
-        ).sort('registration_date', -1))
+        user = scan['user']
         
-        # Get all CA applications for this user
-        user_ca_applications = list(db.ca_registrations.find(
-            {'user_id': user['_id']}
-        ).sort('registration_date', -1))
+        def registration_data(reg):
+            return {
+                'id': str(reg['_id']),
+                'segment': reg.get('segment_name', ''),
+                'category': reg.get('category', ''),
+                'verified': reg.get('verified', False),
+                'present': reg.get('present', False),
+                'present_at': reg.get('present_at'),
+                'date': reg.get('registration_date'),
+                'transaction_id': reg.get('transaction_id', ''),
+                'bkash_number': reg.get('bkash_number', '')
+            }
+        
+        def ca_application_data(ca):
+            return {
+                'id': str(ca['_id']),
+                'ca_code': ca.get('ca_code', ''),
+                'status': ca.get('status', 'pending'),
+                'phone': ca.get('phone', ''),
+                'why_ca': ca.get('why_ca', ''),
+                'class': ca.get('class', ''),
+                'date': ca.get('registration_date'),
+                'profile_picture': ca.get('profile_picture')
+            }
         
         # Build response
         response_data = {
@@ -1532,63 +1500,25 @@ def get_user_by_scan(user_id):
                 'address': user.get('address', ''),
                 'created_at': user.get('created_at')
             },
-            'registrations': [
-                {
-                    'id': str(reg['_id']),
-                    'segment': reg.get('segment_name', ''),
-                    'category': reg.get('category', ''),
-                    'verified': reg.get('verified', False),
-                    'present': reg.get('present', False),
-                    'present_at': reg.get('present_at'),
-                    'date': reg.get('registration_date'),
-                    'transaction_id': reg.get('transaction_id', ''),
-                    'bkash_number': reg.get('bkash_number', '')
-                }
-                for reg in user_registrations
-            ],
-            'ca_applications': [
-                {
-                    'id': str(ca['_id']),
-                    'ca_code': ca.get('ca_code', ''),
-                    'status': ca.get('status', 'pending'),
-                    'phone': ca.get('phone', ''),
-                    'why_ca': ca.get('why_ca', ''),
-                    'class': ca.get('class', ''),
-                    'date': ca.get('registration_date'),
-                    'profile_picture': ca.get('profile_picture')
-                }
-                for ca in user_ca_applications
-            ]
+            'registrations': [registration_data(reg) for reg in scan['registrations']],
+            'ca_applications': [ca_application_data(ca) for ca in scan['ca_applications']]
         }
         
-        # Add current registration if this scan was for a registration
-        registration = db.registrations.find_one({'_id': obj_id})
-        if registration and str(registration.get('user_id')) == str(user['_id']):
-            response_data['current_registration'] = {
-                'id': str(registration['_id']),
-                'segment': registration.get('segment_name', ''),
-                'category': registration.get('category', ''),
-                'verified': registration.get('verified', False),
-                'present': registration.get('present', False),
-                'present_at': registration.get('present_at'),
-                'date': registration.get('registration_date'),
-                'transaction_id': registration.get('transaction_id', ''),
-                'bkash_number': registration.get('bkash_number', '')
+        if ticket:
+            response_data['ticket'] = {
+                'issued_at': ticket['issued_at'],
+                'ref_ids': [str(ref_id) for ref_id in ticket['ref_ids']]
             }
+        else:
+            response_data['legacy_code'] = True
         
-        # Add current CA application if this scan was for a CA application
-        ca_application = db.ca_registrations.find_one({'_id': obj_id})
-        if ca_application and str(ca_application.get('user_id')) == str(user['_id']):
-            response_data['current_ca_application'] = {
-                'id': str(ca_application['_id']),
-                'ca_code': ca_application.get('ca_code', ''),
-                'status': ca_application.get('status', 'pending'),
-                'phone': ca_application.get('phone', ''),
-                'why_ca': ca_application.get('why_ca', ''),
-                'class': ca_application.get('class', ''),
-                'date': ca_application.get('registration_date'),
-                'profile_picture': ca_application.get('profile_picture')
-            }
+        # Add the current registration / CA application if that is what was scanned
+        for reg in scan['registrations']:
+            if reg['_id'] in scanned_ids:
+                response_data['current_registration'] = registration_data(reg)
+        for ca in scan['ca_applications']:
+            if ca['_id'] in scanned_ids:
+                response_data['current_ca_application'] = ca_application_data(ca)
         
         return jsonify(response_data)
         
@@ -1606,22 +1536,48 @@ def mark_present(user_id):
         if not csrf_token:
             return jsonify({'success': False, 'message': 'CSRF token missing'}), 403
         
-        result = db.users.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$set': {
-                'present': True,
-                'present_at': datetime.utcnow()
-            }}
-        )
+        result = record_checkins([{'id': user_id}], default_gate=session.get('admin_email'))[0]
         
-        if result.modified_count > 0:
+        if result['status'] == 'checked_in':
             return jsonify({'success': True, 'message': 'Marked as present'})
+        elif result['status'] == 'duplicate':
+            return jsonify({'success': True, 'message': 'Already marked present', 'present_at': result['present_at'], 'gate': result['gate']})
         else:
             return jsonify({'success': False, 'message': 'Registration not found'})
             
     except Exception as e:
         return jsonify({'success': False, 'message': 'Error marking present'})
 
+@app.route('/api/mark-present', methods=['POST'])
+@role_required('admin', 'executive', 'organizer', 'moderator')
+def mark_present_batch():
+    """Sync check-ins queued by an offline scanner; the earliest scan of a person wins"""
+    data = request.json or {}
+    checkins = data.get('checkins', [])
+    if not isinstance(checkins, list) or len(checkins) > 500:
+        return jsonify({'success': False, 'message': 'Send up to 500 check-ins per batch'}), 400
+    
+    try:
+        results = record_checkins(checkins, default_gate=data.get('gate') or session.get('admin_email'))
+    except Exception as e:
+        print(f"Check-in sync error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Error syncing check-ins'}), 500
+    
+    return jsonify({'success': True, 'results': results})
+
+@app.route('/api/attendance/headcounts')
+@role_required('admin', 'executive', 'organizer', 'moderator')
+def attendance_headcounts():
+    """Live number of distinct people checked in to each segment"""
+    return jsonify({'success': True, 'headcounts': segment_headcounts()})
+
+@app.route('/api/scanner/manifest')
+@role_required('admin', 'executive', 'organizer', 'moderator')
+def scanner_manifest():
+    """Attendee manifest for offline scanning; pass ?since=<version> for changes only"""
+    since = request.args.get('since', type=int)
+    return jsonify(build_manifest(since))
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template('errors/404.html'), 404
@@ -0,0 +1,42 @@
+"""Fill in search_keys on registrations and CA registrations.
+
+Run once after deploying indexed search, and with --rebuild whenever
+utils/search.py changes which fields or tokens are indexed:
+
+    python backfill_search_keys.py [--rebuild] [--explain "search text"]
+
+--explain prints the winning query plan so you can confirm admin searches
+are served by an IXSCAN rather than a COLLSCAN.
+"""
+import argparse
+
+from pymongo import MongoClient
+
+import extensions
+from config import Config
+
+extensions.client = MongoClient(Config.MONGO_URI)
+extensions.db = extensions.client.festival_db
+
+from utils.search import SEARCH_FIELDS, backfill_search_keys, ensure_search_indexes, explain_search
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rebuild', action='store_true', help='recompute keys on every document')
+    parser.add_argument('--explain', metavar='SEARCH', help='print the query plan for a search')
+    args = parser.parse_args()
+
+    ensure_search_indexes()
+    for collection_name in SEARCH_FIELDS:
+        updated = backfill_search_keys(collection_name, rebuild=args.rebuild)
+        print(f"{collection_name}: {updated} document(s) updated")
+
+    if args.explain:
+        for collection_name in SEARCH_FIELDS:
+            stages = explain_search(collection_name, args.explain)
+            print(f"{collection_name} plan for {args.explain!r}: {' <- '.join(stages)}")
+
+
+if __name__ == '__main__':
+    main()
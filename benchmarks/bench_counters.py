@@ -0,0 +1,73 @@
+"""Registration throughput on one hot segment: a single counter vs sharded counters.
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/bench_counters.py [threads] [writes]
+
+Every thread increments the same segment's participant count, the worst
+case of a popular segment opening. The single-counter run does what
+registration did before: $inc current_participants on the segment
+document. The sharded runs call increment_participants with
+PARTICIPANT_COUNTER_SHARDS set to each shard count. Each run checks that
+no increment was lost. Uses a throwaway festival_counter_bench database on
+the MONGO_URI server and drops it again.
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+
+import extensions
+from config import Config
+from utils.participant_counters import _summed_counts, increment_participants
+
+DATABASE = 'festival_counter_bench'
+SEGMENT_ID = 'hot-segment'
+
+
+def single_counter(db):
+    db.segments.update_one({'_id': SEGMENT_ID}, {'$inc': {'current_participants': 1}}, upsert=True)
+
+
+def run(db, increment, threads, writes):
+    """Writes per second with `threads` concurrent writers, and the final count"""
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda _: increment(), range(threads)))  # open the pool's connections
+        db.segments.delete_many({})
+        db.segment_counters.delete_many({})
+        started = time.perf_counter()
+        list(pool.map(lambda _: increment(), range(writes)))
+        elapsed = time.perf_counter() - started
+    return writes / elapsed
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    writes = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    client = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017'), maxPoolSize=threads)
+    db = client[DATABASE]
+    client.drop_database(DATABASE)
+    extensions.client, extensions.db = client, db
+    try:
+        print(f"MongoDB {client.server_info()['version']}: {threads} threads, {writes} increments of one segment")
+
+        rate = run(db, lambda: single_counter(db), threads, writes)
+        count = db.segments.find_one({'_id': SEGMENT_ID})['current_participants']
+        assert count == writes, f'lost {writes - count} increments'
+        print(f"single document   {rate:10,.0f} writes/s")
+
+        for shards in (1, 4, 8, 16):
+            Config.PARTICIPANT_COUNTER_SHARDS = shards
+            rate = run(db, lambda: increment_participants(SEGMENT_ID), threads, writes)
+            count = _summed_counts().get(SEGMENT_ID, 0)
+            assert count == writes, f'lost {writes - count} increments'
+            print(f"{shards:2} shard(s)       {rate:10,.0f} writes/s")
+    finally:
+        client.drop_database(DATABASE)
+
+
+if __name__ == '__main__':
+    main()
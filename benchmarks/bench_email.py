@@ -0,0 +1,84 @@
+"""Per-message cost of building the verification email: cold, re-send and uncached.
+
+    python benchmarks/bench_email.py [messages]
+
+Renders and serializes registration verification emails through
+send_reg_verification_email with the SMTP pool replaced by a collector,
+so only template rendering, QR generation and MIME assembly are timed.
+"cold" is the first pass over fresh registrations, "re-send" repeats the
+same registrations (cached QR codes), and "uncached" clears the QR and
+logo caches before every message.
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bson import ObjectId
+from flask import Flask
+
+import utils.email_service as email_service
+from config import Config
+
+
+class CollectingPool:
+    """Stands in for the SMTP pool and keeps the serialized size of each message"""
+
+    def __init__(self):
+        self.sizes = []
+
+    def send_message(self, message):
+        self.sizes.append(len(message.as_bytes()))
+
+
+def registrations(count):
+    start = datetime(2025, 1, 1)
+    return [
+        {'_id': ObjectId(), 'user_id': ObjectId(), 'email': f'user{n}@example.com',
+         'full_name': f'Participant {n}', 'segment_name': 'সংগীত প্রতিযোগিতা',
+         'division_name': 'রবীন্দ্র সংগীত', 'registration_date': start + timedelta(minutes=n)}
+        for n in range(count)
+    ]
+
+
+def timed(documents, rounds=1, before_each=None):
+    """Milliseconds per message over `rounds` passes"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for document in documents:
+            if before_each:
+                before_each()
+            email_service.send_reg_verification_email(document, raise_errors=True)
+    return (time.perf_counter() - started) * 1000 / (len(documents) * rounds)
+
+
+def clear_caches():
+    email_service._qr_png.cache_clear()
+    email_service._logo_part.cache_clear()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    os.chdir(ROOT)  # the logo is read relative to the working directory
+    app = Flask(__name__, template_folder=os.path.join(ROOT, 'templates'))
+    app.config.from_object(Config)
+    app.config['MAIL_DEFAULT_SENDER'] = 'noreply@example.com'
+    pool = CollectingPool()
+    email_service.get_smtp_pool = lambda config: pool
+
+    documents = registrations(count)
+    with app.app_context():
+        email_service.send_reg_verification_email(registrations(1)[0])  # compile the template
+        clear_caches()
+        print(f"cold      {timed(documents):6.2f} ms/msg")
+        print(f"re-send   {timed(documents, rounds=3):6.2f} ms/msg")
+        print(f"uncached  {timed(documents, before_each=clear_caches):6.2f} ms/msg")
+    print(f"message {pool.sizes[-1]} bytes, QR attachment {len(email_service.ticket_qr_png(documents[0]))} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Time and peak memory of the registration exports at 10k, 100k and 500k rows.
+
+    python benchmarks/bench_export.py [rows ...] [--no-baseline] [--no-xlsx]
+
+Runs on synthetic registration documents generated on the fly, the way a
+batched Mongo cursor hands them over, so no database is needed. For each
+size it measures the streamed CSV (time to first byte, total time, peak
+RSS) and the write-only XLSX spool. The baseline is the old approach:
+materialize every row, build a pandas DataFrame and render it in one go.
+Each measurement runs in a fresh process so peak RSS is its own; "base"
+is the RSS of a process that only imported the modules.
+"""
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+
+from utils.export_service import REGISTRATION_COLUMNS, iter_csv, safe_str, write_xlsx
+
+SIZES = (10000, 100000, 500000)
+
+
+def registrations(count):
+    now = datetime.utcnow()
+    for n in range(count):
+        yield {
+            '_id': ObjectId(), 'full_name': f'Participant {n}', 'email': f'user{n}@example.com',
+            'institution': 'Notre Dame College', 'segment_name': 'সংগীত প্রতিযোগিতা', 'category': 'HS',
+            'division_name': 'রবীন্দ্র সংগীত', 'submission_link': None, 'ca_ref': 'ABCD',
+            'bkash_number': '01700000000', 'transaction_id': f'TX{n:08d}',
+            'receipt': 'https://res.cloudinary.com/demo/image/upload/v1/receipt_pictures/abc.jpg',
+            'verified': n % 2 == 0, 'registration_date': now, 'verified_at': None,
+            'firebase_uid': f'uid{n}', 'ip_address': '10.0.0.1'
+        }
+
+
+def pandas_csv(count):
+    """The pre-streaming export: every row in memory, then one DataFrame.to_csv"""
+    import pandas as pd
+
+    rows = [
+        {header: formatter(doc.get(field)) if formatter else safe_str(doc.get(field))
+         for header, field, formatter in REGISTRATION_COLUMNS}
+        for doc in registrations(count)
+    ]
+    output = io.StringIO()
+    pd.DataFrame(rows).to_csv(output, index=False)
+    yield ('\ufeff' + output.getvalue()).encode('utf-8')
+
+
+def streamed_csv(count):
+    return iter_csv(registrations(count), REGISTRATION_COLUMNS)
+
+
+def xlsx(count):
+    with tempfile.TemporaryFile() as output:
+        write_xlsx(registrations(count), REGISTRATION_COLUMNS, 'Registrations', output)
+        yield b'x' * output.tell()
+
+
+def measure(chunks):
+    """(seconds to first chunk, total seconds, bytes) while draining `chunks`"""
+    started = time.perf_counter()
+    first_byte = None
+    size = 0
+    for chunk in chunks:
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        size += len(chunk)
+    return first_byte, time.perf_counter() - started, size
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+EXPORTS = {'pandas csv': pandas_csv, 'csv': streamed_csv, 'xlsx': xlsx}
+
+
+def run_one(name, count):
+    """Child process: run one export and print its numbers on one line"""
+    if name == 'pandas csv':
+        import pandas  # noqa: F401 -- imported up front so base RSS compares like with like
+    if count:
+        first_byte, elapsed, size = measure(EXPORTS[name](count))
+    else:
+        first_byte, elapsed, size = 0, 0, 0
+    print(first_byte, elapsed, size, peak_rss_mib())
+
+
+def spawn(name, count):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run', name, str(count)],
+        check=True, capture_output=True, text=True
+    ).stdout.split()
+    return [float(value) for value in output]
+
+
+def main():
+    if sys.argv[1:2] == ['--run']:
+        run_one(sys.argv[2], int(sys.argv[3]))
+        return
+
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    sizes = [int(arg) for arg in args] or SIZES
+    names = ['csv']
+    if '--no-baseline' not in sys.argv:
+        names.insert(0, 'pandas csv')
+    if '--no-xlsx' not in sys.argv:
+        names.append('xlsx')
+
+    for name in names:
+        print(f"{name:10}  base RSS {spawn(name, 0)[3]:.1f} MiB")
+    for count in sizes:
+        for name in names:
+            first_byte, elapsed, size, peak = spawn(name, count)
+            print(f"{count:>7} rows  {name:10}  first byte {first_byte * 1000:9.1f} ms  "
+                  f"total {elapsed:7.2f} s  peak RSS {peak:8.1f} MiB  {size / 2 ** 20:7.1f} MiB out")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Registration burst: commit_registration vs the old three independent writes.
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/bench_registration.py [threads] [registrations]
+
+Fires `registrations` registrations at one segment from `threads`
+concurrent writers, as when a popular segment opens, and reports
+throughput and p50/p99 latency per registration. commit_registration runs
+in a transaction on a replica set or sharded cluster and as ordered
+writes with compensation on a standalone server; the report says which.
+Each run checks that every registration was counted and linked. Uses a
+throwaway festival_registration_bench database and drops it again.
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+import extensions
+from utils.participant_counters import _summed_counts
+from utils.registration_commit import commit_registration, transactions_supported
+
+DATABASE = 'festival_registration_bench'
+
+
+def registration(user_id, segment_id, n):
+    return {'user_id': user_id, 'segment_id': segment_id, 'segment_name': 'Bench', 'category': 'HS',
+            'transaction_id': f'TX{n:09d}', 'verified': False, 'registration_date': datetime.utcnow()}
+
+
+def old_register(db, doc):
+    """What register() did before commit_registration"""
+    db.registrations.insert_one(doc)
+    db.segments.update_one({'_id': doc['segment_id']}, {'$inc': {'current_participants': 1}})
+    db.users.update_one({'_id': doc['user_id']}, {'$push': {'registrations': doc['_id']}})
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def burst(db, register, threads, count):
+    for collection in ('registrations', 'segments', 'segment_counters', 'users'):
+        db[collection].delete_many({})
+    segment_id = db.segments.insert_one({'name': 'Bench', 'current_participants': 0}).inserted_id
+    user_ids = db.users.insert_many([{'full_name': f'User {n}'} for n in range(count)]).inserted_ids
+
+    def one(n):
+        started = time.perf_counter()
+        register(registration(user_ids[n], segment_id, n))
+        return (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        started = time.perf_counter()
+        latencies = list(pool.map(one, range(count)))
+        elapsed = time.perf_counter() - started
+
+    assert db.registrations.count_documents({}) == count
+    assert db.users.count_documents({'registrations.0': {'$exists': True}}) == count
+    return count / elapsed, percentiles(latencies), segment_id
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    client = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017'), maxPoolSize=threads)
+    db = client[DATABASE]
+    client.drop_database(DATABASE)
+    extensions.client, extensions.db = client, db
+    try:
+        db.registrations.create_index([('transaction_id', 1)], unique=True, sparse=True)
+        mode = 'transaction' if transactions_supported() else 'standalone, compensating writes'
+        print(f"MongoDB {client.server_info()['version']} ({mode}): {count} registrations, {threads} threads")
+
+        for name, register in (('old writes', lambda doc: old_register(db, doc)),
+                               ('commit_registration', commit_registration)):
+            rate, (p50, p99), segment_id = burst(db, register, threads, count)
+            counted = (db.segments.find_one({'_id': segment_id})['current_participants']
+                       if name == 'old writes' else _summed_counts().get(segment_id, 0))
+            assert counted == count, f'{name}: counted {counted} of {count}'
+            print(f"{name:20} {rate:8,.0f} reg/s  p50 {p50:6.2f} ms  p99 {p99:6.2f} ms")
+    finally:
+        client.drop_database(DATABASE)
+
+
+if __name__ == '__main__':
+    main()
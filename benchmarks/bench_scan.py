@@ -0,0 +1,107 @@
+"""p50/p99 latency of resolving a gate scan: one aggregation vs the old lookups.
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/bench_scan.py [users] [scans]
+
+Seeds a throwaway festival_scan_bench database on the MONGO_URI server
+(MongoDB 4.4+, for $unionWith), times both paths for the same scans and
+drops the database again. Latency is dominated by round trips, so run it
+against a server at the production network distance.
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+import extensions
+from utils.scan import resolve_scan
+
+DATABASE = 'festival_scan_bench'
+
+
+def seed(db, user_count):
+    users, registrations, cas = [], [], []
+    start = datetime(2025, 1, 1)
+    for n in range(user_count):
+        user_id = ObjectId()
+        users.append({'_id': user_id, 'full_name': f'User {n}', 'email': f'user{n}@example.com',
+                      'mobile': f'017{n:08d}', 'institution': 'NDC', 'present': False})
+        for k in range(random.choice((1, 1, 2, 3))):
+            registrations.append({'_id': ObjectId(), 'user_id': user_id, 'segment_name': f'Segment {k}',
+                                  'category': 'HS', 'verified': True,
+                                  'registration_date': start + timedelta(minutes=n + k)})
+        if n % 20 == 0:
+            cas.append({'_id': ObjectId(), 'user_id': user_id, 'ca_code': f'C{n:06d}', 'status': 'approved',
+                        'registration_date': start + timedelta(minutes=n)})
+    db.users.insert_many(users)
+    db.registrations.insert_many(registrations)
+    db.ca_registrations.insert_many(cas)
+    db.registrations.create_index([('user_id', 1)])
+    db.ca_registrations.create_index([('user_id', 1)])
+    return users, registrations
+
+
+def old_resolve(db, obj_id):
+    """The lookups /api/scan-user made before resolve_scan"""
+    user = db.users.find_one({'_id': obj_id})
+    if not user:
+        registration = db.registrations.find_one({'_id': obj_id})
+        if registration:
+            user = db.users.find_one({'_id': registration.get('user_id')})
+    if not user:
+        ca_application = db.ca_registrations.find_one({'_id': obj_id})
+        if ca_application:
+            user = db.users.find_one({'_id': ca_application.get('user_id')})
+    if not user:
+        return None
+    list(db.registrations.find({'user_id': user['_id']}).sort('registration_date', -1))
+    list(db.ca_registrations.find({'user_id': user['_id']}).sort('registration_date', -1))
+    db.registrations.find_one({'_id': obj_id})
+    db.ca_registrations.find_one({'_id': obj_id})
+    return user
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+def main():
+    user_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    scan_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    client = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017'))
+    db = client[DATABASE]
+    client.drop_database(DATABASE)
+    extensions.client, extensions.db = client, db
+    try:
+        users, registrations = seed(db, user_count)
+        version = client.server_info()['version']
+        print(f"MongoDB {version}: {len(users)} users, {len(registrations)} registrations")
+
+        # Tickets carry the user id; legacy plain-ObjectId codes are usually registration ids
+        scans = {
+            'user id': [random.choice(users)['_id'] for _ in range(scan_count)],
+            'registration id': [random.choice(registrations)['_id'] for _ in range(scan_count)],
+        }
+        for kind, ids in scans.items():
+            for name, fn in (('old lookups', lambda i: old_resolve(db, i)), ('resolve_scan', resolve_scan)):
+                fn(ids[0])  # warm up the connection and plan cache
+                samples = []
+                for obj_id in ids:
+                    started = time.perf_counter()
+                    fn(obj_id)
+                    samples.append((time.perf_counter() - started) * 1000)
+                p50, p99 = percentiles(samples)
+                print(f"{kind:16} {name:13} p50 {p50:6.2f} ms  p99 {p99:6.2f} ms")
+    finally:
+        client.drop_database(DATABASE)
+
+
+if __name__ == '__main__':
+    main()
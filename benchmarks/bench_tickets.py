@@ -0,0 +1,34 @@
+"""Throughput of signing and verifying entry tickets.
+
+    python benchmarks/bench_tickets.py [iterations]
+
+Needs no database: tickets are checked in memory with the public key.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+
+from utils.tickets import parse_scan, sign_ticket, verify_ticket
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    user_id, registration_id = ObjectId(), ObjectId()
+    token = sign_ticket(user_id, [registration_id])
+    print(f"ticket: {len(token)} characters")
+
+    for name, fn in [
+        ('sign_ticket', lambda: sign_ticket(user_id, [registration_id])),
+        ('verify_ticket', lambda: verify_ticket(token)),
+        ('parse_scan', lambda: parse_scan(token)),
+    ]:
+        seconds = timeit.timeit(fn, number=iterations)
+        print(f"{name:14} {iterations / seconds:>10,.0f}/s  {seconds / iterations * 1e6:7.1f} us each")
+
+
+if __name__ == '__main__':
+    main()
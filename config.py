@@ -8,12 +8,27 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     
     # MongoDB Configuration
+    # Requires MongoDB 4.4 or later (gate scans resolve with $unionWith, see utils/scan.py)
     MONGO_URI = os.environ.get('MONGO_URI') or 'mongodb://localhost:27017/festival_db'
     
     # Admin JWT Configuration
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-key-change-in-production'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     
+    # Process-local caches (seconds before a worker revalidates against MongoDB)
+    SETTINGS_CACHE_TTL = int(os.environ.get('SETTINGS_CACHE_TTL', 5))
+    SEGMENT_CATALOG_TTL = int(os.environ.get('SEGMENT_CATALOG_TTL', 60))
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL', 60))
+    
+    # Outbound HTTP (Firebase REST APIs)
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+    HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 2))
+    HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.2))
+    HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 4))
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))
+    HTTP_HTTP2 = os.environ.get('HTTP_HTTP2', 'true').lower() == 'true'
+    
     # SMTP Configuration
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
     MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
@@ -22,6 +37,64 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_API = os.environ.get('MAIL_API')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
+    MAIL_POOL_SIZE = int(os.environ.get('MAIL_POOL_SIZE', 3))
+    MAIL_POOL_IDLE_TIMEOUT = int(os.environ.get('MAIL_POOL_IDLE_TIMEOUT', 60))
+    MAIL_MAX_MESSAGES_PER_CONNECTION = int(os.environ.get('MAIL_MAX_MESSAGES_PER_CONNECTION', 100))
+    MAIL_RATE_LIMIT = float(os.environ.get('MAIL_RATE_LIMIT', 5))  # messages per second, 0 = unlimited
+    QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE', 2048))
+    # Ed25519 seed (32 bytes, base64url) for entry tickets; derived from SECRET_KEY if unset
+    QR_TICKET_KEY = os.environ.get('QR_TICKET_KEY')
+    # HMAC key of the v1 tickets already emailed, verified until they are out of circulation
+    QR_SIGNING_KEY = os.environ.get('QR_SIGNING_KEY') or SECRET_KEY
+    # Accept plain ObjectId codes from emails sent before tickets were signed
+    QR_ACCEPT_LEGACY_CODES = os.environ.get('QR_ACCEPT_LEGACY_CODES', 'true').lower() == 'true'
+    
+    # Email outbox (drained by email_worker.py)
+    EMAIL_WORKER_CONCURRENCY = int(os.environ.get('EMAIL_WORKER_CONCURRENCY', 3))
+    EMAIL_WORKER_BATCH_SIZE = int(os.environ.get('EMAIL_WORKER_BATCH_SIZE', 50))
+    EMAIL_WORKER_POLL_INTERVAL = float(os.environ.get('EMAIL_WORKER_POLL_INTERVAL', 2))
+    EMAIL_OUTBOX_LEASE_SECONDS = int(os.environ.get('EMAIL_OUTBOX_LEASE_SECONDS', 120))
+    EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+    EMAIL_OUTBOX_BACKOFF_SECONDS = int(os.environ.get('EMAIL_OUTBOX_BACKOFF_SECONDS', 30))
+    EMAIL_OUTBOX_MAX_BACKOFF_SECONDS = int(os.environ.get('EMAIL_OUTBOX_MAX_BACKOFF_SECONDS', 900))
+    
+    # Export jobs (run by export_worker.py, files kept in GridFS)
+    EXPORT_WORKER_POLL_INTERVAL = float(os.environ.get('EXPORT_WORKER_POLL_INTERVAL', 2))
+    EXPORT_JOB_LEASE_SECONDS = int(os.environ.get('EXPORT_JOB_LEASE_SECONDS', 300))
+    EXPORT_PROGRESS_EVERY = int(os.environ.get('EXPORT_PROGRESS_EVERY', 1000))
+    EXPORT_REUSE_SECONDS = int(os.environ.get('EXPORT_REUSE_SECONDS', 300))
+    EXPORT_RETENTION_SECONDS = int(os.environ.get('EXPORT_RETENTION_SECONDS', 6 * 3600))
+    
+    # Dashboard stats snapshot (refreshed by scheduler.py)
+    DASHBOARD_SNAPSHOT_INTERVAL = int(os.environ.get('DASHBOARD_SNAPSHOT_INTERVAL', 15))
+    DASHBOARD_SNAPSHOT_MAX_AGE = int(os.environ.get('DASHBOARD_SNAPSHOT_MAX_AGE', 120))
+    ANALYTICS_RECONCILE_INTERVAL = int(os.environ.get('ANALYTICS_RECONCILE_INTERVAL', 600))
+    
+    # Segment participant counters, spread over shard documents per segment
+    PARTICIPANT_COUNTER_SHARDS = int(os.environ.get('PARTICIPANT_COUNTER_SHARDS', 8))
+    PARTICIPANT_COUNT_TTL = int(os.environ.get('PARTICIPANT_COUNT_TTL', 5))
+    PARTICIPANT_RECONCILE_INTERVAL = int(os.environ.get('PARTICIPANT_RECONCILE_INTERVAL', 300))
+    
+    # Image uploads (browser uploads straight to storage with a signed ticket);
+    # UPLOAD_BACKEND=local stores files under LOCAL_UPLOAD_DIR instead of Cloudinary
+    UPLOAD_BACKEND = os.environ.get('UPLOAD_BACKEND', 'cloudinary')
+    LOCAL_UPLOAD_DIR = os.environ.get('LOCAL_UPLOAD_DIR', 'local_uploads')
+    UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 2 * 1024 * 1024))
+    UPLOAD_TICKET_TTL = int(os.environ.get('UPLOAD_TICKET_TTL', 600))
+    UPLOAD_REFERENCE_MAX_AGE = int(os.environ.get('UPLOAD_REFERENCE_MAX_AGE', 24 * 3600))
+    
+    # Uploaded images are re-encoded by image_worker.py (stripped of EXIF, downsized, thumbnailed)
+    IMAGE_MAX_EDGE = int(os.environ.get('IMAGE_MAX_EDGE', 1600))
+    IMAGE_THUMB_EDGE = int(os.environ.get('IMAGE_THUMB_EDGE', 240))
+    IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+    IMAGE_OUTPUT_FORMAT = os.environ.get('IMAGE_OUTPUT_FORMAT', 'WEBP')
+    IMAGE_MIN_EDGE = int(os.environ.get('IMAGE_MIN_EDGE', 64))
+    IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 40_000_000))
+    IMAGE_KEEP_ORIGINALS = os.environ.get('IMAGE_KEEP_ORIGINALS', 'false').lower() == 'true'
+    IMAGE_WORKER_PROCESSES = int(os.environ.get('IMAGE_WORKER_PROCESSES', 2))
+    IMAGE_WORKER_POLL_INTERVAL = float(os.environ.get('IMAGE_WORKER_POLL_INTERVAL', 2))
+    IMAGE_JOB_LEASE_SECONDS = int(os.environ.get('IMAGE_JOB_LEASE_SECONDS', 120))
+    IMAGE_JOB_MAX_ATTEMPTS = int(os.environ.get('IMAGE_JOB_MAX_ATTEMPTS', 3))
     
     # Security
     SESSION_COOKIE_HTTPONLY = True
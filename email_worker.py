@@ -0,0 +1,61 @@
+"""Background worker that drains the email outbox.
+
+Run alongside the web process (see Procfile):
+
+    python email_worker.py
+"""
+import signal
+import threading
+
+from flask import Flask
+from pymongo import MongoClient
+
+import extensions
+from config import Config
+
+worker_app = Flask(__name__)
+worker_app.config.from_object(Config)
+
+extensions.client = MongoClient(worker_app.config['MONGO_URI'])
+extensions.db = extensions.client.festival_db
+
+from utils.email_outbox import apply_pending_side_effects, claim_jobs, ensure_outbox_indexes, process_jobs
+
+stop_event = threading.Event()
+
+
+def drain_outbox():
+    """Claim and send batches until asked to stop, sleeping while the queue is empty"""
+    with worker_app.app_context():
+        while not stop_event.is_set():
+            jobs = claim_jobs(Config.EMAIL_WORKER_BATCH_SIZE)
+            if not jobs:
+                try:
+                    apply_pending_side_effects()
+                except Exception as e:
+                    print(f"Outbox side effects failed: {e}")
+                stop_event.wait(Config.EMAIL_WORKER_POLL_INTERVAL)
+                continue
+            try:
+                process_jobs(jobs)
+            except Exception as e:
+                # Leave the jobs leased; they are retried once the lease expires
+                print(f"Outbox batch of {len(jobs)} failed: {e}")
+
+
+def main():
+    ensure_outbox_indexes()
+
+    def _stop(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    print(f"Email worker started: batches of {Config.EMAIL_WORKER_BATCH_SIZE}, "
+          f"{Config.EMAIL_WORKER_CONCURRENCY} concurrent sends")
+    drain_outbox()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Background worker that builds queued admin exports into GridFS.
+
+Run alongside the web process (see Procfile):
+
+    python export_worker.py
+"""
+import signal
+import threading
+
+from flask import Flask
+from pymongo import MongoClient
+
+import extensions
+from config import Config
+
+worker_app = Flask(__name__)
+worker_app.config.from_object(Config)
+
+extensions.client = MongoClient(worker_app.config['MONGO_URI'])
+extensions.db = extensions.client.festival_db
+
+from utils.export_jobs import claim_export_job, ensure_export_indexes, purge_expired_exports, run_export_job
+
+stop_event = threading.Event()
+
+
+def run_exports():
+    """Build exports one at a time until asked to stop, purging old files while idle"""
+    with worker_app.app_context():
+        while not stop_event.is_set():
+            job = claim_export_job()
+            if not job:
+                try:
+                    purge_expired_exports()
+                except Exception as e:
+                    print(f"Export purge failed: {e}")
+                stop_event.wait(Config.EXPORT_WORKER_POLL_INTERVAL)
+                continue
+            try:
+                run_export_job(job)
+            except Exception as e:
+                print(f"Export job {job['_id']} failed: {e}")
+
+
+def main():
+    ensure_export_indexes()
+
+    def _stop(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    print("Export worker started")
+    run_exports()
+
+
+if __name__ == '__main__':
+    main()
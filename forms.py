@@ -1,7 +1,6 @@
 from flask_wtf import FlaskForm
 from wtforms import BooleanField, StringField, PasswordField, SelectField, RadioField, TextAreaField, HiddenField, SubmitField
 from wtforms.validators import DataRequired, Email, Length, Regexp, Optional, EqualTo, URL
-from flask_wtf.file import FileField, FileAllowed
 from wtforms.widgets import TextArea
 
 class RegistrationForm(FlaskForm):
@@ -54,10 +53,8 @@ class RegistrationForm(FlaskForm):
         Length(min=5, max=15)
     ])
     
-    receipt = FileField('Bkash Receipt Screenshot', validators=[
-        FileAllowed(['jpg', 'jpeg', 'png'], 'Images only! (jpg, jpeg, png)'),
-        Optional()
-    ])
+    # Asset reference of the receipt, uploaded by the browser straight to storage
+    receipt_ref = HiddenField('Bkash Receipt Screenshot')
     
     submit = SubmitField('Register')
     # Hidden fields for bot prevention
@@ -97,9 +94,9 @@ class CARegistrationForm(FlaskForm):
         Length(min=20, max=1000)
     ], widget=TextArea(), render_kw={"rows": 6})
     
-    profile_picture = FileField('Profile Picture', validators=[
-        FileAllowed(['jpg', 'jpeg', 'png'], 'Images only! (jpg, jpeg, png)'),
-        DataRequired()
+    # Asset reference of the picture, uploaded by the browser straight to storage
+    profile_picture_ref = HiddenField('Profile Picture', validators=[
+        DataRequired(message='Profile picture is required')
     ])
     
     submit = SubmitField('Apply as CA')
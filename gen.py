@@ -557,4 +557,7 @@ def genrerate_segs(uri):
 
 
     segments_collection = db.segments
-    segments_collection.insert_many(segments)
\ No newline at end of file
+    segments_collection.insert_many(segments)
+
+    from utils.segment_catalog import invalidate_segment_catalog
+    invalidate_segment_catalog()
\ No newline at end of file
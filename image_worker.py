@@ -0,0 +1,60 @@
+"""Background worker that normalizes uploaded images (receipts, CA pictures).
+
+Run alongside the web process (see Procfile):
+
+    python image_worker.py
+
+Images are decoded and re-encoded in a pool of IMAGE_WORKER_PROCESSES
+processes, so one large photo does not hold up the rest of the queue.
+"""
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import Flask
+from pymongo import MongoClient
+
+import extensions
+from config import Config
+
+worker_app = Flask(__name__)
+worker_app.config.from_object(Config)
+
+extensions.client = MongoClient(worker_app.config['MONGO_URI'])
+extensions.db = extensions.client.festival_db
+
+from utils.image_jobs import claim_image_jobs, ensure_image_indexes, process_image_jobs
+
+stop_event = threading.Event()
+
+
+def run_image_jobs(pool):
+    """Claim jobs in batches sized to the pool until asked to stop"""
+    with worker_app.app_context():
+        while not stop_event.is_set():
+            jobs = claim_image_jobs(Config.IMAGE_WORKER_PROCESSES * 2)
+            if not jobs:
+                stop_event.wait(Config.IMAGE_WORKER_POLL_INTERVAL)
+                continue
+            try:
+                process_image_jobs(jobs, pool)
+            except Exception as e:
+                print(f"Image batch failed: {e}")
+
+
+def main():
+    ensure_image_indexes()
+
+    def _stop(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    print("Image worker started")
+    with ProcessPoolExecutor(max_workers=Config.IMAGE_WORKER_PROCESSES) as pool:
+        run_image_jobs(pool)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Background process that runs periodic maintenance tasks.
+
+Run alongside the web process (see Procfile):
+
+    python scheduler.py
+"""
+import signal
+import threading
+import time
+
+from flask import Flask
+from pymongo import MongoClient
+
+import extensions
+from config import Config
+
+scheduler_app = Flask(__name__)
+scheduler_app.config.from_object(Config)
+
+extensions.client = MongoClient(scheduler_app.config['MONGO_URI'])
+extensions.db = extensions.client.festival_db
+
+from utils.participant_counters import reconcile_participant_counts
+from utils.rollups import reconcile_rollups
+from utils.stats import refresh_dashboard_snapshot
+
+stop_event = threading.Event()
+
+# (name, interval in seconds, task)
+PERIODIC_TASKS = [
+    ('dashboard_snapshot', Config.DASHBOARD_SNAPSHOT_INTERVAL, refresh_dashboard_snapshot),
+    ('analytics_reconcile', Config.ANALYTICS_RECONCILE_INTERVAL, reconcile_rollups),
+    ('participant_reconcile', Config.PARTICIPANT_RECONCILE_INTERVAL, reconcile_participant_counts),
+]
+
+
+def run_periodic_tasks():
+    """Run each task whenever its interval has elapsed until asked to stop"""
+    next_run = {name: 0.0 for name, _, _ in PERIODIC_TASKS}
+    with scheduler_app.app_context():
+        while not stop_event.is_set():
+            for name, interval, task in PERIODIC_TASKS:
+                if time.monotonic() < next_run[name]:
+                    continue
+                try:
+                    task()
+                except Exception as e:
+                    print(f"Scheduled task {name} failed: {e}")
+                next_run[name] = time.monotonic() + interval
+            stop_event.wait(max(0.0, min(next_run.values()) - time.monotonic()))
+
+
+def main():
+    def _stop(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    print(f"Scheduler started: {', '.join(name for name, _, _ in PERIODIC_TASKS)}")
+    run_periodic_tasks()
+
+
+if __name__ == '__main__':
+    main()
@@ -54,4 +54,69 @@ Array.from(document.getElementsByClassName('jb-notification-dismiss')).forEach(f
   el.addEventListener('click', function (e) {
     e.currentTarget.closest('.notification').classList.add('is-hidden');
   });
-});
\ No newline at end of file
+});
+/* Email outbox: poll queued jobs until they are sent, dead-lettered or cancelled.
+   Retries back off for minutes, so polling slows down and gives up after
+   EMAIL_POLL_LIMIT requests, reporting timedOut; the worker keeps sending. */
+
+var EMAIL_POLL_LIMIT = 40;
+
+function pollEmailJobs(jobIds, onProgress, onDone) {
+  var csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+  var polls = 0;
+  var poll = function () {
+    polls += 1;
+    fetch('/admin/email-jobs', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'X-CSRFToken': csrfToken
+      },
+      body: JSON.stringify({ job_ids: jobIds })
+    })
+      .then(function (response) { return response.json(); })
+      .then(function (data) {
+        if (!data.success) {
+          onDone(data);
+          return;
+        }
+        if (onProgress) {
+          onProgress(data);
+        }
+        if (data.pending > 0 && polls < EMAIL_POLL_LIMIT) {
+          setTimeout(poll, Math.min(2000 * Math.ceil(polls / 10), 8000));
+        } else {
+          data.timedOut = data.pending > 0;
+          onDone(data);
+        }
+      })
+      .catch(function () {
+        onDone({ success: false, timedOut: true, pending: jobIds.length, sent: 0, dead: 0, jobs: [] });
+      });
+  };
+  poll();
+}
+
+/* Export jobs: poll a background export until its file is ready */
+
+function pollExportJob(jobId, onProgress, onDone) {
+  var poll = function () {
+    fetch('/admin/export-jobs/' + jobId)
+      .then(function (response) { return response.json(); })
+      .then(function (data) {
+        if (!data.success) {
+          onDone(data);
+          return;
+        }
+        if (onProgress) {
+          onProgress(data.job);
+        }
+        if (data.job.status === 'queued' || data.job.status === 'running') {
+          setTimeout(poll, 2000);
+        } else {
+          onDone(data);
+        }
+      });
+  };
+  poll();
+}
@@ -306,4 +306,54 @@ function togglePasswordVisibility(inputId) {
         icon.classList.remove('fa-eye-slash');
         icon.classList.add('fa-eye');
     }
-}
\ No newline at end of file
+}
+
+// ========================================
+// Direct Uploads
+// ========================================
+// Uploads an image straight to storage with a signed ticket from the server,
+// then stores the signed result in a hidden field so the form only submits
+// the asset reference.
+function bindDirectUpload({ input, refInput, kind, form, onStatus }) {
+  const submit = form.querySelector('[type="submit"]');
+  const csrfToken = (form.querySelector('input[name="csrf_token"]') || {}).value;
+
+  input.addEventListener('change', function () {
+    refInput.value = '';
+    const file = this.files && this.files[0];
+    if (!file) return;
+
+    submit.disabled = true;
+    onStatus('uploading', file);
+
+    fetch('/api/upload-ticket', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrfToken },
+      body: JSON.stringify({ kind: kind })
+    })
+      .then(res => res.json())
+      .then(ticket => {
+        if (!ticket.success) throw new Error(ticket.message);
+        if (file.size > ticket.max_bytes) throw new Error('File size too large');
+
+        const body = new FormData();
+        Object.entries(ticket.fields).forEach(([key, value]) => body.append(key, value));
+        body.append('file', file);
+
+        return fetch(ticket.url, { method: 'POST', body: body })
+          .then(res => res.json())
+          .then(result => {
+            if (result.error) throw new Error(result.error.message);
+            refInput.value = JSON.stringify({
+              ticket: ticket.ticket,
+              version: result.version,
+              signature: result.signature,
+              bytes: result.bytes
+            });
+            onStatus('done', file);
+          });
+      })
+      .catch(err => onStatus('error', file, err.message))
+      .finally(() => { submit.disabled = false; });
+  });
+}
@@ -0,0 +1,47 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# Tests import the app's modules the way the processes in the Procfile do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    """A throwaway database set as extensions.db.
+
+    Uses the MongoDB at TEST_MONGO_URI when set, otherwise mongomock with
+    each collection call serialized (mongomock is not thread-safe; a real
+    server is needed to exercise true parallelism).
+    """
+    import extensions
+
+    uri = os.environ.get('TEST_MONGO_URI')
+    if uri:
+        from pymongo import MongoClient
+        client = MongoClient(uri)
+        db = client[f'festival_test_{os.getpid()}']
+    else:
+        mongomock = pytest.importorskip('mongomock')
+        client = mongomock.MongoClient()
+        db = client.festival_test
+        # mongomock predates the `sort` option pymongo now passes for bulk updates
+        add_update = mongomock.collection.BulkOperationBuilder.add_update
+        monkeypatch.setattr(mongomock.collection.BulkOperationBuilder, 'add_update',
+                            lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs))
+        lock = threading.RLock()
+        for name in ('find_one_and_update', 'insert_one', 'bulk_write', 'find', 'update_one'):
+            original = getattr(mongomock.Collection, name)
+
+            def locked(self, *args, _original=original, **kwargs):
+                with lock:
+                    return _original(self, *args, **kwargs)
+            monkeypatch.setattr(mongomock.Collection, name, locked)
+
+    monkeypatch.setattr(extensions, 'client', client)
+    monkeypatch.setattr(extensions, 'db', db)
+    yield db
+    if uri:
+        client.drop_database(db.name)
@@ -0,0 +1,44 @@
+"""CA code allocation under concurrent signups"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo.errors import DuplicateKeyError
+
+from utils.ca_codes import allocate_ca_code, ensure_ca_code_counters
+
+# Four-word names always derive the same base code, so every signup after
+# the first contends on the same two-letter prefix counter
+NAMES = ['Ann Bob Carl Dan'] * 150 + ['Eve Fay Gus Hal'] * 60 + ['Ivy Jon Kim Lee'] * 60 + \
+        ['Mia Ned Oli Pam'] * 60 + ['Quinn Rob Sam Tom'] * 60
+
+
+def _signup(db, name):
+    code = allocate_ca_code(name)
+    try:
+        db.ca_registrations.insert_one({'full_name': name, 'ca_code': code})
+    except DuplicateKeyError:
+        return code, False
+    return code, True
+
+
+def test_parallel_allocations_are_unique(mongo_db):
+    mongo_db.ca_registrations.create_index([('ca_code', 1)], unique=True)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda name: _signup(mongo_db, name), NAMES))
+
+    codes = [code for code, _ in results]
+    assert [code for code, count in Counter(codes).items() if count > 1] == []
+    assert all(inserted for _, inserted in results)
+    assert all(len(code) == 4 for code in codes)
+    assert {'ABCD', 'EFGH', 'IJKL', 'MNOP', 'QRST'} <= set(codes)
+    # The contended prefix hands out AB01..AB99, then falls back to A + random letters
+    assert sum(code[:2] == 'AB' and code[2:].isdigit() for code in codes) == 99
+
+
+def test_counters_account_for_existing_codes(mongo_db):
+    mongo_db.ca_registrations.insert_many([{'ca_code': 'ABCD'}, {'ca_code': 'AB07'}])
+    ensure_ca_code_counters()
+
+    assert allocate_ca_code('Ann Bob Carl Dan') == 'AB08'
+    assert allocate_ca_code('Eve Fay Gus Hal') == 'EFGH'
@@ -0,0 +1,179 @@
+"""Email outbox: enqueue, lease, retry and cancellation against a local SMTP stand-in"""
+import os
+import socketserver
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+from config import Config
+from utils import smtp_pool
+from utils.email_outbox import cancel_email, claim_jobs, claim_next_job, enqueue_email, process_jobs
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Minimal SMTP server that records messages, or rejects them with a 451"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.messages = []
+        self.reject = False
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 stand-in')
+        for line in self.rfile:
+            command = line.decode().strip().upper()
+            if command == 'DATA':
+                self.reply('354 go ahead')
+                message = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                if self.server.reject:
+                    self.reply('451 try again later')
+                else:
+                    self.server.messages.append(message)
+                    self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = SMTPStandIn()
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    monkeypatch.setattr(smtp_pool, '_pool', None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def mail_app(smtp_server, mongo_db, monkeypatch):
+    # The logo is read relative to the working directory, as in the Procfile processes
+    monkeypatch.chdir(REPO_ROOT)
+    app = Flask(__name__, template_folder=os.path.join(REPO_ROOT, 'templates'))
+    app.config.from_object(Config)
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=smtp_server.server_address[1], MAIL_USE_TLS=False,
+                      MAIL_USERNAME=None, MAIL_DEFAULT_SENDER='noreply@example.com', MAIL_RATE_LIMIT=0)
+    with app.app_context():
+        yield app
+
+
+def _ca(db, status):
+    return db.ca_registrations.insert_one({
+        'full_name': 'Ann Bob', 'email': 'ann@example.com', 'ca_code': 'AB01',
+        'user_id': None, 'status': status, 'registration_date': datetime(2024, 1, 1)
+    }).inserted_id
+
+
+def _job(db, ca_id):
+    return db.email_outbox.find_one({'idempotency_key': f'ca_approval:{ca_id}'})
+
+
+def test_enqueue_is_idempotent(mongo_db):
+    ca_id = _ca(mongo_db, 'approved')
+    first = enqueue_email('ca_approval', ca_id)
+    second = enqueue_email('ca_approval', ca_id)
+    assert first['_id'] == second['_id']
+    assert second['status'] == 'queued'
+    assert mongo_db.email_outbox.count_documents({}) == 1
+
+
+def test_leased_job_is_not_claimed_twice(mongo_db):
+    ca_id = _ca(mongo_db, 'approved')
+    enqueue_email('ca_approval', ca_id)
+
+    job = claim_next_job()
+    assert job['status'] == 'sending' and job['attempts'] == 1
+    assert claim_next_job() is None
+
+    # The worker died: once the lease runs out another one takes the job over
+    mongo_db.email_outbox.update_one({'_id': job['_id']}, {'$set': {'locked_until': datetime.utcnow() - timedelta(seconds=1)}})
+    retaken = claim_next_job()
+    assert retaken['_id'] == job['_id'] and retaken['attempts'] == 2
+
+
+def test_sent_job_records_approval(mail_app, smtp_server, mongo_db):
+    ca_id = _ca(mongo_db, 'approved')
+    enqueue_email('ca_approval', ca_id)
+
+    assert process_jobs(claim_jobs(10)) == 1
+    assert len(smtp_server.messages) == 1
+    assert _job(mongo_db, ca_id)['status'] == 'sent'
+    assert _job(mongo_db, ca_id)['applied'] is True
+    assert mongo_db.ca_registrations.find_one({'_id': ca_id})['approval_sent_at']
+
+
+def test_rejected_send_is_retried_with_backoff(mail_app, smtp_server, mongo_db):
+    ca_id = _ca(mongo_db, 'approved')
+    enqueue_email('ca_approval', ca_id)
+
+    smtp_server.reject = True
+    assert process_jobs(claim_jobs(10)) == 0
+    job = _job(mongo_db, ca_id)
+    assert job['status'] == 'retry'
+    assert 'try again later' in job['last_error']
+    assert job['next_attempt_at'] > datetime.utcnow()
+    assert claim_jobs(10) == []
+
+    smtp_server.reject = False
+    mongo_db.email_outbox.update_one({'_id': job['_id']}, {'$set': {'next_attempt_at': datetime.utcnow()}})
+    assert process_jobs(claim_jobs(10)) == 1
+    assert _job(mongo_db, ca_id)['status'] == 'sent'
+    assert len(smtp_server.messages) == 1
+
+
+def test_repeated_failures_dead_letter(mail_app, smtp_server, mongo_db):
+    ca_id = _ca(mongo_db, 'approved')
+    enqueue_email('ca_approval', ca_id)
+    smtp_server.reject = True
+
+    for _ in range(Config.EMAIL_OUTBOX_MAX_ATTEMPTS):
+        mongo_db.email_outbox.update_many({}, {'$set': {'next_attempt_at': datetime.utcnow()}})
+        process_jobs(claim_jobs(10))
+
+    assert _job(mongo_db, ca_id)['status'] == 'dead'
+    # Approving again puts a dead-lettered mail back in the queue
+    assert enqueue_email('ca_approval', ca_id)['status'] == 'queued'
+
+
+def test_cancelled_approval_is_not_sent(mail_app, smtp_server, mongo_db):
+    ca_id = _ca(mongo_db, 'approved')
+    enqueue_email('ca_approval', ca_id)
+
+    mongo_db.ca_registrations.update_one({'_id': ca_id}, {'$set': {'status': 'rejected'}})
+    assert cancel_email('ca_approval', ca_id)
+    assert _job(mongo_db, ca_id)['status'] == 'cancelled'
+    assert claim_jobs(10) == []
+    assert smtp_server.messages == []
+
+    # Approving again requeues the cancelled job
+    mongo_db.ca_registrations.update_one({'_id': ca_id}, {'$set': {'status': 'approved'}})
+    assert enqueue_email('ca_approval', ca_id)['status'] == 'queued'
+
+
+def test_claimed_job_for_rejected_ca_is_cancelled(mail_app, smtp_server, mongo_db):
+    ca_id = _ca(mongo_db, 'approved')
+    enqueue_email('ca_approval', ca_id)
+    jobs = claim_jobs(10)
+
+    # Rejected after the worker claimed the job, before it sent anything
+    mongo_db.ca_registrations.update_one({'_id': ca_id}, {'$set': {'status': 'rejected'}})
+    assert cancel_email('ca_approval', ca_id) is False
+    assert process_jobs(jobs) == 0
+
+    assert smtp_server.messages == []
+    assert _job(mongo_db, ca_id)['status'] == 'cancelled'
+    ca = mongo_db.ca_registrations.find_one({'_id': ca_id})
+    assert ca['status'] == 'rejected' and 'approval_sent_at' not in ca
@@ -0,0 +1,77 @@
+"""The CA export must fetch users per batch, not per row"""
+import io
+from math import ceil
+
+import pytest
+from bson import ObjectId
+
+import extensions
+from utils.export_jobs import export_documents
+from utils.export_service import CA_COLUMNS, join_users, write_csv
+
+
+class CountingCollection:
+    """Just enough of a pymongo collection for export reads, recording every find"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.finds = []
+
+    def find(self, query=None, projection=None):
+        self.finds.append(query or {})
+        ids = (query or {}).get('_id', {}).get('$in')
+        matched = [doc for doc in self.documents if ids is None or doc['_id'] in ids]
+        if projection:
+            matched = [{key: value for key, value in doc.items() if key == '_id' or key in projection}
+                       for doc in matched]
+        return CountingCursor(matched)
+
+    def find_one(self, *args, **kwargs):
+        raise AssertionError('find_one per row')
+
+
+class CountingCursor(list):
+    def batch_size(self, size):
+        return self
+
+
+@pytest.fixture
+def ca_export_db(monkeypatch):
+    users = [{'_id': ObjectId(), 'facebook_link': f'https://fb.example/{n}', 'password': 'x'} for n in range(700)]
+    # Several CA applications per user, as in the real data
+    cas = [
+        {'_id': ObjectId(), 'user_id': users[n % len(users)]['_id'], 'ca_code': f'C{n:04d}', 'full_name': f'CA {n}'}
+        for n in range(2500)
+    ]
+    db = {'users': CountingCollection(users), 'ca_registrations': CountingCollection(cas)}
+    monkeypatch.setattr(extensions, 'db', type('FakeDB', (), {
+        'users': db['users'], '__getitem__': lambda self, name: db[name]
+    })())
+    return db
+
+
+def test_join_users_queries_once_per_batch(ca_export_db):
+    users = ca_export_db['users']
+    cas = ca_export_db['ca_registrations'].documents
+    rows = list(join_users(iter(cas), users, ['facebook_link'], batch_size=1000))
+
+    assert len(rows) == len(cas)
+    assert len(users.finds) == ceil(len(cas) / 1000)
+    assert all(row['facebook_link'].startswith('https://fb.example/') for row in rows)
+
+
+def test_ca_export_query_count(ca_export_db):
+    output = io.BytesIO()
+    write_csv(export_documents('ca_registrations', {}), CA_COLUMNS, output)
+
+    lines = output.getvalue().decode('utf-8-sig').splitlines()
+    assert len(lines) == 2500 + 1
+    assert len(ca_export_db['ca_registrations'].finds) == 1
+    assert len(ca_export_db['users'].finds) == ceil(2500 / 1000)
+
+
+def test_documents_without_user_skip_the_lookup():
+    users = CountingCollection([])
+    rows = list(join_users(iter([{'_id': ObjectId()}] * 5), users, ['facebook_link'], batch_size=2))
+    assert [row['facebook_link'] for row in rows] == [None] * 5
+    assert users.finds == []
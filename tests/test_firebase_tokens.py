@@ -0,0 +1,201 @@
+"""firebase_verify_id_token against locally generated keys, served by a stand-in for Google's cert endpoint"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from utils import firebase_helpers, http_client
+
+PROJECT_ID = 'test-project'
+KID = 'test-kid'
+
+
+def _keypair():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'securetoken')])
+    now = datetime.now(timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+            .public_key(key.public_key()).serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(days=1)).not_valid_after(now + timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    return key, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+SIGNING_KEY, CERT_PEM = _keypair()
+OTHER_KEY, OTHER_CERT_PEM = _keypair()
+
+
+class _CertsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.fetches.append(time.time())
+        body = json.dumps(self.server.certs).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.cache_control:
+            self.send_header('Cache-Control', self.server.cache_control)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def certs_server(monkeypatch):
+    """Serve CERT_PEM as Google's only cert, the way Google does, and record the fetches"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _CertsHandler)
+    server.certs = {KID: CERT_PEM}
+    server.cache_control = 'public, max-age=3600, must-revalidate, no-transform'
+    server.fetches = []
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+
+    monkeypatch.setenv('FIREBASE_PROJECT_ID', PROJECT_ID)
+    monkeypatch.setattr(firebase_helpers, 'GOOGLE_CERTS_URL', f'http://127.0.0.1:{server.server_address[1]}/certs')
+    monkeypatch.setattr(firebase_helpers, '_google_keys', {'keys': {}, 'expires_at': 0.0, 'fetched_at': 0.0})
+    monkeypatch.setattr(http_client, '_session', None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def google_certs(certs_server):
+    return certs_server.fetches
+
+
+def _token(key=SIGNING_KEY, kid=KID, algorithm='RS256', **overrides):
+    now = int(time.time())
+    claims = {
+        'iss': f'https://securetoken.google.com/{PROJECT_ID}',
+        'aud': PROJECT_ID,
+        'sub': 'firebase-uid',
+        'iat': now,
+        'exp': now + 3600,
+        'email': 'user@example.com'
+    }
+    claims.update(overrides)
+    return jwt.encode(claims, key, algorithm=algorithm, headers={'kid': kid})
+
+
+def test_valid_token():
+    claims = firebase_helpers.firebase_verify_id_token(_token())
+    assert claims['sub'] == 'firebase-uid'
+    assert claims['email'] == 'user@example.com'
+
+
+def test_keys_are_cached_between_tokens(google_certs):
+    firebase_helpers.firebase_verify_id_token(_token())
+    firebase_helpers.firebase_verify_id_token(_token())
+    assert len(google_certs) == 1
+
+
+def test_cache_lasts_for_max_age(certs_server):
+    before = time.time()
+    firebase_helpers.firebase_verify_id_token(_token())
+    expires_at = firebase_helpers._google_keys['expires_at']
+    assert before + 3600 <= expires_at <= time.time() + 3600
+
+
+def test_keys_refetched_once_max_age_passes(certs_server):
+    certs_server.cache_control = 'public, max-age=0'
+    firebase_helpers.firebase_verify_id_token(_token())
+    firebase_helpers.firebase_verify_id_token(_token())
+    assert len(certs_server.fetches) == 2
+
+
+def test_missing_cache_control_is_not_cached(certs_server):
+    certs_server.cache_control = None
+    firebase_helpers.firebase_verify_id_token(_token())
+    assert firebase_helpers._google_keys['expires_at'] <= time.time()
+
+
+def test_rotated_keys_picked_up(certs_server, monkeypatch):
+    firebase_helpers.firebase_verify_id_token(_token())
+    # Google rotates in a new cert before our cached copy expires
+    certs_server.certs = {KID: CERT_PEM, 'new-kid': OTHER_CERT_PEM}
+    monkeypatch.setattr(firebase_helpers, 'FORCED_REFRESH_INTERVAL', 0)
+    claims = firebase_helpers.firebase_verify_id_token(_token(key=OTHER_KEY, kid='new-kid'))
+    assert claims['sub'] == 'firebase-uid'
+    assert len(certs_server.fetches) == 2
+
+
+def test_previous_keys_kept_when_endpoint_fails(certs_server, monkeypatch):
+    firebase_helpers.firebase_verify_id_token(_token())
+    certs_server.certs = {KID: 'not a certificate'}
+    monkeypatch.setattr(firebase_helpers, 'FORCED_REFRESH_INTERVAL', 0)
+    with pytest.raises(jwt.InvalidTokenError):
+        firebase_helpers.firebase_verify_id_token(_token(kid='junk'))
+    assert firebase_helpers.firebase_verify_id_token(_token())['sub'] == 'firebase-uid'
+
+
+def test_expired_token():
+    past = int(time.time()) - 7200
+    with pytest.raises(jwt.ExpiredSignatureError):
+        firebase_helpers.firebase_verify_id_token(_token(iat=past, exp=past + 3600))
+
+
+@pytest.mark.parametrize('claim, value', [
+    ('aud', 'another-project'),
+    ('iss', 'https://securetoken.google.com/another-project'),
+    ('iss', f'https://accounts.google.com/{PROJECT_ID}'),
+    ('sub', ''),
+])
+def test_wrong_claims(claim, value):
+    with pytest.raises(jwt.InvalidTokenError):
+        firebase_helpers.firebase_verify_id_token(_token(**{claim: value}))
+
+
+def test_signed_with_another_key():
+    with pytest.raises(jwt.InvalidSignatureError):
+        firebase_helpers.firebase_verify_id_token(_token(key=OTHER_KEY))
+
+
+def test_unknown_kid():
+    with pytest.raises(jwt.InvalidTokenError, match='Unknown signing key'):
+        firebase_helpers.firebase_verify_id_token(_token(kid='rotated-away'))
+
+
+def test_unknown_kid_refresh_is_rate_limited(google_certs):
+    firebase_helpers.firebase_verify_id_token(_token())
+    for _ in range(20):
+        with pytest.raises(jwt.InvalidTokenError):
+            firebase_helpers.firebase_verify_id_token(_token(kid='junk'))
+    # The first unknown kid is still inside FORCED_REFRESH_INTERVAL of the initial fetch
+    assert len(google_certs) == 1
+
+
+def test_unknown_kid_refreshes_after_interval(google_certs, monkeypatch):
+    firebase_helpers.firebase_verify_id_token(_token())
+    monkeypatch.setattr(firebase_helpers, 'FORCED_REFRESH_INTERVAL', 0)
+    with pytest.raises(jwt.InvalidTokenError):
+        firebase_helpers.firebase_verify_id_token(_token(kid='junk'))
+    assert len(google_certs) == 2
+
+
+@pytest.mark.parametrize('algorithm, key', [
+    ('HS256', 'shared-secret-of-at-least-32-bytes!!'),
+    ('RS512', SIGNING_KEY),
+])
+def test_unexpected_algorithm(algorithm, key):
+    with pytest.raises(jwt.InvalidTokenError):
+        firebase_helpers.firebase_verify_id_token(_token(key=key, algorithm=algorithm))
+
+
+def test_unsigned_token():
+    token = jwt.encode({'sub': 'x', 'aud': PROJECT_ID}, None, algorithm='none', headers={'kid': KID})
+    with pytest.raises(jwt.InvalidTokenError):
+        firebase_helpers.firebase_verify_id_token(token)
+
+
+def test_missing_token():
+    with pytest.raises(jwt.InvalidTokenError):
+        firebase_helpers.firebase_verify_id_token('')
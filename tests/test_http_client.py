@@ -0,0 +1,74 @@
+"""Retry policy of the shared outbound HTTP client"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from config import Config
+from utils import http_client
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits += 1
+        if self.path == '/slow':
+            time.sleep(0.5)
+        status = 503 if self.path == '/flaky' and self.server.hits < 3 else 200
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up on /slow
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(Config, 'HTTP_READ_TIMEOUT', 0.2)
+    monkeypatch.setattr(Config, 'HTTP_RETRY_BACKOFF', 0.01)
+    monkeypatch.setattr(http_client, '_session', None)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.hits = 0
+    threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True).start()
+    yield httpd, f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_idempotent_call_retries_5xx(server):
+    httpd, base = server
+    response = http_client.http_get('test:flaky', f'{base}/flaky')
+    assert response.status_code == 200
+    assert response.json() == {'ok': True}
+    assert httpd.hits == 3
+
+
+def test_read_timeout_is_not_retried(server):
+    httpd, base = server
+    with pytest.raises(requests.exceptions.Timeout):
+        http_client.http_get('test:slow', f'{base}/slow')
+    assert httpd.hits == 1
+
+
+def test_connection_error_is_retried(server, monkeypatch):
+    _, base = server
+    calls = []
+    send = http_client._send
+
+    def refuse_once(session, method, url, **kwargs):
+        calls.append(url)
+        if len(calls) == 1:
+            raise requests.exceptions.ConnectionError('refused')
+        return send(session, method, url, **kwargs)
+
+    monkeypatch.setattr(http_client, '_send', refuse_once)
+    assert http_client.http_get('test:ok', f'{base}/ok').status_code == 200
+    assert len(calls) == 2
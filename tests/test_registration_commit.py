@@ -0,0 +1,22 @@
+"""Transaction support detection for commit_registration"""
+from utils import registration_commit
+
+
+def test_negative_answer_is_rechecked(monkeypatch):
+    answers = [False, True, False]
+    clock = [1000.0]
+    monkeypatch.setattr(registration_commit, '_transaction_check', None)
+    monkeypatch.setattr(registration_commit, '_detect_transactions', lambda: answers.pop(0))
+    monkeypatch.setattr(registration_commit.time, 'monotonic', lambda: clock[0])
+
+    assert registration_commit.transactions_supported() is False
+    clock[0] += registration_commit.TRANSACTION_RECHECK_SECONDS - 1
+    assert registration_commit.transactions_supported() is False
+    assert answers == [True, False]
+
+    clock[0] += 2
+    assert registration_commit.transactions_supported() is True
+    # A positive answer is kept for good
+    clock[0] += registration_commit.TRANSACTION_RECHECK_SECONDS * 10
+    assert registration_commit.transactions_supported() is True
+    assert answers == [False]
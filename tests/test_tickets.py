@@ -0,0 +1,76 @@
+"""Scanning QR codes: signed tickets, v1 tickets and plain ObjectIds"""
+import base64
+import hashlib
+import hmac
+import os
+import struct
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from config import Config
+from utils.scan import resolve_scan
+from utils.tickets import InvalidTicket, parse_scan, sign_ticket
+
+
+def _v1_ticket(user_id, ref_ids, key):
+    """A ticket as the v1 (HMAC) scheme issued them"""
+    body = struct.pack('>BI', 1, 1700000000) + user_id.binary + b''.join(ref.binary for ref in ref_ids)
+    mac = hmac.new(key.encode(), body, hashlib.sha256).digest()[:12]
+    return base64.urlsafe_b64encode(body + mac).rstrip(b'=').decode()
+
+
+def test_bare_object_id_scans_without_ticket():
+    obj_id = ObjectId()
+    assert parse_scan(f' {obj_id} ') == (obj_id, None)
+
+
+def test_bare_object_ids_rejected_when_legacy_codes_disabled(monkeypatch):
+    monkeypatch.setattr(Config, 'QR_ACCEPT_LEGACY_CODES', False)
+    with pytest.raises(InvalidTicket):
+        parse_scan(str(ObjectId()))
+
+
+def test_signed_ticket_round_trip():
+    user_id, reg_id = ObjectId(), ObjectId()
+    obj_id, ticket = parse_scan(sign_ticket(user_id, [reg_id], datetime(2024, 1, 1)))
+    assert obj_id == user_id
+    assert ticket['ref_ids'] == [reg_id]
+    assert ticket['issued_at'] == datetime(2024, 1, 1)
+
+
+def test_tampered_ticket_rejected():
+    token = sign_ticket(ObjectId(), [ObjectId()])
+    raw = bytearray(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    raw[10] ^= 1
+    with pytest.raises(InvalidTicket):
+        parse_scan(base64.urlsafe_b64encode(bytes(raw)).rstrip(b'=').decode())
+
+
+def test_v1_ticket_still_verified():
+    user_id, reg_id = ObjectId(), ObjectId()
+    obj_id, ticket = parse_scan(_v1_ticket(user_id, [reg_id], Config.QR_SIGNING_KEY))
+    assert obj_id == user_id
+    assert ticket['ref_ids'] == [reg_id]
+
+
+def test_v1_ticket_with_wrong_key_rejected():
+    with pytest.raises(InvalidTicket):
+        parse_scan(_v1_ticket(ObjectId(), [ObjectId()], 'not-the-signing-key'))
+
+
+def test_scan_bare_registration_id(mongo_db):
+    if not os.environ.get('TEST_MONGO_URI'):
+        pytest.skip('resolve_scan uses $unionWith; needs a MongoDB 4.4+ server at TEST_MONGO_URI')
+    user_id = mongo_db.users.insert_one({'full_name': 'Ann Bob'}).inserted_id
+    reg_id = mongo_db.registrations.insert_one({'user_id': user_id, 'segment_name': 'Quiz'}).inserted_id
+
+    obj_id, ticket = parse_scan(str(reg_id))
+    scan = resolve_scan(obj_id)
+
+    assert ticket is None
+    assert scan['scanned_kind'] == 'registration'
+    assert scan['user']['_id'] == user_id
+    assert [reg['_id'] for reg in scan['registrations']] == [reg_id]
+    assert resolve_scan(ObjectId()) is None
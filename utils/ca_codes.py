@@ -0,0 +1,88 @@
+import random
+import re
+import string
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import extensions
+
+CA_CODE_LENGTH = 4
+
+# Codes whose name-derived form is taken become two initials plus a
+# two-digit sequence number (AB01 .. AB99) handed out by a per-prefix counter
+SEQUENCE_PREFIX_LENGTH = 2
+MAX_SEQUENCE = 99
+
+_SEQUENCED = re.compile(r'^(.{2})(\d{2})$')
+
+
+def _base_code(full_name):
+    """Initials of the name, padded with random letters to four characters"""
+    initials = ''.join(word[0].upper() for word in full_name.split() if word)
+    if len(initials) >= CA_CODE_LENGTH:
+        return initials[:CA_CODE_LENGTH]
+    return initials + ''.join(random.choices(string.ascii_uppercase, k=CA_CODE_LENGTH - len(initials)))
+
+
+def _next(counter_id):
+    """Atomically bump a counter and return its new value"""
+    for attempt in range(2):
+        try:
+            counter = extensions.db.ca_code_counters.find_one_and_update(
+                {'_id': counter_id},
+                {'$inc': {'seq': 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return counter['seq']
+        except DuplicateKeyError:
+            # Two first uses of a counter raced to insert it; the retry increments the winner's
+            if attempt:
+                raise
+
+
+def allocate_ca_code(full_name):
+    """Hand out a unique 4-character CA code derived from the name.
+
+    The name's own code is claimed with a single $inc on its counter (the
+    first caller gets seq 1). If it is taken, the next number from the
+    two-initial prefix counter is used instead. Both steps are atomic, so
+    concurrent signups never receive the same code.
+    """
+    for _ in range(10):
+        code = _base_code(full_name)
+        # A name-derived code that looks sequenced (digit initials) is left to the prefix counter
+        if not _SEQUENCED.match(code) and _next(code) == 1:
+            return code
+
+        seq = _next(code[:SEQUENCE_PREFIX_LENGTH])
+        if seq <= MAX_SEQUENCE:
+            return f"{code[:SEQUENCE_PREFIX_LENGTH]}{seq:02d}"
+        # Prefix exhausted: retry with random letters after the first initial
+        full_name = code[0]
+    raise RuntimeError('Could not allocate a CA code')
+
+
+def ensure_ca_code_counters():
+    """Make the counters account for codes allocated before they existed.
+
+    Idempotent ($max), so it is safe to run on every start.
+    """
+    db = extensions.db
+    operations = []
+    sequences = {}
+    for ca in db.ca_registrations.find({'ca_code': {'$type': 'string'}}, {'ca_code': 1}):
+        code = ca['ca_code']
+        operations.append(UpdateOne({'_id': code}, {'$max': {'seq': 1}}, upsert=True))
+        match = _SEQUENCED.match(code)
+        if match:
+            prefix, seq = match.group(1), int(match.group(2))
+            sequences[prefix] = max(sequences.get(prefix, 0), seq)
+
+    operations += [
+        UpdateOne({'_id': prefix}, {'$max': {'seq': seq}}, upsert=True)
+        for prefix, seq in sequences.items()
+    ]
+    if operations:
+        db.ca_code_counters.bulk_write(operations, ordered=False)
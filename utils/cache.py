@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+
+from bson import json_util
+
+import extensions
+from config import Config
+
+_MISSING = object()
+
+# Every VersionedCache created in this process, for cache_stats()
+_caches = []
+
+
+def get_version(key):
+    """Read the current version counter for a cached key"""
+    doc = extensions.db.cache_versions.find_one({'_id': key}, {'version': 1})
+    return doc.get('version', 0) if doc else 0
+
+
+def bump_version(key):
+    """Increment the version counter so every worker reloads its copy of key"""
+    extensions.db.cache_versions.update_one(
+        {'_id': key},
+        {'$inc': {'version': 1}},
+        upsert=True
+    )
+
+
+class VersionedCache:
+    """Process-local cache of a database value, revalidated against a version counter.
+
+    Each gunicorn worker holds its own copy. Within ``ttl`` seconds the cached
+    value is served without touching MongoDB; after that a single lookup of the
+    version counter decides whether the value is still current. Writers call
+    ``bump_version(key)`` so the other workers pick up the change within ``ttl``.
+    """
+
+    def __init__(self, key, loader, ttl):
+        self.key = key
+        self.loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = _MISSING
+        self._version = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        _caches.append(self)
+
+    def get(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._value is not _MISSING and now - self._checked_at < self.ttl:
+                self.hits += 1
+                return self._value
+
+        version = get_version(self.key)
+
+        with self._lock:
+            if self._value is not _MISSING and version == self._version:
+                self._checked_at = now
+                self.hits += 1
+                self.revalidations += 1
+                return self._value
+
+        value = self.loader()
+
+        with self._lock:
+            self._value = value
+            self._version = version
+            self._checked_at = now
+            self.misses += 1
+        return value
+
+    def invalidate(self):
+        """Drop the local copy so the next read goes to the database"""
+        with self._lock:
+            self._value = _MISSING
+            self._version = None
+            self._checked_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'key': self.key,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'version': self._version,
+                'ttl': self.ttl
+            }
+
+
+def _load_system_settings():
+    return extensions.db.settings.find_one({'name': 'system_settings'})
+
+
+settings_cache = VersionedCache('system_settings', _load_system_settings, Config.SETTINGS_CACHE_TTL)
+
+
+def get_system_settings():
+    """Get the system_settings document from the process-local cache"""
+    return settings_cache.get()
+
+
+def invalidate_system_settings():
+    """Publish a settings change to all workers and drop the local copy"""
+    bump_version('system_settings')
+    settings_cache.invalidate()
+
+
+# Count cache: {(collection, query): (count, counted_at)}, most recently used last
+_counts = OrderedDict()
+_counts_lock = threading.Lock()
+_COUNT_CACHE_SIZE = 256
+
+
+def cached_count(collection, query, ttl=None):
+    """Document count for a filter, recounted at most every `ttl` seconds per worker.
+    
+    An unfiltered count uses the collection metadata instead of scanning.
+    """
+    ttl = Config.COUNT_CACHE_TTL if ttl is None else ttl
+    key = (collection.name, json_util.dumps(query, sort_keys=True))
+    now = time.monotonic()
+    
+    with _counts_lock:
+        entry = _counts.get(key)
+        if entry and now - entry[1] < ttl:
+            _counts.move_to_end(key)
+            return entry[0]
+    
+    count = collection.count_documents(query) if query else collection.estimated_document_count()
+    
+    with _counts_lock:
+        _counts[key] = (count, now)
+        _counts.move_to_end(key)
+        while len(_counts) > _COUNT_CACHE_SIZE:
+            _counts.popitem(last=False)
+    return count
+
+
+def cache_stats():
+    """Hit/miss counters for every process-local cache in this worker"""
+    return {cache.key: cache.stats() for cache in _caches}
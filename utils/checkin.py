@@ -0,0 +1,257 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import extensions
+
+# Columns of each manifest row, in order; the scanner zips them back into objects.
+# Only what a gate needs to admit someone: scanner devices keep the manifest
+# in IndexedDB, so contact details stay on the server (see /api/scan-user).
+MANIFEST_FIELDS = ('id', 'name', 'present', 'present_at', 'segments', 'ca_code', 'aliases')
+
+# How far back a delta reaches before `since`, to cover writes that were in
+# flight while the previous manifest was being built
+MANIFEST_OVERLAP_MS = 5000
+
+# One attendance log entry per distinct scan; re-sent scans match the same key
+ATTENDANCE_KEY = ('user_id', 'segment', 'gate', 'scanned_at')
+
+USER_MANIFEST_FIELDS = ('full_name', 'name', 'present', 'present_at')
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _to_ms(value):
+    """Epoch milliseconds for a naive UTC datetime as stored by the app"""
+    if not isinstance(value, datetime):
+        return None
+    return int(value.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def touch_attendees(user_ids):
+    """Flag users whose manifest row changed so the next delta sync picks them up"""
+    user_ids = [user_id for user_id in user_ids if user_id]
+    if user_ids:
+        extensions.db.users.update_many(
+            {'_id': {'$in': user_ids}},
+            {'$set': {'manifest_updated_at': datetime.utcnow()}}
+        )
+
+
+def ensure_checkin_indexes():
+    db = extensions.db
+    db.users.create_index([('manifest_updated_at', 1)])
+    db.attendance.create_index([(key, 1) for key in ATTENDANCE_KEY], unique=True)
+    # Covers the headcount $group and "who is in this segment" lookups
+    db.attendance.create_index([('segment', 1), ('user_id', 1)])
+
+
+def _attendee_rows(user_filter=None):
+    """Manifest rows for verified registrants and approved CAs, optionally limited to some users"""
+    db = extensions.db
+    registration_match = {'verified': True}
+    ca_match = {'status': 'approved'}
+    if user_filter is not None:
+        registration_match['user_id'] = {'$in': user_filter}
+        ca_match['user_id'] = {'$in': user_filter}
+
+    attendees = {}
+    for group in db.registrations.aggregate([
+        {'$match': registration_match},
+        {'$sort': {'registration_date': 1}},
+        {'$group': {
+            '_id': '$user_id',
+            'segments': {'$push': {'segment': '$segment_name', 'category': '$category'}},
+            'aliases': {'$push': '$_id'}
+        }}
+    ]):
+        attendees[group['_id']] = {'segments': group['segments'], 'aliases': group['aliases'], 'ca_code': None}
+
+    for ca in db.ca_registrations.find(ca_match, {'user_id': 1, 'ca_code': 1}):
+        entry = attendees.setdefault(ca['user_id'], {'segments': [], 'aliases': [], 'ca_code': None})
+        entry['ca_code'] = ca.get('ca_code')
+        entry['aliases'].append(ca['_id'])
+
+    rows = []
+    users = db.users.find(
+        {'_id': {'$in': list(attendees)}},
+        {field: 1 for field in USER_MANIFEST_FIELDS}
+    )
+    for user in users:
+        entry = attendees[user['_id']]
+        rows.append([
+            str(user['_id']),
+            user.get('full_name', user.get('name', '')),
+            bool(user.get('present', False)),
+            _to_ms(user.get('present_at')),
+            [[seg.get('segment') or '', seg.get('category') or ''] for seg in entry['segments']],
+            entry['ca_code'],
+            [str(alias) for alias in entry['aliases']]
+        ])
+    return rows
+
+
+def build_manifest(since=None):
+    """Attendee snapshot for offline scanners.
+
+    Without `since` (a previous manifest's version) the full list is
+    returned. With it, only users changed since then are returned in
+    `attendees`, and those who no longer qualify are listed in `removed`.
+    """
+    version = _now_ms()
+    if since is None:
+        return {'version': version, 'full': True, 'fields': MANIFEST_FIELDS,
+                'attendees': _attendee_rows(), 'removed': []}
+
+    changed_since = datetime.utcfromtimestamp(max(since - MANIFEST_OVERLAP_MS, 0) / 1000)
+    changed = [user['_id'] for user in extensions.db.users.find(
+        {'manifest_updated_at': {'$gte': changed_since}}, {'_id': 1}
+    )]
+    rows = _attendee_rows(changed) if changed else []
+    kept = {row[0] for row in rows}
+    return {
+        'version': version,
+        'full': False,
+        'fields': MANIFEST_FIELDS,
+        'attendees': rows,
+        'removed': [str(user_id) for user_id in changed if str(user_id) not in kept]
+    }
+
+
+def _scan_time(value, now):
+    """Parse a client check-in time (epoch ms), never later than the server clock"""
+    try:
+        value = int(value)
+        scanned_at = datetime.utcfromtimestamp(value // 1000) + timedelta(milliseconds=value % 1000)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return now
+    return min(scanned_at, now)
+
+
+def _parse_checkin(checkin, now, default_gate):
+    """Normalized check-in, or None if its ids are not ObjectIds"""
+    if not isinstance(checkin, dict):
+        return None
+    try:
+        user_id = ObjectId(str(checkin.get('id', '')))
+        registration_id = ObjectId(str(checkin['registration_id'])) if checkin.get('registration_id') else None
+    except InvalidId:
+        return None
+    return {
+        'user_id': user_id,
+        'registration_id': registration_id,
+        'segment': checkin.get('segment') or None,
+        'gate': checkin.get('gate') or default_gate,
+        'scanned_at': _scan_time(checkin.get('scanned_at'), now)
+    }
+
+
+def _earliest_wins(_id, scanned_at, fields):
+    """Set present fields unless an equal-or-earlier check-in is already recorded"""
+    return UpdateOne(
+        {'_id': _id, '$or': [
+            {'present': {'$ne': True}},
+            {'present_at': {'$gt': scanned_at}},
+            {'present_at': None}
+        ]},
+        {'$set': dict(fields, present=True, present_at=scanned_at)}
+    )
+
+
+def _bulk_write_ignoring_duplicates(collection, operations):
+    """Unordered upserts where losing a race to a concurrent identical upsert is fine"""
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+            raise
+
+
+def record_checkins(checkins, default_gate=None):
+    """Mark users present from a batch of (possibly offline) scans.
+
+    Each check-in is {'id': user_id, 'scanned_at': epoch_ms, 'gate': name},
+    optionally with the 'segment' and 'registration_id' being attended.
+    Every scan is appended to the attendance log once; re-sending a batch
+    is harmless. When the same person is checked in at several gates the
+    earliest scan wins the user's present_at / present_gate, and later ones
+    are reported as duplicates.
+    The whole batch takes at most four round trips. Returns one result per
+    check-in, in order.
+    """
+    db = extensions.db
+    now = datetime.utcnow()
+    # MongoDB keeps milliseconds; truncate so stored times compare equal to ours
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    parsed = [_parse_checkin(checkin, now, default_gate) for checkin in checkins]
+    valid = [entry for entry in parsed if entry]
+
+    if valid:
+        db.users.bulk_write([
+            _earliest_wins(entry['user_id'], entry['scanned_at'],
+                           {'present_gate': entry['gate'], 'manifest_updated_at': now})
+            for entry in valid
+        ], ordered=False)
+
+    users = {
+        user['_id']: user for user in db.users.find(
+            {'_id': {'$in': list({entry['user_id'] for entry in valid})}},
+            {'present_at': 1, 'present_gate': 1}
+        )
+    } if valid else {}
+
+    attended = [entry for entry in valid if entry['user_id'] in users]
+    if attended:
+        _bulk_write_ignoring_duplicates(db.attendance, [
+            UpdateOne(
+                {key: entry[key] for key in ATTENDANCE_KEY},
+                {'$setOnInsert': {'registration_id': entry['registration_id'], 'recorded_at': now}},
+                upsert=True
+            )
+            for entry in attended
+        ])
+
+    registration_updates = [
+        _earliest_wins(entry['registration_id'], entry['scanned_at'], {'present_gate': entry['gate']})
+        for entry in attended if entry['registration_id']
+    ]
+    if registration_updates:
+        db.registrations.bulk_write(registration_updates, ordered=False)
+
+    results = []
+    for checkin, entry in zip(checkins, parsed):
+        raw_id = str(checkin.get('id', '')) if isinstance(checkin, dict) else ''
+        if not entry:
+            results.append({'id': raw_id, 'status': 'invalid'})
+            continue
+        user = users.get(entry['user_id'])
+        if not user:
+            results.append({'id': raw_id, 'status': 'not_found'})
+            continue
+        won = user.get('present_at') == entry['scanned_at'] and user.get('present_gate') == entry['gate']
+        results.append({
+            'id': raw_id,
+            'status': 'checked_in' if won else 'duplicate',
+            'present_at': _to_ms(user.get('present_at')),
+            'gate': user.get('present_gate')
+        })
+
+    return results
+
+
+def segment_headcounts():
+    """Distinct people checked in per segment, from the attendance log"""
+    return {
+        group['_id']: group['count']
+        for group in extensions.db.attendance.aggregate([
+            {'$match': {'segment': {'$ne': None}}},
+            {'$group': {'_id': {'segment': '$segment', 'user_id': '$user_id'}}},
+            {'$group': {'_id': '$_id.segment', 'count': {'$sum': 1}}}
+        ])
+    }
@@ -0,0 +1,328 @@
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+import extensions
+from config import Config
+from utils.checkin import touch_attendees
+from utils.email_service import send_ca_approval_email, send_concurrently, send_reg_verification_email
+from utils.rollups import ROLLUP_DIMENSIONS, apply_rollup_delta
+
+# Job lifecycle: queued -> sending -> sent, or back to retry with backoff,
+# ending in dead (the dead-letter state) after EMAIL_OUTBOX_MAX_ATTEMPTS.
+# A queued or retrying job is cancelled when its document leaves the state
+# the mail announces. A sent job keeps applied=False until its on_sent side
+# effect has run.
+TERMINAL_STATUSES = ('sent', 'dead', 'cancelled')
+
+
+def _mark_registrations_verified(registration_ids):
+    # One at a time so the analytics rollups count only registrations this call flipped
+    projection = {field: 1 for field in ROLLUP_DIMENSIONS.values()}
+    projection['user_id'] = 1
+    user_ids = []
+    for registration_id in registration_ids:
+        before = extensions.db.registrations.find_one_and_update(
+            {'_id': registration_id, 'verified': {'$ne': True}},
+            {'$set': {'verified': True, 'verified_at': datetime.utcnow()}},
+            projection=projection
+        )
+        if before:
+            apply_rollup_delta(before, dict(before, verified=True))
+            user_ids.append(before.get('user_id'))
+    touch_attendees(user_ids)
+
+
+def _record_ca_approval_sent(ca_ids):
+    # The admin approves the CA when queueing the mail; a CA rejected since then stays rejected
+    extensions.db.ca_registrations.update_many(
+        {'_id': {'$in': ca_ids}, 'status': 'approved'},
+        {'$set': {'approval_sent_at': datetime.utcnow()}}
+    )
+
+
+# What each kind of outbox message sends, what to record once it went out,
+# the document state that record produces (`applied_query`) and the state
+# the document must still be in for the mail to go out at all (`send_query`)
+OUTBOX_KINDS = {
+    'reg_verification': {
+        'collection': 'registrations',
+        'send': send_reg_verification_email,
+        'on_sent': _mark_registrations_verified,
+        'applied_query': {'verified': True},
+        'send_query': {}
+    },
+    'ca_approval': {
+        'collection': 'ca_registrations',
+        'send': send_ca_approval_email,
+        'on_sent': _record_ca_approval_sent,
+        'applied_query': {'status': 'approved'},
+        'send_query': {'status': 'approved'}
+    }
+}
+
+
+def ensure_outbox_indexes():
+    db = extensions.db
+    db.email_outbox.create_index([('idempotency_key', 1)], unique=True)
+    db.email_outbox.create_index([('status', 1), ('next_attempt_at', 1)])
+    db.email_outbox.create_index([('ref_id', 1)])
+    db.email_outbox.create_index([('status', 1), ('applied', 1)])
+
+
+def _requeue_needed(job, resend):
+    """Whether a finished job must go out again.
+
+    A dead or cancelled job always does. A sent job does when the admin asks
+    for a resend, or when the document has left the state its mail produced.
+    A sent job whose side effect is still pending is left to
+    apply_pending_side_effects.
+    """
+    if job['status'] in ('dead', 'cancelled'):
+        return True
+    if job['status'] != 'sent' or not job.get('applied', True):
+        return False
+    if resend:
+        return True
+    spec = OUTBOX_KINDS[job['kind']]
+    return extensions.db[spec['collection']].count_documents(
+        dict(spec['applied_query'], _id=job['ref_id']), limit=1
+    ) == 0
+
+
+def enqueue_email(kind, ref_id, created_by=None, resend=False):
+    """Queue one message for a document, at most once per (kind, document).
+
+    Re-enqueueing a message that is queued, or sent with its document still
+    in the state it produced, returns the existing job. A dead-lettered or
+    cancelled job, a sent one whose document has since changed, or any sent
+    one when `resend` is set, is put back in the queue.
+    """
+    if kind not in OUTBOX_KINDS:
+        raise ValueError(f'Unknown outbox kind: {kind}')
+
+    db = extensions.db
+    now = datetime.utcnow()
+    job = db.email_outbox.find_one_and_update(
+        {'idempotency_key': f'{kind}:{ref_id}'},
+        {'$setOnInsert': {
+            'kind': kind,
+            'ref_id': ref_id,
+            'status': 'queued',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'locked_until': None,
+            'last_error': None,
+            'created_by': created_by,
+            'created_at': now,
+            'updated_at': now
+        }},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+    if _requeue_needed(job, resend):
+        job = db.email_outbox.find_one_and_update(
+            {'_id': job['_id'], 'status': job['status']},
+            {'$set': {
+                'status': 'queued',
+                'attempts': 0,
+                'next_attempt_at': now,
+                'last_error': None,
+                'created_by': created_by,
+                'updated_at': now
+            }},
+            return_document=ReturnDocument.AFTER
+        ) or job
+    return job
+
+
+def enqueue_emails(kind, ref_ids, created_by=None, resend=False):
+    return [enqueue_email(kind, ref_id, created_by, resend) for ref_id in ref_ids]
+
+
+def cancel_email(kind, ref_id):
+    """Cancel a document's queued or retrying message; returns whether one was cancelled.
+
+    A job already being sent is not interrupted; the send_query and on_sent
+    guards keep it from undoing the change that cancelled it.
+    """
+    now = datetime.utcnow()
+    result = extensions.db.email_outbox.update_one(
+        {'idempotency_key': f'{kind}:{ref_id}', 'status': {'$in': ['queued', 'retry']}},
+        {'$set': {'status': 'cancelled', 'cancelled_at': now, 'locked_until': None, 'updated_at': now}}
+    )
+    return result.modified_count == 1
+
+
+def get_job_statuses(job_ids):
+    """Status of outbox jobs for the admin UI to poll"""
+    object_ids = [ObjectId(job_id) for job_id in job_ids]
+    jobs = extensions.db.email_outbox.find(
+        {'_id': {'$in': object_ids}},
+        {'status': 1, 'attempts': 1, 'last_error': 1, 'ref_id': 1, 'kind': 1}
+    )
+    return [
+        {
+            'id': str(job['_id']),
+            'kind': job['kind'],
+            'ref_id': str(job['ref_id']),
+            'status': job['status'],
+            'attempts': job['attempts'],
+            'last_error': job.get('last_error')
+        }
+        for job in jobs
+    ]
+
+
+def claim_next_job(lease_seconds=None):
+    """Atomically take the next due job, or one whose worker died mid-send"""
+    db = extensions.db
+    now = datetime.utcnow()
+    lease_seconds = lease_seconds or Config.EMAIL_OUTBOX_LEASE_SECONDS
+    return db.email_outbox.find_one_and_update(
+        {'$or': [
+            {'status': {'$in': ['queued', 'retry']}, 'next_attempt_at': {'$lte': now}},
+            {'status': 'sending', 'locked_until': {'$lt': now}}
+        ]},
+        {
+            '$set': {
+                'status': 'sending',
+                'locked_until': now + timedelta(seconds=lease_seconds),
+                'updated_at': now
+            },
+            '$inc': {'attempts': 1}
+        },
+        sort=[('next_attempt_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _retry_delay(attempts):
+    delay = Config.EMAIL_OUTBOX_BACKOFF_SECONDS * (2 ** (attempts - 1))
+    return min(delay, Config.EMAIL_OUTBOX_MAX_BACKOFF_SECONDS)
+
+
+def _fail_job(job, error):
+    now = datetime.utcnow()
+    if job['attempts'] >= Config.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        update = {'status': 'dead', 'dead_at': now}
+    else:
+        update = {'status': 'retry', 'next_attempt_at': now + timedelta(seconds=_retry_delay(job['attempts']))}
+    update.update({'last_error': error, 'locked_until': None, 'updated_at': now})
+    extensions.db.email_outbox.update_one({'_id': job['_id']}, {'$set': update})
+
+
+def _cancel_claimed_job(job):
+    now = datetime.utcnow()
+    extensions.db.email_outbox.update_one({'_id': job['_id']}, {'$set': {
+        'status': 'cancelled', 'cancelled_at': now, 'locked_until': None, 'updated_at': now
+    }})
+
+
+def claim_jobs(limit):
+    """Claim up to `limit` due jobs for one batch"""
+    jobs = []
+    while len(jobs) < limit:
+        job = claim_next_job()
+        if not job:
+            break
+        jobs.append(job)
+    return jobs
+
+
+def process_jobs(jobs):
+    """Send a batch of claimed jobs through the concurrent bulk sender.
+
+    Only the jobs whose mail actually went out are marked sent and have their
+    registration verified / CA approval recorded; the rest are retried or
+    dead-lettered individually, and jobs whose document no longer matches the
+    kind's send_query are cancelled unsent. Must run inside a Flask app context. Returns the sent count.
+    """
+    db = extensions.db
+    by_kind = {}
+    for job in jobs:
+        by_kind.setdefault(job['kind'], []).append(job)
+
+    sent_count = 0
+    for kind, kind_jobs in by_kind.items():
+        spec = OUTBOX_KINDS.get(kind)
+        if not spec:
+            for job in kind_jobs:
+                _fail_job(job, f'Unknown kind {kind}')
+            continue
+
+        ref_ids = [job['ref_id'] for job in kind_jobs]
+        documents = {
+            doc['_id']: doc
+            for doc in db[spec['collection']].find(dict(spec['send_query'], _id={'$in': ref_ids}))
+        }
+        missing = [ref_id for ref_id in ref_ids if ref_id not in documents]
+        existing = {doc['_id'] for doc in db[spec['collection']].find({'_id': {'$in': missing}}, {'_id': 1})} if missing else set()
+        ready = []
+        for job in kind_jobs:
+            if job['ref_id'] in documents:
+                ready.append(job)
+            elif job['ref_id'] in existing:
+                # The document changed after the job was queued (a CA rejected again)
+                _cancel_claimed_job(job)
+            else:
+                # Nothing to retry: the document was deleted after the job was queued
+                job['attempts'] = Config.EMAIL_OUTBOX_MAX_ATTEMPTS
+                _fail_job(job, 'Referenced document not found')
+
+        results = send_concurrently(
+            [documents[job['ref_id']] for job in ready],
+            spec['send'],
+            max_workers=Config.EMAIL_WORKER_CONCURRENCY
+        )
+
+        sent_jobs = []
+        for job, result in zip(ready, results):
+            if result['success']:
+                sent_jobs.append(job)
+            else:
+                _fail_job(job, result['error'] or 'SMTP send failed')
+
+        if sent_jobs:
+            # Record the send before the side effect: a failure there must not
+            # leave the job leased and mail the recipient again
+            sent_ids = [job['_id'] for job in sent_jobs]
+            now = datetime.utcnow()
+            db.email_outbox.update_many(
+                {'_id': {'$in': sent_ids}},
+                {'$set': {'status': 'sent', 'applied': False, 'sent_at': now, 'locked_until': None,
+                          'last_error': None, 'updated_at': now}}
+            )
+            sent_count += len(sent_jobs)
+            _apply_side_effect(spec, sent_ids, [job['ref_id'] for job in sent_jobs])
+
+    return sent_count
+
+
+def _apply_side_effect(spec, job_ids, ref_ids):
+    try:
+        spec['on_sent'](ref_ids)
+    except Exception as e:
+        # apply_pending_side_effects retries it; on_sent is idempotent
+        print(f"Outbox side effect for {len(job_ids)} sent job(s) failed: {e}")
+        return
+    extensions.db.email_outbox.update_many(
+        {'_id': {'$in': job_ids}},
+        {'$set': {'applied': True, 'updated_at': datetime.utcnow()}}
+    )
+
+
+def apply_pending_side_effects(limit=500):
+    """Run on_sent for sent jobs whose side effect failed after the mail went out"""
+    jobs = list(extensions.db.email_outbox.find(
+        {'status': 'sent', 'applied': False}, {'kind': 1, 'ref_id': 1}
+    ).limit(limit))
+    by_kind = {}
+    for job in jobs:
+        by_kind.setdefault(job['kind'], []).append(job)
+    for kind, kind_jobs in by_kind.items():
+        _apply_side_effect(OUTBOX_KINDS[kind], [job['_id'] for job in kind_jobs],
+                           [job['ref_id'] for job in kind_jobs])
+    return len(jobs)
@@ -1,25 +1,57 @@
-import smtplib
+import copy
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from flask import current_app
-from threading import Thread
+from flask import current_app, render_template
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import qrcode
 from io import BytesIO
 from email.mime.image import MIMEImage
 from email.utils import formataddr
+from config import Config
+from utils.smtp_pool import get_smtp_pool
+from utils.tickets import document_ticket
+
+
+@lru_cache(maxsize=1)
+def _logo_part():
+    """Logo MIME part, read from disk and base64-encoded once per process"""
+    with open("logo-bangla.png", "rb") as f:
+        logo = MIMEImage(f.read())
+    logo.add_header('Content-ID', '<logo>')
+    return logo
+
+
+@lru_cache(maxsize=Config.QR_CACHE_SIZE)
+def _qr_png(code):
+    qr = qrcode.QRCode(box_size=6, border=4)
+    qr.add_data(code)
+    qr.make(fit=True)
+    # 1-bit black/white image, PNG-optimized: a fraction of the default RGB output
+    image = qr.make_image().get_image().convert('1')
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def qr_png(code):
+    """PNG bytes of the entry QR code for a payload, cached per process"""
+    return _qr_png(str(code))
+
+
+def ticket_qr_png(document):
+    """QR code carrying a signed ticket for a registration or CA application"""
+    return qr_png(document_ticket(document))
 
-def send_email(to_email, subject, body, is_html, buffer=None):
-    """Send an email using SMTP"""
+def send_email(to_email, subject, body, is_html, buffer=None, raise_errors=False):
+    """Send an email using SMTP; failures return False, or raise with raise_errors"""
     try:
         msg = MIMEMultipart("alternative")
         msg["Subject"] = subject
         msg['From'] = formataddr(("10thNCJ", current_app.config['MAIL_DEFAULT_SENDER']))
         msg['To'] = to_email
         
-        with open("logo-bangla.png", "rb") as f:
-            logo = MIMEImage(f.read())
-            logo.add_header('Content-ID', '<logo>')
-            msg.attach(logo)
+        msg.attach(copy.copy(_logo_part()))
         if buffer:
             image = MIMEImage(buffer.read())
             image.add_header('Content-ID', '<qr_code>')
@@ -30,240 +62,63 @@ def send_email(to_email, subject, body, is_html, buffer=None):
         else:
             msg.attach(MIMEText(body, 'plain'))
         
-        with smtplib.SMTP(current_app.config['MAIL_SERVER'],
-                         current_app.config['MAIL_PORT']) as server:
-            server.starttls()
-            server.login(current_app.config['MAIL_USERNAME'],
-                        current_app.config['MAIL_PASSWORD'])
-            server.send_message(msg)
+        # Reuse an authenticated connection instead of a fresh STARTTLS + login per message
+        get_smtp_pool(current_app.config).send_message(msg)
             
         return True
     except Exception as e:
         print(f"Error sending email: {e}")
+        if raise_errors:
+            raise
         return False
 
-def send_reg_verification_email(registration):
+def send_reg_verification_email(registration, raise_errors=False):
     """Send verification email to a participant"""
-    qr = qrcode.make(registration['user_id'])
-    buffer = BytesIO()
-    qr.save(buffer, format="PNG")
-    buffer.seek(0)
-    
-    div_text = f"({registration['division_name']})" if registration.get('division_name') else ""
-    
     subject = "১০ম  ন্যাশনাল কালচারাল জুবিলেশন-এ রেজিস্ট্রেশনের জন্য ধন্যবাদ"
-    body = f"""
-    <!DOCTYPE html>
-    <html lang="bn">
-    <head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>১০ম  ন্যাশনাল কালচারাল জুবিলেশন-এ রেজিস্ট্রেশনের জন্য ধন্যবাদ!</title>
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Baloo+Da+2:wght@400..800&display=swap" rel="stylesheet">
-
-    </head>
-    <body style="margin:0; padding:0; font-family: 'Baloo Da 2', sans-serif;">
-
-    <div style="max-width:600px; margin:30px auto; background:#ffffff;">
-
-        <!-- Logo -->
-        <div style="text-align:center; padding:20px; background:#734610;">
-            <img src="cid:logo" width="150">
-        </div>
-
-        <!-- Heading -->
-        <div style="background:#D9A23D; padding:30px 20px; text-align:center;">
-            <h1 style="margin:0; color:#261515; font-size:24px;">
-                ১০ম ন্যাশনাল কালচারাল জুবিলেশন-এ রেজিস্ট্রেশনের জন্য ধন্যবাদ!
-            </h1>
-        </div>
-
-        <!-- Event Strip -->
-        <div style="background:#734610; padding:15px; text-align:center;">
-            <span style="color:#ffffff; font-weight:bold; letter-spacing:1px;">
-                {registration['segment_name']}
-            </span>
-        </div>
-
-        <!-- Content -->
-        <div style="padding:30px; color:#261515; font-size:15px; line-height:1.7;">
-
-            <p>প্রিয় <strong>{registration['full_name']}</strong>,</p>
-
-            <p>
-                <strong>{registration['segment_name']} {div_text} </strong> ইভেন্টে আপনার রেজিস্ট্রেশন সফল হয়েছে।
-                অনুষ্ঠান দিনে নটর ডেম কলেজ, ঢাকা ক্যাম্পাসে প্রবেশের সময়
-                এই ইমেইলটি প্রদর্শন করবেন।
-                আপনার কোড নিচে দেওয়া হলো:
-            </p>
-
-            <!-- Code Box -->
-            <div style="text-align:center; margin:25px 0;">
-                <div style="display:inline-block; background:#D9C24E; padding:15px 30px; border-radius:8px;">
-                    <span id="confirmCode" style="font-size:22px; font-weight:bold; color:#402B12;">
-                        {registration['user_id']}
-                    </span>
-                </div>
-            </div>
-
-            <!-- QR Code -->
-            <div style="text-align:center; margin-bottom:25px;">
-                <img src="cid:qr_code" width="150" style="display:block; margin:0 auto;">
-                <p style="font-size:13px; color:#734610; margin-top:10px;">
-                    প্রবেশের সময় এই QR কোড স্ক্যান করা হবে
-                </p>
-            </div>
-
-
-            <p>
-                সময়সূচি জানতে আমাদের 
-                <a target="_blank" href="https://www.facebook.com/NDCCDhaka" style="color:#734610;">ফেসবুক পেজ</a> ভিজিট করুন।
-            </p>
-
-            <p>
-                প্রতিটি ইভেন্টের নিয়মাবলি জানতে আমাদের
-                <a target="_blank" href="https://ndcc.club" style="color:#734610;">ওয়েবসাইট</a> দেখুন।
-            </p>
-
-            <p style="margin-top:30px;">
-                শুভেচ্ছান্তে,<br>
-                <strong style="font-size:18px;">নটর ডেম কালচারাল ক্লাব</strong>
-            </p>
-
-        </div>
-
-        <!-- Footer -->
-        <div style="background:#261515; color:#ffffff; text-align:center; padding:20px; font-size:13px;">
-            © ২০২৬ NDCC, সর্বস্বত্ব সংরক্ষিত<br>
-            যোগাযোগ: {current_app.config['MAIL_DEFAULT_SENDER']}
-        </div>
-
-    </div>
+    body = render_template('email/reg_verification.html', registration=registration,
+                           ticket=document_ticket(registration))
+    
+    return send_email(registration['email'], subject, body, is_html=True,
+                      buffer=BytesIO(ticket_qr_png(registration)), raise_errors=raise_errors)
 
-    </body>
-    </html>
+def send_concurrently(items, send_fn, max_workers=None):
+    """Call send_fn(item, raise_errors=True) for every item over a bounded thread pool.
     
+    Throughput is capped by the SMTP pool's connection limit and MAIL_RATE_LIMIT.
+    Returns one result per item, in input order, with the exception text as
+    `error` when a send failed.
     """
+    if not items:
+        return []
     
-    return send_email(registration['email'], subject, body, is_html=True, buffer=buffer)
-
-def send_bulk_emails(recipients, subject=None):
-    """Send emails to multiple recipients in bulk"""
-    if not recipients:
-        return False
+    app = current_app._get_current_object()
+    max_workers = max_workers or app.config.get('MAIL_POOL_SIZE', 3)
     
-    success_count = 0
+    def _send(item):
+        with app.app_context():
+            try:
+                return {'success': bool(send_fn(item, raise_errors=True)), 'error': None}
+            except Exception as e:
+                return {'success': False, 'error': str(e)}
     
-    for recipient in recipients:
-        qr = qrcode.make({recipient['user_id']})
-        buffer = BytesIO()
-        qr.save(buffer, format="PNG")
-        buffer.seek(0)
-        
-        div_text = f"({recipient['division_name']})" if recipient.get('division_name') else ""
-        email_subject = "১০ম  ন্যাশনাল কালচারাল জুবিলেশন-এ রেজিস্ট্রেশনের জন্য ধন্যবাদ"
-        email_body = f"""
-        <!DOCTYPE html>
-        <html lang="bn">
-        <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>১০ম  ন্যাশনাল কালচারাল জুবিলেশন-এ রেজিস্ট্রেশনের জন্য ধন্যবাদ!</title>
-        <link rel="preconnect" href="https://fonts.googleapis.com">
-        <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-        <link href="https://fonts.googleapis.com/css2?family=Baloo+Da+2:wght@400..800&display=swap" rel="stylesheet">
-
-        </head>
-        <body style="margin:0; padding:0; font-family: 'Baloo Da 2', sans-serif;">
-
-        <div style="max-width:600px; margin:30px auto; background:#ffffff;">
-
-            <!-- Logo -->
-            <div style="text-align:center; padding:20px; background:#734610;">
-                <img src="cid:logo" width="150">
-            </div>
-
-            <!-- Heading -->
-            <div style="background:#D9A23D; padding:30px 20px; text-align:center;">
-                <h1 style="margin:0; color:#261515; font-size:24px;">
-                    ১০ম ন্যাশনাল কালচারাল জুবিলেশন-এ রেজিস্ট্রেশনের জন্য ধন্যবাদ!
-                </h1>
-            </div>
-
-            <!-- Event Strip -->
-            <div style="background:#734610; padding:15px; text-align:center;">
-                <span style="color:#ffffff; font-weight:bold; letter-spacing:1px;">
-                    {recipient['segment_name']}
-                </span>
-            </div>
-
-            <!-- Content -->
-            <div style="padding:30px; color:#261515; font-size:15px; line-height:1.7;">
-
-                <p>প্রিয় <strong>{recipient.get('full_name', 'Participant')}</strong>,</p>
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(_send, items))
 
-                <p>
-                    <strong>{recipient['segment_name']} {div_text}</strong> ইভেন্টে আপনার রেজিস্ট্রেশন সফল হয়েছে।
-                    অনুষ্ঠান দিনে নটর ডেম কলেজ, ঢাকা ক্যাম্পাসে প্রবেশের সময়
-                    এই ইমেইলটি প্রদর্শন করবেন।
-                    আপনার কোড নিচে দেওয়া হলো:
-                </p>
-
-                <!-- Code Box -->
-                <div style="text-align:center; margin:25px 0;">
-                    <div style="display:inline-block; background:#D9C24E; padding:15px 30px; border-radius:8px;">
-                        <span id="confirmCode" style="font-size:22px; font-weight:bold; color:#402B12;">
-                            {recipient['user_id']}
-                        </span>
-                    </div>
-                </div>
-
-                <!-- QR Code -->
-                <div style="text-align:center; margin-bottom:25px;">
-                    <img src="cid:qr_code" width="150" style="display:block; margin:0 auto;">
-                    <p style="font-size:13px; color:#734610; margin-top:10px;">
-                        প্রবেশের সময় এই QR কোড স্ক্যান করা হবে
-                    </p>
-                </div>
-
-
-                <p>
-                    সময়সূচি জানতে আমাদের 
-                    <a target="_blank" href="https://www.facebook.com/NDCCDhaka" style="color:#734610;">ফেসবুক পেজ</a> ভিজিট করুন।
-                </p>
-
-                <p>
-                    প্রতিটি ইভেন্টের নিয়মাবলি জানতে আমাদের
-                    <a target="_blank" href="https://ndcc.club" style="color:#734610;">ওয়েবসাইট</a> দেখুন।
-                </p>
-
-                <p style="margin-top:30px;">
-                    শুভেচ্ছান্তে,<br>
-                    <strong style="font-size:18px;">নটর ডেম কালচারাল ক্লাব</strong>
-                </p>
-
-            </div>
-
-            <!-- Footer -->
-            <div style="background:#261515; color:#ffffff; text-align:center; padding:20px; font-size:13px;">
-                © ২০২৬ NDCC, সর্বস্বত্ব সংরক্ষিত<br>
-                যোগাযোগ: {current_app.config['MAIL_DEFAULT_SENDER']}
-            </div>
-
-        </div>
-
-        </body>
-        </html>
-        
-        """
-        
-        
-        if send_email(recipient['email'], email_subject, email_body, True, buffer=buffer):
-            success_count += 1
+def send_bulk_emails(recipients, subject=None):
+    """Send registration emails to multiple recipients concurrently.
     
-    return success_count > 0
+    Returns a list of per-recipient results: id, email, success and error.
+    """
+    results = send_concurrently(recipients, send_reg_verification_email)
+    return [
+        {
+            'id': str(recipient['_id']),
+            'email': recipient['email'],
+            'success': result['success'],
+            'error': result['error']
+        }
+        for recipient, result in zip(recipients, results)
+    ]
 
 def send_email_async(app, to_email, subject, body):
     """Send email asynchronously"""
@@ -271,101 +126,10 @@ def send_email_async(app, to_email, subject, body):
         send_email(to_email, subject, body)
 
 
-def send_ca_approval_email(ca_registration):
+def send_ca_approval_email(ca_registration, raise_errors=False):
     """Send approval email to CA"""
-    qr = qrcode.make(ca_registration['user_id'])
-    buffer = BytesIO()
-    qr.save(buffer, format="PNG")
-    buffer.seek(0)
-    
     subject = "১০ম ন্যাশনাল কালচারাল জুবিলেশন - সিএ রেজিস্ট্রেশন"
-    body = f"""
-    <!DOCTYPE html>
-    <html lang="bn">
-    <head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>১০ম ন্যাশনাল কালচারাল জুবিলেশন-এ সিএ রেজিস্ট্রেশনের জন্য ধন্যবাদ!</title>
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Baloo+Da+2:wght@400..800&display=swap" rel="stylesheet">
-
-    </head>
-    <body style="margin:0; padding:0; font-family: 'Baloo Da 2', sans-serif;">
-
-    <div style="max-width:600px; margin:30px auto; background:#ffffff;">
-
-        <!-- Logo -->
-        <div style="text-align:center; padding:20px; background:#734610;">
-            <img src="cid:logo" width="150">
-        </div>
-
-        <!-- Heading -->
-        <div style="background:#D9A23D; padding:30px 20px; text-align:center;">
-            <h1 style="margin:0; color:#261515; font-size:24px;">
-                ১০ম ন্যাশনাল কালচারাল জুবিলেশন-এ সিএ রেজিস্ট্রেশনের জন্য ধন্যবাদ!
-            </h1>
-        </div>
-
-        <!-- Content -->
-        <div style="padding:30px; color:#261515; font-size:15px; line-height:1.7;">
-
-            <p>প্রিয় <strong>{ca_registration['full_name']}</strong>,</p>
-
-            <p>
-                ১০ম ন্যাশনাল কালচারাল জুবিলেশন-এ ক্যামপাস অ্যাম্বাসেডর হিসেবে রেজিস্ট্রেশনের জন্য আপনাকে আন্তরিক অভিনন্দন ও ধন্যবাদ।
-                আপনার রেজিস্ট্রেশন সফলভাবে সম্পন্ন হয়েছে। আপনার নির্ধারিত সিএ কোড নিচে প্রদান করা হলো:
-            </p>
-
-            <!-- Code Box -->
-            <div style="text-align:center; margin:25px 0;">
-                <div style="display:inline-block; background:#D9C24E; padding:15px 30px; border-radius:8px;">
-                    <span id="confirmCode" style="font-size:22px; font-weight:bold; color:#402B12;">
-                        {ca_registration['ca_code']}
-                    </span>
-                </div>
-            </div>
-
-            <p>
-                অনুগ্রহ করে এই কোডটি সংরক্ষণ করুন।  রেজিস্ট্রেশনের সময় কোডটি ব্যবহার করতে উৎসাহিত করুন। আপনার সক্রিয় অংশগ্রহণ আমাদের আয়োজনকে আরও সফল করে তুলবে — এই প্রত্যাশায়।
-            </p>
-            
-            <!-- QR Code -->
-            <div style="text-align:center; margin-bottom:25px;">
-                <img src="cid:qr_code" width="150" style="display:block; margin:0 auto;">
-                <p style="font-size:13px; color:#734610; margin-top:10px;">
-                    প্রবেশের সময় এই QR কোড স্ক্যান করা হবে
-                </p>
-            </div>
-
-            <p>
-                সময়সূচি জানতে আমাদের 
-                <a target="_blank" href="https://www.facebook.com/NDCCDhaka" style="color:#734610;">ফেসবুক পেজ</a> ভিজিট করুন।
-            </p>
-
-            <p>
-                প্রতিটি ইভেন্টের নিয়মাবলি জানতে আমাদের
-                <a target="_blank" href="https://ndcc.club" style="color:#734610;">ওয়েবসাইট</a> দেখুন।
-            </p>
-
-            <p style="margin-top:30px;">
-                শুভেচ্ছান্তে,<br>
-                <strong style="font-size:18px;">নটর ডেম কালচারাল ক্লাব</strong>
-            </p>
-
-        </div>
-
-        <!-- Footer -->
-        <div style="background:#261515; color:#ffffff; text-align:center; padding:20px; font-size:13px;">
-            © ২০২৬ NDCC, সর্বস্বত্ব সংরক্ষিত<br>
-            যোগাযোগ: ndcc.it.dept@gmail.com
-        </div>
-
-    </div>
-
-    </body>
-    </html>
-
-    """
+    body = render_template('email/ca_approval.html', ca_registration=ca_registration)
     
-    return send_email(ca_registration['email'], subject, body, is_html=True, buffer=buffer)
\ No newline at end of file
+    return send_email(ca_registration['email'], subject, body, is_html=True,
+                      buffer=BytesIO(ticket_qr_png(ca_registration)), raise_errors=raise_errors)
@@ -0,0 +1,303 @@
+import hashlib
+import json
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+import gridfs
+from bson import ObjectId
+from flask import Response, request
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from werkzeug.wsgi import wrap_file
+
+import extensions
+from config import Config
+from utils.export_service import (BOB_COLUMNS, CA_COLUMNS, REGISTRATION_COLUMNS, XLSX_MAX_COLUMN_WIDTH,
+                                  XLSX_MIMETYPE, export_projection, join_users, write_csv, write_xlsx)
+
+# Job lifecycle: queued -> running -> done, or failed. A running job whose
+# lease expired (worker died) is picked up again by the next claim. Queued
+# and running jobs carry active=True; a unique partial index on
+# (filter_key, active) allows only one of them per export.
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': XLSX_MIMETYPE
+}
+
+# What each export reads, which filters it accepts and how its file is named
+EXPORT_KINDS = {
+    'registrations': {
+        'collection': 'registrations',
+        'columns': REGISTRATION_COLUMNS,
+        'filters': ('segment_id', 'verified'),
+        'formats': ('csv', 'xlsx'),
+        'sheet_title': 'Registrations',
+        'filenames': {'csv': 'registrations.csv', 'xlsx': 'registrations.xlsx'}
+    },
+    'ca_registrations': {
+        'collection': 'ca_registrations',
+        'columns': CA_COLUMNS,
+        'filters': ('status',),
+        'formats': ('csv', 'xlsx'),
+        'sheet_title': 'CARegistrations',
+        'filenames': {'csv': 'ca_registrations.csv', 'xlsx': 'caregistrations.xlsx'},
+        'user_fields': ['facebook_link']
+    },
+    'bob_registrations': {
+        'collection': 'bob_registrations',
+        'columns': BOB_COLUMNS,
+        'filters': ('status',),
+        'formats': ('xlsx',),
+        'sheet_title': 'BoBRegistrations',
+        'filenames': {'xlsx': 'bob_registrations_{timestamp}.xlsx'},
+        'fixed_widths': {'Members': XLSX_MAX_COLUMN_WIDTH}
+    }
+}
+
+
+def _fs():
+    return gridfs.GridFS(extensions.db, collection='export_files')
+
+
+def ensure_export_indexes():
+    db = extensions.db
+    db.export_jobs.create_index([('filter_key', 1), ('created_at', -1)])
+    db.export_jobs.create_index([('status', 1), ('created_at', 1)])
+    db.export_jobs.create_index(
+        [('filter_key', 1), ('active', 1)],
+        unique=True,
+        partialFilterExpression={'active': True},
+        name='one_active_job_per_export'
+    )
+
+
+def clean_filters(kind, args):
+    """Keep only the non-empty filters an export kind understands"""
+    spec = EXPORT_KINDS[kind]
+    return {name: args.get(name) for name in spec['filters'] if args.get(name)}
+
+
+def export_query(kind, filters):
+    query = {}
+    if filters.get('segment_id'):
+        query['segment_id'] = ObjectId(filters['segment_id'])
+    if filters.get('verified') in ('true', 'false'):
+        query['verified'] = filters['verified'] == 'true'
+    if filters.get('status'):
+        query['status'] = filters['status']
+    return query
+
+
+def export_documents(kind, filters):
+    """Projected cursor for an export, joined with user fields where needed"""
+    spec = EXPORT_KINDS[kind]
+    projection = export_projection(spec['columns'])
+    if spec.get('user_fields'):
+        projection['user_id'] = 1
+
+    documents = extensions.db[spec['collection']].find(
+        export_query(kind, filters), projection
+    ).batch_size(1000)
+    if spec.get('user_fields'):
+        documents = join_users(documents, extensions.db.users, spec['user_fields'])
+    return documents
+
+
+def _filter_key(kind, format_type, filters):
+    raw = json.dumps([kind, format_type, filters], sort_keys=True)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def enqueue_export(kind, format_type, filters, created_by=None):
+    """Queue an export, or return a matching one that is still usable.
+
+    A job with the same kind, format and filters is reused while it is queued
+    or running, or if it finished within the last EXPORT_REUSE_SECONDS.
+    The active job is claimed with an upsert on the unique partial index, so
+    simultaneous requests (a double click) share a single job.
+    Returns (job, reused).
+    """
+    spec = EXPORT_KINDS.get(kind)
+    if not spec:
+        raise ValueError(f'Unknown export kind: {kind}')
+    if format_type not in spec['formats']:
+        raise ValueError(f'{kind} cannot be exported as {format_type}')
+
+    # Fail on a malformed filter now rather than in the worker
+    export_query(kind, filters)
+
+    db = extensions.db
+    now = datetime.utcnow()
+    filter_key = _filter_key(kind, format_type, filters)
+    recent = db.export_jobs.find_one(
+        {'filter_key': filter_key, 'status': 'done',
+         'finished_at': {'$gte': now - timedelta(seconds=Config.EXPORT_REUSE_SECONDS)}},
+        sort=[('created_at', -1)]
+    )
+    if recent:
+        return recent, True
+
+    filename = spec['filenames'][format_type].format(timestamp=now.strftime('%Y%m%d_%H%M%S'))
+    job_id = ObjectId()
+    new_job = {
+        '_id': job_id,
+        'kind': kind,
+        'format': format_type,
+        'filters': filters,
+        'filename': filename,
+        'status': 'queued',
+        'rows_done': 0,
+        'rows_total': None,
+        'file_id': None,
+        'size': None,
+        'error': None,
+        'attempts': 0,
+        'locked_until': None,
+        'created_by': created_by,
+        'created_at': now,
+        'updated_at': now
+    }
+    for attempt in range(2):
+        try:
+            job = db.export_jobs.find_one_and_update(
+                {'filter_key': filter_key, 'active': True},
+                {'$setOnInsert': new_job},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return job, job['_id'] != job_id
+        except DuplicateKeyError:
+            # Another request inserted the active job first; the retry finds it
+            if attempt:
+                raise
+
+
+def get_export_job(job_id):
+    return extensions.db.export_jobs.find_one({'_id': ObjectId(job_id)})
+
+
+def export_job_status(job):
+    """Progress summary for the admin page to poll"""
+    return {
+        'id': str(job['_id']),
+        'kind': job['kind'],
+        'format': job['format'],
+        'status': job['status'],
+        'rows_done': job.get('rows_done', 0),
+        'rows_total': job.get('rows_total'),
+        'filename': job['filename'],
+        'size': job.get('size'),
+        'error': job.get('error')
+    }
+
+
+def claim_export_job():
+    """Atomically take the oldest queued job, or one whose worker died"""
+    now = datetime.utcnow()
+    return extensions.db.export_jobs.find_one_and_update(
+        {'$or': [
+            {'status': 'queued'},
+            {'status': 'running', 'locked_until': {'$lt': now}}
+        ]},
+        {
+            '$set': {
+                'status': 'running',
+                'started_at': now,
+                'locked_until': now + timedelta(seconds=Config.EXPORT_JOB_LEASE_SECONDS),
+                'updated_at': now
+            },
+            '$inc': {'attempts': 1}
+        },
+        sort=[('created_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _track_progress(job_id, documents):
+    """Yield documents, recording progress and extending the lease as rows go by"""
+    db = extensions.db
+    rows_done = 0
+    for doc in documents:
+        yield doc
+        rows_done += 1
+        if rows_done % Config.EXPORT_PROGRESS_EVERY == 0:
+            now = datetime.utcnow()
+            db.export_jobs.update_one({'_id': job_id}, {'$set': {
+                'rows_done': rows_done,
+                'locked_until': now + timedelta(seconds=Config.EXPORT_JOB_LEASE_SECONDS),
+                'updated_at': now
+            }})
+
+
+def run_export_job(job):
+    """Write a claimed job's file into GridFS and mark it done, or failed"""
+    db = extensions.db
+    spec = EXPORT_KINDS[job['kind']]
+    query = export_query(job['kind'], job['filters'])
+    rows_total = db[spec['collection']].count_documents(query)
+    db.export_jobs.update_one({'_id': job['_id']}, {'$set': {'rows_total': rows_total, 'rows_done': 0}})
+
+    documents = _track_progress(job['_id'], export_documents(job['kind'], job['filters']))
+    try:
+        # Spool to disk first: openpyxl needs a seekable file to write the zip
+        with tempfile.TemporaryFile() as spool:
+            if job['format'] == 'csv':
+                write_csv(documents, spec['columns'], spool)
+            else:
+                write_xlsx(documents, spec['columns'], spec['sheet_title'], spool, spec.get('fixed_widths'))
+            size = spool.tell()
+            spool.seek(0)
+
+            with _fs().new_file(filename=job['filename'], content_type=CONTENT_TYPES[job['format']]) as grid_in:
+                shutil.copyfileobj(spool, grid_in)
+            file_id = grid_in._id
+    except Exception as e:
+        now = datetime.utcnow()
+        db.export_jobs.update_one({'_id': job['_id']}, {'$set': {
+            'status': 'failed', 'error': str(e), 'locked_until': None, 'finished_at': now, 'updated_at': now
+        }, '$unset': {'active': ''}})
+        raise
+
+    now = datetime.utcnow()
+    db.export_jobs.update_one({'_id': job['_id']}, {'$set': {
+        'status': 'done',
+        'rows_done': rows_total,
+        'file_id': file_id,
+        'size': size,
+        'locked_until': None,
+        'finished_at': now,
+        'updated_at': now
+    }, '$unset': {'active': ''}})
+
+
+def purge_expired_exports():
+    """Delete finished jobs and their files once past EXPORT_RETENTION_SECONDS"""
+    db = extensions.db
+    cutoff = datetime.utcnow() - timedelta(seconds=Config.EXPORT_RETENTION_SECONDS)
+    fs = _fs()
+    removed = 0
+    for job in db.export_jobs.find({'status': {'$in': ['done', 'failed']}, 'finished_at': {'$lt': cutoff}}, {'file_id': 1}):
+        if job.get('file_id'):
+            fs.delete(job['file_id'])
+        db.export_jobs.delete_one({'_id': job['_id']})
+        removed += 1
+    return removed
+
+
+def export_file_response(job):
+    """Serve a finished job's file from GridFS, honouring Range and If-None-Match"""
+    grid_out = _fs().get(job['file_id'])
+    response = Response(
+        wrap_file(request.environ, grid_out),
+        mimetype=grid_out.content_type,
+        direct_passthrough=True
+    )
+    response.headers['Content-Disposition'] = f"attachment; filename={job['filename']}"
+    # Advertise ranges on full responses too so interrupted downloads can resume
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.content_length = grid_out.length
+    response.last_modified = grid_out.upload_date
+    response.set_etag(str(job['file_id']))
+    return response.make_conditional(request, accept_ranges=True, complete_length=grid_out.length)
@@ -1,368 +1,276 @@
 from datetime import datetime
+import csv
 import io
+import tempfile
+from itertools import islice
 
-import pandas as pd
-from io import BytesIO, StringIO
 from flask import Response
 from bson import ObjectId
 from openpyxl import Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+from openpyxl.utils import get_column_letter
 
-def safe_str(value):
-    """Convert any value to string safely"""
-    if value is None:
-        return ''
-    if isinstance(value, ObjectId):
-        return str(value)
-    if isinstance(value, datetime):
-        return value.strftime('%Y-%m-%d %H:%M:%S')
-    if isinstance(value, bool):
-        return 'Yes' if value else 'No'
-    return str(value)
+# Rows are flushed to the client whenever this much CSV text has accumulated
+CSV_CHUNK_SIZE = 64 * 1024
 
+# XLSX column widths are computed from this many leading rows, then capped
+XLSX_WIDTH_SAMPLE_ROWS = 500
+XLSX_MAX_COLUMN_WIDTH = 50
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 
-def export_to_excel(registrations):
-    """Export registrations to Excel format"""
-    # Convert to DataFrame
-    data = []
-    for reg in registrations:
-        data.append(
-            {
-                "ID": str(reg.get("_id", "")),
-                "Full Name": reg.get("full_name", ""),
-                "Email": reg.get("email", ""),
-                "Institution": reg.get("institution", ""),
-                "Segment": reg.get("segment_name", ""),
-                "Category": reg.get("category", ""),
-                "Division": reg.get("division_name", ""),
-                "Submission Link": reg.get("submission_link", ""),
-                "CA Ref": reg.get("ca_ref", ""),
-                "Bkash Number": reg.get("bkash_number", ""),
-                "Transaction ID": reg.get("transaction_id", ""),
-                "Receipt": reg.get("receipt", ""),
-                "Verified": "Yes" if reg.get("verified") else "No",
-                "Registration Date": reg.get("registration_date", ""),
-                "Verified At": reg.get("verified_at", ""),
-                "Firebase uid": reg.get("firebase_uid", ""),
-                "IP Address": reg.get("ip_address", ""),
-            }
-        )
+# Registration export columns: (header, document field, formatter)
+REGISTRATION_COLUMNS = [
+    ("ID", "_id", None),
+    ("Full Name", "full_name", None),
+    ("Email", "email", None),
+    ("Institution", "institution", None),
+    ("Segment", "segment_name", None),
+    ("Category", "category", None),
+    ("Division", "division_name", None),
+    ("Submission Link", "submission_link", None),
+    ("CA Ref", "ca_ref", None),
+    ("Bkash Number", "bkash_number", None),
+    ("Transaction ID", "transaction_id", None),
+    ("Receipt", "receipt", None),
+    ("Verified", "verified", lambda value: "Yes" if value else "No"),
+    ("Registration Date", "registration_date", None),
+    ("Verified At", "verified_at", None),
+    ("Firebase uid", "firebase_uid", None),
+    ("IP Address", "ip_address", None),
+]
 
-    df = pd.DataFrame(data)
-    
-    # Create Excel file in memory
-    output = BytesIO()
-    
-    # Use openpyxl directly without pandas ExcelWriter
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Registrations"
-    
-    # Write headers
-    for col_num, column_title in enumerate(df.columns, 1):
-        ws.cell(row=1, column=col_num, value=column_title)
-    
-    # Write data
-    for row_num, row_data in enumerate(df.values, 2):
-        for col_num, cell_value in enumerate(row_data, 1):
-            ws.cell(row=row_num, column=col_num, value=cell_value)
-    
-    # Auto-adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    wb.save(output)
-    output.seek(0)
-    
-    return Response(
-        output.getvalue(),
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        headers={'Content-Disposition': 'attachment;filename=registrations.xlsx'}
+
+def _format_members(members):
+    return "\n".join(
+        f"{member.get('position', '')}. {member.get('name', '')} - {member.get('role', '')}"
+        for member in members or []
     )
 
 
-def export_to_csv(registrations):
-    """Export registrations to CSV format with proper formatting"""
-    # Convert to DataFrame with safe string conversion
-    data = []
-    for reg in registrations:
-        # Format registration date
-        reg_date = reg.get('registration_date')
-        if isinstance(reg_date, datetime):
-            formatted_reg_date = reg_date.strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            formatted_reg_date = safe_str(reg_date)
-        
-        # Format verified date
-        verified_at = reg.get('verified_at')
-        if isinstance(verified_at, datetime):
-            formatted_verified_at = verified_at.strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            formatted_verified_at = safe_str(verified_at)
-        
-        data.append({
-            "ID": safe_str(reg.get("_id")),
-            "Full Name": safe_str(reg.get("full_name")),
-            "Email": safe_str(reg.get("email")),
-            "Institution": safe_str(reg.get("institution")),
-            "Segment": safe_str(reg.get("segment_name")),
-            "Category": safe_str(reg.get("category")),
-            "Division": safe_str(reg.get("division_name")),
-            "Submission Link": safe_str(reg.get("submission_link")),
-            "CA Ref": safe_str(reg.get("ca_ref")),
-            "Bkash Number": safe_str(reg.get("bkash_number")),
-            "Transaction ID": safe_str(reg.get("transaction_id")),
-            "Receipt": safe_str(reg.get("receipt")),
-            "Verified": "Yes" if reg.get("verified") else "No",
-            "Registration Date": formatted_reg_date,
-            "Verified At": formatted_verified_at,
-            "Firebase uid": safe_str(reg.get("firebase_uid")),
-            "IP Address": safe_str(reg.get("ip_address")),
-        })
-
-    # Convert to DataFrame
-    df = pd.DataFrame(data)
-    
-    # Handle empty DataFrame
-    if df.empty:
-        df = pd.DataFrame(columns=[
-            "ID", "Full Name", "Email", "Institution", "Segment",
-            "Category", "Submission Link", "CA Ref", "Bkash Number",
-            "Transaction ID", "Verified", "Registration Date",
-            "Verified At", "Firebase uid", "IP Address"
+CA_COLUMNS = [
+    ("ID", "_id", None),
+    ("CA Code", "ca_code", None),
+    ("Profile", "profile_picture", None),
+    ("Full Name", "full_name", None),
+    ("Email", "email", None),
+    ("Institution", "institution", None),
+    ("Class", "class", None),
+    ("Phone Number", "phone", None),
+    ("Status", "status", None),
+    ("Facebook", "facebook_link", None),
+    ("Why CA", "why_ca", None),
+    ("Registration Date", "registration_date", None),
+    ("Firebase uid", "firebase_uid", None),
+    ("IP Address", "ip_address", None),
+]
+
+BOB_COLUMNS = [
+    ("ID", "_id", None),
+    ("Band Name", "band_name", None),
+    ("Email", "email", None),
+    ("Genre", "band_genre", None),
+    ("Member Count", "member_count", lambda value: value or 0),
+    ("Members", "members", _format_members),
+    ("Jamming Clip", "jamming_clip", None),
+    ("CA Reference", "ca_reference", lambda value: value or ""),
+    ("Verified", "verified", lambda value: "Yes" if value else "No"),
+    ("Status", "status", lambda value: value or "pending"),
+    ("Registration Date", "registration_date", None),
+    ("Firebase uid", "firebase_uid", None),
+    ("User ID", "user_id", lambda value: str(value) if value else ""),
+    ("IP Address", "ip_address", None),
+]
+
+
+def export_projection(columns):
+    """Mongo projection covering exactly the fields an export reads"""
+    return {field: 1 for _, field, _ in columns}
+
+
+def iter_csv(documents, columns):
+    """Yield UTF-8 CSV (with a BOM for Excel) in chunks while iterating documents.
+    
+    The header is yielded before the first document is read, so the response
+    starts immediately and memory stays flat regardless of row count.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow([header for header, _, _ in columns])
+    yield '\ufeff'.encode('utf-8') + buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+    
+    for doc in documents:
+        writer.writerow([
+            formatter(doc.get(field)) if formatter else safe_str(doc.get(field))
+            for _, field, formatter in columns
         ])
+        if buffer.tell() >= CSV_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
     
-    # Create CSV with UTF-8 encoding
-    output = io.StringIO()
-    df.to_csv(output, index=False, encoding='utf-8')
-    output.seek(0)
-    
-    # Convert to bytes for response with BOM for Excel
-    csv_bytes = output.getvalue().encode('utf-8-sig')
-    
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def stream_csv(documents, columns, filename):
+    """Streamed CSV download response"""
     return Response(
-        csv_bytes,
+        iter_csv(documents, columns),
         mimetype='text/csv',
         headers={
-            'Content-Disposition': 'attachment; filename=registrations.csv',
+            'Content-Disposition': f'attachment; filename={filename}',
             'Content-Type': 'text/csv; charset=utf-8'
         }
     )
 
 
-def export_ca_to_csv(ca_data):
-    """Export CA registrations to CSV format with proper formatting"""
-    # Convert to DataFrame with safe string conversion
-    data = []
-    for ca in ca_data:
-        # Format registration date
-        reg_date = ca.get('registration_date')
-        if isinstance(reg_date, datetime):
-            formatted_reg_date = reg_date.strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            formatted_reg_date = safe_str(reg_date)
+def join_users(documents, users, fields, batch_size=1000):
+    """Copy `fields` from each document's user onto it while streaming.
+    
+    Users are fetched with one projected $in query per batch of documents
+    instead of one find_one per document.
+    """
+    projection = {field: 1 for field in fields}
+    documents = iter(documents)
+    while True:
+        batch = list(islice(documents, batch_size))
+        if not batch:
+            break
         
-        data.append({
-            "ID": safe_str(ca.get("_id")),
-            "CA Code": safe_str(ca.get("ca_code")),
-            "Profile": safe_str(ca.get("profile_picture")),
-            "Full Name": safe_str(ca.get("full_name")),
-            "Email": safe_str(ca.get("email")),
-            "Institution": safe_str(ca.get("institution")),
-            "Class": safe_str(ca.get("class")),
-            "Phone Number": safe_str(ca.get("phone")),
-            "Status": safe_str(ca.get("status")),
-            "Facebook": safe_str(ca.get("facebook_link")),
-            "Why CA": safe_str(ca.get("why_ca")),
-            "Registration Date": formatted_reg_date,
-            "Firebase uid": safe_str(ca.get("firebase_uid")),
-            "IP Address": safe_str(ca.get("ip_address")),
-        })
-
-    # Convert to DataFrame
-    df = pd.DataFrame(data)
-    
-    # Handle empty DataFrame
-    if df.empty:
-        df = pd.DataFrame(columns=[
-            "ID", "CA Code", "Profile", "Full Name", "Email", 
-            "Institution", "Class", "Phone Number", "Status", 
-            "Why CA", "Registration Date", "Firebase uid", "IP Address"
-        ])
+        user_ids = {doc['user_id'] for doc in batch if doc.get('user_id')}
+        users_by_id = {}
+        if user_ids:
+            users_by_id = {
+                user['_id']: user
+                for user in users.find({'_id': {'$in': list(user_ids)}}, projection)
+            }
+        
+        for doc in batch:
+            user = users_by_id.get(doc.get('user_id'), {})
+            for field in fields:
+                doc[field] = user.get(field)
+            yield doc
+
+
+def excel_value(value):
+    """Convert a document value to something openpyxl can write natively"""
+    if value is None or isinstance(value, (str, int, float, bool, datetime)):
+        return value
+    return str(value)
+
+
+def _excel_row(doc, columns):
+    return [
+        formatter(doc.get(field)) if formatter else excel_value(doc.get(field))
+        for _, field, formatter in columns
+    ]
+
+
+def _iter_file(handle, chunk_size=CSV_CHUNK_SIZE):
+    try:
+        while True:
+            chunk = handle.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        handle.close()
+
+
+def write_xlsx(documents, columns, sheet_title, output, fixed_widths=None):
+    """Write documents to a write-only workbook in one pass.
+    
+    Column widths are sized from the first XLSX_WIDTH_SAMPLE_ROWS rows, since
+    write-only mode needs them before any row is written.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_title)
+    
+    headers = [header for header, _, _ in columns]
+    documents = iter(documents)
+    sample = [_excel_row(doc, columns) for doc in islice(documents, XLSX_WIDTH_SAMPLE_ROWS)]
+    
+    for index, header in enumerate(headers):
+        max_length = max([len(header)] + [len(str(row[index])) for row in sample if row[index] is not None])
+        width = min(max_length + 2, XLSX_MAX_COLUMN_WIDTH)
+        if fixed_widths and header in fixed_widths:
+            width = fixed_widths[header]
+        ws.column_dimensions[get_column_letter(index + 1)].width = width
+    
+    ws.append(headers)
+    for row in sample:
+        ws.append(row)
+    for doc in documents:
+        ws.append(_excel_row(doc, columns))
     
-    # Create CSV with UTF-8 encoding
-    output = io.StringIO()
-    df.to_csv(output, index=False, encoding='utf-8')
+    wb.save(output)
+
+
+def write_csv(documents, columns, output):
+    """Write the same bytes stream_csv would send to a binary file"""
+    for chunk in iter_csv(documents, columns):
+        output.write(chunk)
+
+
+def stream_xlsx(documents, columns, sheet_title, filename, fixed_widths=None):
+    """Build the workbook in a temp file and stream it back"""
+    output = tempfile.TemporaryFile()
+    try:
+        write_xlsx(documents, columns, sheet_title, output, fixed_widths)
+    except Exception:
+        output.close()
+        raise
+    size = output.tell()
     output.seek(0)
     
-    # Convert to bytes for response with BOM for Excel
-    csv_bytes = output.getvalue().encode('utf-8-sig')
-    
     return Response(
-        csv_bytes,
-        mimetype='text/csv',
+        _iter_file(output),
+        mimetype=XLSX_MIMETYPE,
         headers={
-            'Content-Disposition': 'attachment; filename=ca_registrations.csv',
-            'Content-Type': 'text/csv; charset=utf-8'
+            'Content-Disposition': f'attachment; filename={filename}',
+            'Content-Length': str(size)
         }
     )
 
 
-def export_ca_to_excel(ca_data):
-    """Export registrations to CSV format"""
-    # Convert to DataFrame
-    data = []
-    for ca in ca_data:
-        data.append(
-            {
-                "ID": str(ca.get("_id", "")),
-                "CA Code": ca.get("ca_code", ""),
-                "Profile": ca.get("profile_picture", ""),
-                "Full Name": ca.get("full_name", ""),
-                "Email": ca.get("email", ""),
-                "Institution": ca.get("institution", ""),
-                "Class": ca.get("class", ""),
-                "Phone Number": ca.get("phone", ""),
-                "Status": ca.get("status"),
-                "Facebook": ca.get("facebook_link"),
-                "Why CA": ca.get("why_ca", ""),
-                "Registration Date": ca.get("registration_date", ""),
-                "Firebase uid": ca.get("firebase_uid", ""),
-                "IP Address": ca.get("ip_address", ""),
-            }
-        )
+def safe_str(value):
+    """Convert any value to string safely"""
+    if value is None:
+        return ''
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, bool):
+        return 'Yes' if value else 'No'
+    return str(value)
 
-    df = pd.DataFrame(data)
-    
-    # Create Excel file in memory
-    output = BytesIO()
-    
-    # Use openpyxl directly without pandas ExcelWriter
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "CARegistrations"
-    
-    # Write headers
-    for col_num, column_title in enumerate(df.columns, 1):
-        ws.cell(row=1, column=col_num, value=column_title)
-    
-    # Write data
-    for row_num, row_data in enumerate(df.values, 2):
-        for col_num, cell_value in enumerate(row_data, 1):
-            ws.cell(row=row_num, column=col_num, value=cell_value)
-    
-    # Auto-adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    wb.save(output)
-    output.seek(0)
-    
-    return Response(
-        output.getvalue(),
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        headers={'Content-Disposition': 'attachment;filename=caregistrations.xlsx'}
-    )
+
+def export_to_excel(registrations):
+    """Export registrations to Excel format"""
+    return stream_xlsx(registrations, REGISTRATION_COLUMNS, "Registrations", "registrations.xlsx")
+
+
+def export_to_csv(registrations):
+    """Export registrations to CSV, streamed row by row from a cursor or iterable"""
+    return stream_csv(registrations, REGISTRATION_COLUMNS, 'registrations.csv')
+
+
+def export_ca_to_csv(ca_data):
+    """Export CA registrations to CSV, streamed row by row"""
+    return stream_csv(ca_data, CA_COLUMNS, "ca_registrations.csv")
+
+
+def export_ca_to_excel(ca_data):
+    """Export CA registrations to Excel format"""
+    return stream_xlsx(ca_data, CA_COLUMNS, "CARegistrations", "caregistrations.xlsx")
 
 
 def export_bob_to_excel(bob_data):
     """Export BoB registrations to Excel format matching CA export style"""
-    # Convert to DataFrame
-    data = []
-    for bob in bob_data:
-        # Format members as a readable string
-        members_str = ""
-        for member in bob.get('members', []):
-            members_str += f"{member.get('position', '')}. {member.get('name', '')} - {member.get('role', '')}\n"
-        members_str = members_str.strip()
-        
-        data.append({
-            "ID": str(bob.get("_id", "")),
-            "Band Name": bob.get("band_name", ""),
-            "Email": bob.get("email", ""),
-            "Genre": bob.get("band_genre", ""),
-            "Member Count": bob.get("member_count", 0),
-            "Members": members_str,
-            "Jamming Clip": bob.get("jamming_clip", ""),
-            "CA Reference": bob.get("ca_reference", "") if bob.get("ca_reference") else "",
-            "Verified": "Yes" if bob.get("verified") else "No",
-            "Status": bob.get("status", "pending"),
-            "Registration Date": bob.get("registration_date", ""),
-            "Firebase uid": bob.get("firebase_uid", ""),
-            "User ID": str(bob.get("user_id", "")),
-            "IP Address": bob.get("ip_address", ""),
-        })
-
-    df = pd.DataFrame(data)
-    
-    # Create Excel file in memory
-    output = io.BytesIO()
-    
-    # Create workbook directly with openpyxl
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "BoBRegistrations"
-    
-    # Write headers
-    for col_num, column_title in enumerate(df.columns, 1):
-        ws.cell(row=1, column=col_num, value=column_title)
-    
-    # Write data
-    for row_num, row_data in enumerate(df.values, 2):
-        for col_num, cell_value in enumerate(row_data, 1):
-            ws.cell(row=row_num, column=col_num, value=cell_value)
-    
-    # Auto-adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if cell.value and len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        # Cap width at 50 and add padding
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Enable text wrapping for Members column (column G)
-    if 'G' in ws.column_dimensions:
-        ws.column_dimensions['G'].width = 50  # Make Members column wider
-    
-    wb.save(output)
-    output.seek(0)
-    
-    # Create filename with timestamp
-    from datetime import datetime
     timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
     filename = f"bob_registrations_{timestamp}.xlsx"
     
-    return Response(
-        output.getvalue(),
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        headers={
-            'Content-Disposition': f'attachment; filename={filename}',
-            'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet; charset=utf-8'
-        }
-    )
\ No newline at end of file
+    # Members are listed one per line, so give that column the full width
+    return stream_xlsx(bob_data, BOB_COLUMNS, "BoBRegistrations", filename, fixed_widths={"Members": XLSX_MAX_COLUMN_WIDTH})
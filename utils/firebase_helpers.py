@@ -3,9 +3,15 @@ from firebase_admin import auth
 from firebase_admin import exceptions as firebase_exceptions
 import requests
 import json
+import re
+import threading
+import time
+import jwt
+from cryptography.x509 import load_pem_x509_certificate
 from flask import current_app
 import os
 from .email_service import send_email
+from .http_client import http_get, http_post
 from flask import session
 
 def firebase_create_user(email, password, display_name=None):
@@ -28,7 +34,7 @@ def firebase_create_user(email, password, display_name=None):
         payload["displayName"] = display_name
     
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        response = http_post('accounts:signUp', url, json=payload)
         data = response.json()
         
         if response.status_code == 200:
@@ -81,7 +87,7 @@ def firebase_login_user(email, password):
     }
     
     try:
-        response = requests.post(url, json=payload)
+        response = http_post('accounts:signInWithPassword', url, json=payload)
         data = response.json()
         
         if response.status_code == 200:
@@ -115,7 +121,7 @@ def firebase_send_password_reset(email):
     }
     
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        response = http_post('accounts:sendOobCode', url, json=payload)
         data = response.json()
         
         if response.status_code == 200:
@@ -157,7 +163,7 @@ def firebase_verify_token(id_token):
     }
     
     try:
-        response = requests.post(url, json=payload, timeout=5)
+        response = http_post('accounts:lookup', url, idempotent=True, json=payload)
         data = response.json()
         
         if response.status_code == 200:
@@ -169,6 +175,114 @@ def firebase_verify_token(id_token):
         print(f"Token verification error: {e}")
         return None
 
+# Public x509 certs Google signs Firebase ID tokens with, keyed by `kid`
+GOOGLE_CERTS_URL = os.environ.get(
+    'FIREBASE_CERTS_URL',
+    'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+)
+
+# Tokens with an unknown `kid` force a refetch at most this often, so junk
+# tokens cannot turn every request into a call to Google
+FORCED_REFRESH_INTERVAL = int(os.environ.get('FIREBASE_CERTS_MIN_REFRESH_SECONDS', 60))
+
+_google_keys = {'keys': {}, 'expires_at': 0.0, 'fetched_at': 0.0}
+_google_keys_lock = threading.Lock()
+
+
+def _fetch_google_public_keys():
+    """Download Google's signing certs and return (keys by kid, max-age seconds)"""
+    response = http_get('securetoken:certs', GOOGLE_CERTS_URL)
+    response.raise_for_status()
+    
+    keys = {
+        kid: load_pem_x509_certificate(pem.encode('utf-8')).public_key()
+        for kid, pem in response.json().items()
+    }
+    
+    match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+    max_age = int(match.group(1)) if match else 0
+    return keys, max_age
+
+
+def get_google_public_keys(force_refresh=False):
+    """Get Google's token signing keys, cached until their Cache-Control expiry.
+    
+    force_refresh refetches before expiry, but at most once per
+    FORCED_REFRESH_INTERVAL; within it the cached keys are returned.
+    """
+    with _google_keys_lock:
+        now = time.time()
+        if _google_keys['keys'] and now < _google_keys['expires_at']:
+            if not force_refresh or now - _google_keys['fetched_at'] < FORCED_REFRESH_INTERVAL:
+                return _google_keys['keys']
+        
+        # Set before fetching so a failed forced refresh also waits out the interval
+        _google_keys['fetched_at'] = now
+        try:
+            keys, max_age = _fetch_google_public_keys()
+        except Exception as e:
+            # Keep serving the previous keys if Google is briefly unreachable
+            if _google_keys['keys']:
+                print(f"Error refreshing Google public keys: {e}")
+                return _google_keys['keys']
+            raise
+        
+        _google_keys['keys'] = keys
+        _google_keys['expires_at'] = now + max_age
+        return keys
+
+
+def get_firebase_project_id():
+    """Firebase project ID, used as the expected `aud` of ID tokens"""
+    project_id = os.environ.get('FIREBASE_PROJECT_ID')
+    if not project_id:
+        try:
+            project_id = firebase_admin.get_app().project_id
+        except ValueError:
+            project_id = None
+    
+    if not project_id:
+        raise Exception('Firebase project ID not configured')
+    return project_id
+
+
+def firebase_verify_id_token(id_token):
+    """Verify a Firebase ID token locally against Google's public keys.
+    
+    Returns the decoded claims. Raises jwt.ExpiredSignatureError once `exp`
+    has passed (the caller should refresh the token) and jwt.InvalidTokenError
+    for anything else wrong with the token.
+    """
+    if not id_token:
+        raise jwt.InvalidTokenError('Missing ID token')
+    
+    header = jwt.get_unverified_header(id_token)
+    kid = header.get('kid')
+    if header.get('alg') != 'RS256' or not kid:
+        raise jwt.InvalidTokenError('Unexpected token header')
+    
+    keys = get_google_public_keys()
+    if kid not in keys:
+        # Google rotated its keys before our cached copy expired
+        keys = get_google_public_keys(force_refresh=True)
+    if kid not in keys:
+        raise jwt.InvalidTokenError('Unknown signing key')
+    
+    project_id = get_firebase_project_id()
+    claims = jwt.decode(
+        id_token,
+        keys[kid],
+        algorithms=['RS256'],
+        audience=project_id,
+        issuer=f'https://securetoken.google.com/{project_id}',
+        options={'require': ['exp', 'iat', 'aud', 'iss', 'sub']},
+        leeway=30  # tolerate small clock skew between us and Google
+    )
+    
+    if not claims.get('sub'):
+        raise jwt.InvalidTokenError('Empty subject')
+    return claims
+
 def firebase_update_user(uid, display_name=None, email=None, phone_number=None):
     """Update Firebase user profile using REST API"""
     api_key = os.environ.get('FIREBASE_API_KEY')
@@ -200,7 +314,7 @@ def firebase_update_user(uid, display_name=None, email=None, phone_number=None):
         payload["phoneNumber"] = phone_number
     
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        response = http_post('accounts:update', url, json=payload)
         data = response.json()
         
         if response.status_code == 200:
@@ -248,7 +362,7 @@ def firebase_change_password(uid, new_password):
     }
     
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        response = http_post('accounts:update', url, json=payload)
         data = response.json()
         
         if response.status_code == 200:
@@ -299,7 +413,7 @@ def firebase_delete_user(uid):
     }
     
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        response = http_post('accounts:delete', url, json=payload)
         data = response.json()
         
         if response.status_code == 200:
@@ -346,7 +460,7 @@ def firebase_send_email_verification(id_token):
     }
     
     try:
-        response = requests.post(url, json=payload)
+        response = http_post('accounts:sendOobCode', url, json=payload)
         data = response.json()
         
         if response.status_code == 200:
@@ -373,7 +487,7 @@ def refresh_firebase_token(refresh_token):
     }
     
     try:
-        response = requests.post(url, json=payload)
+        response = http_post('securetoken:token', url, json=payload)
         data = response.json()
         
         if response.status_code == 200:
@@ -401,7 +515,7 @@ def firebase_get_user_info(id_token):
     }
     
     try:
-        response = requests.post(url, json=payload)
+        response = http_post('accounts:lookup', url, idempotent=True, json=payload)
         data = response.json()
         
         if response.status_code == 200:
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import httpx
+import requests
+
+from config import Config
+
+# Status codes worth retrying on an idempotent call
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_metrics_lock = threading.Lock()
+_metrics = defaultdict(lambda: {
+    'requests': 0,
+    'errors': 0,
+    'retries': 0,
+    'total_ms': 0.0,
+    'max_ms': 0.0,
+    'http_version': None,
+    'recent_ms': deque(maxlen=256)
+})
+
+
+def get_http_session():
+    """Shared keep-alive HTTP/2 client for this worker process.
+
+    Calls from a worker's threads are multiplexed over one connection per
+    host. Re-created after a fork so gunicorn workers never share sockets.
+    HTTP_HTTP2=false falls back to HTTP/1.1 keep-alive.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            _session = httpx.Client(
+                http2=Config.HTTP_HTTP2,
+                follow_redirects=True,
+                timeout=httpx.Timeout(Config.HTTP_READ_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=Config.HTTP_POOL_MAXSIZE,
+                    max_keepalive_connections=Config.HTTP_POOL_CONNECTIONS
+                )
+            )
+            _session_pid = pid
+    return _session
+
+
+def _send(session, method, url, **kwargs):
+    """session.request, raising the requests exceptions callers already handle"""
+    try:
+        return session.request(method, url, **kwargs)
+    except httpx.ConnectTimeout as e:
+        raise requests.exceptions.ConnectTimeout(str(e)) from e
+    except httpx.TimeoutException as e:
+        raise requests.exceptions.ReadTimeout(str(e)) from e
+    except httpx.TransportError as e:
+        raise requests.exceptions.ConnectionError(str(e)) from e
+
+
+def _record(endpoint, elapsed_ms, error=False, retry=False, http_version=None):
+    with _metrics_lock:
+        stats = _metrics[endpoint]
+        if http_version:
+            stats['http_version'] = http_version
+        stats['requests'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        stats['recent_ms'].append(elapsed_ms)
+        if error:
+            stats['errors'] += 1
+        if retry:
+            stats['retries'] += 1
+
+
+def http_request(method, endpoint, url, idempotent=False, **kwargs):
+    """Send a request through the shared client and record its latency under `endpoint`.
+
+    Idempotent calls are retried with exponential backoff on connection
+    errors (including connect timeouts) and 5xx responses, up to
+    Config.HTTP_MAX_RETRIES times. Read timeouts are not retried: each one
+    already held the calling web worker for HTTP_READ_TIMEOUT.
+    """
+    attempts = Config.HTTP_MAX_RETRIES + 1 if idempotent else 1
+    session = get_http_session()
+
+    for attempt in range(attempts):
+        retrying = attempt + 1 < attempts
+        start = time.perf_counter()
+        try:
+            response = _send(session, method, url, **kwargs)
+        except requests.exceptions.ConnectionError:
+            _record(endpoint, (time.perf_counter() - start) * 1000, error=True, retry=retrying)
+            if not retrying:
+                raise
+        except requests.exceptions.Timeout:
+            _record(endpoint, (time.perf_counter() - start) * 1000, error=True)
+            raise
+        else:
+            failed = response.status_code in RETRY_STATUS_CODES
+            _record(endpoint, (time.perf_counter() - start) * 1000, error=failed, retry=failed and retrying,
+                    http_version=response.http_version)
+            if not (failed and retrying):
+                return response
+
+        time.sleep(Config.HTTP_RETRY_BACKOFF * (2 ** attempt))
+
+
+def http_post(endpoint, url, idempotent=False, **kwargs):
+    return http_request('POST', endpoint, url, idempotent=idempotent, **kwargs)
+
+
+def http_get(endpoint, url, **kwargs):
+    return http_request('GET', endpoint, url, idempotent=True, **kwargs)
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def http_metrics():
+    """Per-endpoint latency summary for this worker"""
+    with _metrics_lock:
+        return {
+            endpoint: {
+                'requests': stats['requests'],
+                'errors': stats['errors'],
+                'retries': stats['retries'],
+                'avg_ms': round(stats['total_ms'] / stats['requests'], 2) if stats['requests'] else 0.0,
+                'p50_ms': round(_percentile(stats['recent_ms'], 50), 2),
+                'p95_ms': round(_percentile(stats['recent_ms'], 95), 2),
+                'max_ms': round(stats['max_ms'], 2),
+                'http_version': stats['http_version']
+            }
+            for endpoint, stats in _metrics.items()
+        }
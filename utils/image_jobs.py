@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+import extensions
+from config import Config
+from utils.images import InvalidImage, normalize_image
+from utils.uploads import delete_asset, read_asset, store_variant
+
+# Collection -> field holding the uploaded image's URL. The pipeline adds
+# <field>_thumb and <field>_status ('pending', 'normalized' or 'invalid').
+IMAGE_FIELDS = {
+    'registrations': 'receipt',
+    'ca_registrations': 'profile_picture'
+}
+
+VARIANT_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def ensure_image_indexes():
+    db = extensions.db
+    db.image_jobs.create_index([('collection', 1), ('doc_id', 1)], unique=True)
+    db.image_jobs.create_index([('status', 1), ('created_at', 1)])
+
+
+def enqueue_image_job(collection, doc_id, upload):
+    """Queue normalization of the image `upload` (as returned by verify_upload) stored on a document"""
+    now = datetime.utcnow()
+    extensions.db.image_jobs.update_one(
+        {'collection': collection, 'doc_id': doc_id},
+        {'$setOnInsert': {
+            'field': IMAGE_FIELDS[collection],
+            'asset': upload['asset'],
+            'version': upload['version'],
+            'status': 'queued',
+            'attempts': 0,
+            'error': None,
+            'locked_until': None,
+            'created_at': now,
+            'updated_at': now
+        }},
+        upsert=True
+    )
+    extensions.db[collection].update_one(
+        {'_id': doc_id}, {'$set': {f"{IMAGE_FIELDS[collection]}_status": 'pending'}}
+    )
+
+
+def claim_image_jobs(limit):
+    """Atomically take up to `limit` queued jobs, oldest first, including ones whose worker died"""
+    db = extensions.db
+    jobs = []
+    for _ in range(limit):
+        now = datetime.utcnow()
+        job = db.image_jobs.find_one_and_update(
+            {'$or': [
+                {'status': 'queued'},
+                {'status': 'running', 'locked_until': {'$lt': now}}
+            ]},
+            {
+                '$set': {
+                    'status': 'running',
+                    'locked_until': now + timedelta(seconds=Config.IMAGE_JOB_LEASE_SECONDS),
+                    'updated_at': now
+                },
+                '$inc': {'attempts': 1}
+            },
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            break
+        jobs.append(job)
+    return jobs
+
+
+def _finish(job, status, error=None):
+    now = datetime.utcnow()
+    extensions.db.image_jobs.update_one({'_id': job['_id']}, {'$set': {
+        'status': status, 'error': error, 'locked_until': None, 'finished_at': now, 'updated_at': now
+    }})
+
+
+def _store_result(job, result):
+    """Save the normalized image and thumbnail and point the document at them"""
+    extension = VARIANT_EXTENSIONS[result['format']]
+    image_url = store_variant(f"{job['asset']}_web", result['image'], extension)
+    thumb_url = store_variant(f"{job['asset']}_thumb", result['thumbnail'], extension)
+
+    field = job['field']
+    extensions.db[job['collection']].update_one({'_id': job['doc_id']}, {'$set': {
+        field: image_url,
+        f'{field}_thumb': thumb_url,
+        f'{field}_status': 'normalized',
+        f'{field}_size': [result['width'], result['height']]
+    }})
+    if not Config.IMAGE_KEEP_ORIGINALS:
+        # The original still carries its EXIF (GPS, device) data
+        delete_asset(job['asset'])
+
+
+def process_image_jobs(jobs, pool):
+    """Normalize claimed jobs' images on `pool` (a process pool) and store the results.
+
+    Downloads and storage calls stay in this process; only the CPU-bound
+    decode/resize/encode runs in the pool, one image per process at a time.
+    """
+    futures = []
+    for job in jobs:
+        try:
+            data = read_asset(job['asset'], job['version'])
+        except Exception as e:
+            _retry_or_fail(job, e)
+            continue
+        if len(data) > Config.UPLOAD_MAX_BYTES:
+            # The size in the upload reference is not signed; this is the stored original's
+            _mark_invalid(job, f'Original is {len(data)} bytes, over UPLOAD_MAX_BYTES')
+            continue
+        futures.append((job, pool.submit(
+            normalize_image, data,
+            max_edge=Config.IMAGE_MAX_EDGE,
+            thumb_edge=Config.IMAGE_THUMB_EDGE,
+            quality=Config.IMAGE_QUALITY,
+            output_format=Config.IMAGE_OUTPUT_FORMAT,
+            min_edge=Config.IMAGE_MIN_EDGE,
+            max_pixels=Config.IMAGE_MAX_PIXELS
+        )))
+
+    for job, future in futures:
+        try:
+            _store_result(job, future.result())
+        except InvalidImage as e:
+            _mark_invalid(job, str(e))
+        except Exception as e:
+            _retry_or_fail(job, e)
+        else:
+            _finish(job, 'done')
+
+
+def _mark_invalid(job, error):
+    extensions.db[job['collection']].update_one(
+        {'_id': job['doc_id']}, {'$set': {f"{job['field']}_status": 'invalid'}}
+    )
+    _finish(job, 'invalid', error)
+
+
+def _retry_or_fail(job, error):
+    print(f"Image job {job['_id']} failed: {error}")
+    if job['attempts'] >= Config.IMAGE_JOB_MAX_ATTEMPTS:
+        _finish(job, 'failed', str(error))
+        return
+    extensions.db.image_jobs.update_one({'_id': job['_id']}, {'$set': {
+        'status': 'queued', 'error': str(error), 'locked_until': None, 'updated_at': datetime.utcnow()
+    }})
@@ -0,0 +1,87 @@
+from io import BytesIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Formats accepted from uploads, identified by the file header, not its name
+ACCEPTED_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+CONTENT_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+
+
+class InvalidImage(ValueError):
+    """Raised for uploads that are not a usable image"""
+
+
+def _open(data, min_edge, max_pixels):
+    """Identify the image by its header and bound-check it before anything is decoded"""
+    try:
+        image = Image.open(BytesIO(data))
+        image_format = image.format
+        image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise InvalidImage(f'Not a readable image: {e}')
+
+    if image_format not in ACCEPTED_FORMATS:
+        raise InvalidImage(f'Unsupported image format: {image_format}')
+
+    # verify() leaves the image unusable; reopen it for decoding
+    image = Image.open(BytesIO(data))
+    width, height = image.size
+    if min(width, height) < min_edge:
+        raise InvalidImage(f'Image too small: {width}x{height}')
+    if width * height > max_pixels:
+        raise InvalidImage(f'Image too large: {width}x{height}')
+    return image
+
+
+def _encode(image, max_edge, quality, output_format):
+    image = image.copy()
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    if output_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha: flatten transparent areas onto white
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+
+    buffer = BytesIO()
+    if output_format == 'WEBP':
+        image.save(buffer, 'WEBP', quality=quality, method=4)
+    else:
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue(), image.size
+
+
+def normalize_image(data, max_edge, thumb_edge, quality, output_format='WEBP', min_edge=64,
+                    max_pixels=40_000_000):
+    """Re-encode an uploaded image for storage and build its thumbnail.
+
+    The image is identified by its header, bounded in size, rotated per its
+    EXIF orientation and then written without any metadata (EXIF, GPS,
+    ICC), downsized to fit `max_edge` and a `thumb_edge` thumbnail.
+    Runs in worker processes, so everything it needs comes in as arguments.
+    Returns {'image', 'thumbnail', 'format', 'width', 'height'}; raises InvalidImage.
+    """
+    output_format = output_format.upper()
+    image = _open(data, min_edge, max_pixels)
+    if image.format == 'JPEG':
+        # Let libjpeg decode at a reduced scale when the photo is much larger than needed
+        image.draft('RGB', (max_edge, max_edge))
+
+    try:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        encoded, (width, height) = _encode(image, max_edge, quality, output_format)
+        thumbnail, _ = _encode(image, thumb_edge, quality, output_format)
+    except (OSError, ValueError) as e:
+        raise InvalidImage(f'Could not decode image: {e}')
+
+    return {
+        'image': encoded,
+        'thumbnail': thumbnail,
+        'format': output_format,
+        'width': width,
+        'height': height
+    }
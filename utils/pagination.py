@@ -0,0 +1,92 @@
+import base64
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+def encode_cursor(doc, sort_field):
+    """Opaque token for a document's position in a (sort_field, _id) ordering"""
+    value = doc.get(sort_field)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps({'v': value, 'id': str(doc['_id'])})
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (value, _id) from a cursor token, or None if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+        value = data['v']
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        return value, ObjectId(data['id'])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        return None
+
+
+def _seek_condition(sort_field, value, doc_id, forward):
+    """Filter for documents after (forward) or before a position in descending order.
+
+    Documents without the sort field sort last in descending order, so they
+    are reached only after every dated document.
+    """
+    if forward:
+        if value is None:
+            return {sort_field: None, '_id': {'$lt': doc_id}}
+        return {'$or': [
+            {sort_field: {'$lt': value}},
+            {sort_field: value, '_id': {'$lt': doc_id}},
+            {sort_field: None}
+        ]}
+
+    if value is None:
+        return {'$or': [
+            {sort_field: {'$ne': None}},
+            {sort_field: None, '_id': {'$gt': doc_id}}
+        ]}
+    return {'$or': [
+        {sort_field: {'$gt': value}},
+        {sort_field: value, '_id': {'$gt': doc_id}}
+    ]}
+
+
+def keyset_page(collection, query, sort_field, per_page, after=None, before=None, projection=None):
+    """One page of documents newest first, positioned by cursor instead of skip.
+
+    Pass the `next_cursor` of a page as `after` to get the following page, or
+    its `prev_cursor` as `before` to go back. Every page costs one index range
+    scan of per_page + 1 documents, however deep it is.
+    Returns (documents, prev_cursor, next_cursor); a cursor is None at either end.
+    """
+    position = decode_cursor(after or before) if (after or before) else None
+    forward = not (position and before)
+
+    if position:
+        query = {'$and': [query, _seek_condition(sort_field, position[0], position[1], forward)]}
+
+    direction = -1 if forward else 1
+    documents = list(
+        collection.find(query, projection)
+        .sort([(sort_field, direction), ('_id', direction)])
+        .limit(per_page + 1)
+    )
+    has_more = len(documents) > per_page
+    documents = documents[:per_page]
+    if not forward:
+        documents.reverse()
+
+    if not documents:
+        return documents, None, None
+
+    if forward:
+        has_prev, has_next = position is not None, has_more
+    else:
+        has_prev, has_next = has_more, True
+
+    prev_cursor = encode_cursor(documents[0], sort_field) if has_prev else None
+    next_cursor = encode_cursor(documents[-1], sort_field) if has_next else None
+    return documents, prev_cursor, next_cursor
@@ -0,0 +1,125 @@
+import random
+import threading
+import time
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+import extensions
+from config import Config
+
+RECONCILE_REPORT_ID = 'participant_reconcile'
+
+# Summed counts as of the last read: (counts, read_at)
+_cached_counts = None
+_counts_lock = threading.Lock()
+
+
+def _shard_id(segment_id, shard):
+    return f'{segment_id}:{shard}'
+
+
+def ensure_participant_counters():
+    """Index the counter shards and build them from registrations on first use"""
+    db = extensions.db
+    db.segment_counters.create_index([('segment_id', 1)])
+    if db.segment_counters.estimated_document_count() == 0:
+        reconcile_participant_counts()
+
+
+def increment_participants(segment_id, amount=1, session=None):
+    """Add to a segment's participant count on one of its counter shards.
+
+    Spreading writes over PARTICIPANT_COUNTER_SHARDS documents keeps a
+    popular segment from serializing every registration on one document.
+    """
+    shard = random.randrange(Config.PARTICIPANT_COUNTER_SHARDS)
+    extensions.db.segment_counters.update_one(
+        {'_id': _shard_id(segment_id, shard)},
+        {'$inc': {'count': amount}, '$setOnInsert': {'segment_id': segment_id, 'shard': shard}},
+        upsert=True,
+        session=session
+    )
+
+
+def _summed_counts():
+    return {
+        group['_id']: group['count']
+        for group in extensions.db.segment_counters.aggregate([
+            {'$group': {'_id': '$segment_id', 'count': {'$sum': '$count'}}}
+        ])
+    }
+
+
+def participant_counts():
+    """{segment_id: participants} summed over the shards, cached per worker for PARTICIPANT_COUNT_TTL"""
+    global _cached_counts
+    now = time.monotonic()
+    with _counts_lock:
+        if _cached_counts and now - _cached_counts[1] < Config.PARTICIPANT_COUNT_TTL:
+            return _cached_counts[0]
+
+    counts = _summed_counts()
+    with _counts_lock:
+        _cached_counts = (counts, now)
+    return counts
+
+
+def reconcile_participant_counts():
+    """Recount participants from registrations and correct drifted counters.
+
+    The shard sums are read before and after the recount; a segment whose
+    sum moved in between had a registration land mid-recount and is left
+    for the next run. For the rest the difference is $inc'ed onto shard 0,
+    so registrations counted after the recount are not lost.
+    segments.current_participants is refreshed with the recounted values.
+    """
+    db = extensions.db
+    current = _summed_counts()
+    expected = {
+        group['_id']: group['count']
+        for group in db.registrations.aggregate([
+            {'$group': {'_id': '$segment_id', 'count': {'$sum': 1}}}
+        ])
+    }
+    settled = _summed_counts()
+
+    drift = []
+    skipped = []
+    operations = []
+    for segment_id in set(expected) | set(current) | set(settled):
+        if current.get(segment_id, 0) != settled.get(segment_id, 0):
+            skipped.append(segment_id)
+            continue
+        difference = expected.get(segment_id, 0) - current.get(segment_id, 0)
+        if not difference:
+            continue
+        drift.append({'segment_id': segment_id, 'expected': expected.get(segment_id, 0),
+                      'actual': current.get(segment_id, 0)})
+        operations.append(UpdateOne(
+            {'_id': _shard_id(segment_id, 0)},
+            {'$inc': {'count': difference}, '$setOnInsert': {'segment_id': segment_id, 'shard': 0}},
+            upsert=True
+        ))
+    if operations:
+        db.segment_counters.bulk_write(operations, ordered=False)
+
+    segment_updates = [
+        UpdateOne({'_id': seg['_id']}, {'$set': {'current_participants': expected.get(seg['_id'], 0)}})
+        for seg in db.segments.find({'_id': {'$nin': skipped}}, {'current_participants': 1})
+        if seg.get('current_participants', 0) != expected.get(seg['_id'], 0)
+    ]
+    if segment_updates:
+        db.segments.bulk_write(segment_updates, ordered=False)
+
+    report = {
+        'checked_at': datetime.utcnow(),
+        'segments': len(expected),
+        'drift_count': len(drift),
+        'drift': drift[:50],
+        'skipped': len(skipped)
+    }
+    db.stats_snapshots.update_one({'_id': RECONCILE_REPORT_ID}, {'$set': report}, upsert=True)
+    if drift:
+        print(f"Participant counters: corrected {len(drift)} drifted segment(s)")
+    return report
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+import extensions
+from utils.participant_counters import increment_participants
+from utils.rollups import apply_rollup_delta
+
+
+# A negative answer is checked again after this long: it may come from a
+# server that was briefly unreachable, or one since converted to a replica set
+TRANSACTION_RECHECK_SECONDS = 60
+
+# (supported, checked_at) of the last check
+_transaction_check = None
+_transaction_lock = threading.Lock()
+
+
+def _detect_transactions():
+    try:
+        hello = extensions.client.admin.command('hello')
+    except PyMongoError as e:
+        print(f"Could not detect transaction support: {e}")
+        return False
+    return bool(hello.get('setName')) or hello.get('msg') == 'isdbgrid'
+
+
+def transactions_supported():
+    """Whether the deployment is a replica set or sharded cluster.
+
+    A positive answer is kept for the life of the process; a negative one
+    for TRANSACTION_RECHECK_SECONDS.
+    """
+    global _transaction_check
+    now = time.monotonic()
+    with _transaction_lock:
+        if _transaction_check and (_transaction_check[0] or now - _transaction_check[1] < TRANSACTION_RECHECK_SECONDS):
+            return _transaction_check[0]
+
+    supported = _detect_transactions()
+    with _transaction_lock:
+        _transaction_check = (supported, now)
+    return supported
+
+
+def _link_registration(registration, session=None):
+    """Writes that follow the insert; the $inc goes last so a failure leaves nothing to uncount"""
+    db = extensions.db
+    db.users.update_one(
+        {'_id': registration['user_id']},
+        {'$addToSet': {'registrations': registration['_id']}},
+        session=session
+    )
+    increment_participants(registration['segment_id'], session=session)
+
+
+def _write_in_transaction(session, registration):
+    extensions.db.registrations.insert_one(registration, session=session)
+    _link_registration(registration, session)
+
+
+def commit_registration(registration):
+    """Insert a registration, count it on its segment and link it to its user, all or nothing.
+
+    On a replica set the three writes run in one transaction, so only the
+    commit waits for write concern. On a standalone server they run in
+    order and the registration is removed again if a later one fails. The unique
+    transaction_id index is the duplicate-payment check: DuplicateKeyError
+    propagates before anything else is written.
+    Returns the new registration's _id.
+    """
+    registration.setdefault('_id', ObjectId())
+    # Blank transaction IDs (free segments) must not collide on the sparse unique index
+    if not registration.get('transaction_id'):
+        registration.pop('transaction_id', None)
+
+    if transactions_supported():
+        with extensions.client.start_session() as session:
+            session.with_transaction(lambda s: _write_in_transaction(s, registration))
+    else:
+        db = extensions.db
+        db.registrations.insert_one(registration)
+        try:
+            _link_registration(registration)
+        except PyMongoError:
+            db.registrations.delete_one({'_id': registration['_id']})
+            db.users.update_one({'_id': registration['user_id']}, {'$pull': {'registrations': registration['_id']}})
+            raise
+
+    apply_rollup_delta(None, registration)
+    return registration['_id']
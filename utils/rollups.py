@@ -0,0 +1,161 @@
+from collections import defaultdict
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+import extensions
+
+RECONCILE_REPORT_ID = 'analytics_reconcile'
+
+# Analytics dimensions: rollup name -> registration field it groups by
+ROLLUP_DIMENSIONS = {
+    'day': 'registration_date',
+    'category': 'category',
+    'segment': 'segment_name',
+    'ca_ref': 'ca_ref'
+}
+
+
+def _bucket_key(dimension, doc):
+    value = doc.get(ROLLUP_DIMENSIONS[dimension])
+    if dimension == 'day':
+        return value.strftime('%Y-%m-%d') if isinstance(value, datetime) else None
+    return value
+
+
+def _contributions(doc):
+    """{(dimension, key): (count, verified)} a registration adds to the rollups"""
+    if not doc:
+        return {}
+    verified = 1 if doc.get('verified') else 0
+    return {(dimension, _bucket_key(dimension, doc)): (1, verified) for dimension in ROLLUP_DIMENSIONS}
+
+
+def ensure_rollup_indexes():
+    extensions.db.analytics_rollups.create_index([('dim', 1), ('key', 1)], unique=True)
+
+
+def apply_rollup_delta(before, after):
+    """Move a registration's contribution from `before` to `after` with $inc.
+
+    Pass before=None for an insert and after=None for a delete. Only the
+    fields in ROLLUP_DIMENSIONS and `verified` are read.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for bucket, (count, verified) in _contributions(before).items():
+        deltas[bucket][0] -= count
+        deltas[bucket][1] -= verified
+    for bucket, (count, verified) in _contributions(after).items():
+        deltas[bucket][0] += count
+        deltas[bucket][1] += verified
+
+    operations = [
+        UpdateOne(
+            {'dim': dimension, 'key': key},
+            {'$inc': {'count': count, 'verified': verified}},
+            upsert=True
+        )
+        for (dimension, key), (count, verified) in deltas.items()
+        if count or verified
+    ]
+    if operations:
+        extensions.db.analytics_rollups.bulk_write(operations, ordered=False)
+
+
+def get_rollups():
+    """All rollup buckets grouped by dimension, shaped like the old $group output"""
+    rollups = {dimension: [] for dimension in ROLLUP_DIMENSIONS}
+    for bucket in extensions.db.analytics_rollups.find({'count': {'$gt': 0}}):
+        rollups[bucket['dim']].append({
+            '_id': bucket['key'],
+            'count': bucket['count'],
+            'verified': bucket.get('verified', 0)
+        })
+
+    rollups['day'].sort(key=lambda stat: stat['_id'] or '')
+    for dimension in ('category', 'segment', 'ca_ref'):
+        rollups[dimension].sort(key=lambda stat: stat['count'], reverse=True)
+    return rollups
+
+
+def _expected_rollups():
+    """Rollups recomputed from the registrations in one $facet pass"""
+    verified = {'$sum': {'$cond': [{'$eq': ['$verified', True]}, 1, 0]}}
+    facets = {}
+    for dimension, field in ROLLUP_DIMENSIONS.items():
+        group_key = f'${field}'
+        if dimension == 'day':
+            group_key = {'$dateToString': {'format': '%Y-%m-%d', 'date': group_key}}
+        facets[dimension] = [{'$group': {'_id': group_key, 'count': {'$sum': 1}, 'verified': verified}}]
+
+    result = next(extensions.db.registrations.aggregate([{'$facet': facets}]))
+    return {
+        (dimension, bucket['_id']): (bucket['count'], bucket['verified'])
+        for dimension, buckets in result.items()
+        for bucket in buckets
+    }
+
+
+def reconcile_rollups():
+    """Correct drifted rollups from a recount and record how far they had drifted.
+
+    Corrections are $inc'ed as the difference, guarded by the values read
+    before the recount: a bucket a registration touched meanwhile is left
+    for the next run instead of having that registration's $inc undone.
+    Missing buckets are only inserted, never $inc'ed onto one that a
+    registration created in the meantime.
+    """
+    db = extensions.db
+    # Read the rollups before recounting, so any later $inc shows up as a guard mismatch
+    current = {
+        (bucket['dim'], bucket['key']): (bucket.get('count', 0), bucket.get('verified', 0))
+        for bucket in db.analytics_rollups.find()
+    }
+    expected = _expected_rollups()
+
+    drift = []
+    skipped = 0
+    for bucket in set(expected) | set(current):
+        want = expected.get(bucket, (0, 0))
+        have = current.get(bucket, (0, 0))
+        if want == have:
+            continue
+        dimension, key = bucket
+        if bucket in current:
+            result = db.analytics_rollups.update_one(
+                {'dim': dimension, 'key': key, 'count': have[0], 'verified': have[1]},
+                {'$inc': {'count': want[0] - have[0], 'verified': want[1] - have[1]}}
+            )
+        else:
+            # Only create the bucket if no registration has created it since the read
+            result = db.analytics_rollups.update_one(
+                {'dim': dimension, 'key': key},
+                {'$setOnInsert': {'count': want[0], 'verified': want[1]}},
+                upsert=True
+            )
+        if not (result.modified_count or result.upserted_id):
+            skipped += 1
+            continue
+        drift.append({'dim': dimension, 'key': key, 'expected': want[0], 'actual': have[0],
+                      'expected_verified': want[1], 'actual_verified': have[1]})
+
+    # Buckets corrected down to nothing; the filter keeps any that were just incremented
+    db.analytics_rollups.delete_many({'count': 0, 'verified': 0})
+
+    report = {
+        'checked_at': datetime.utcnow(),
+        'buckets': len(expected),
+        'drift_count': len(drift),
+        'drift': drift[:50],
+        'skipped': skipped
+    }
+    db.stats_snapshots.update_one({'_id': RECONCILE_REPORT_ID}, {'$set': report}, upsert=True)
+    if drift:
+        print(f"Analytics rollups: corrected {len(drift)} drifted bucket(s)")
+    return report
+
+
+def get_reconcile_report():
+    """Last reconciler run, rebuilding the rollups first if they have never been built"""
+    report = extensions.db.stats_snapshots.find_one({'_id': RECONCILE_REPORT_ID})
+    return report or reconcile_rollups()
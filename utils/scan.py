@@ -0,0 +1,73 @@
+import extensions
+
+# Only the fields the gate scanner shows
+USER_SCAN_FIELDS = ('full_name', 'name', 'present', 'email', 'mobile', 'institution', 'profile_picture',
+                    'class_level', 'email_verified', 'facebook_link', 'address', 'created_at')
+REGISTRATION_SCAN_FIELDS = ('segment_name', 'category', 'verified', 'present', 'present_at',
+                            'registration_date', 'transaction_id', 'bkash_number')
+CA_SCAN_FIELDS = ('ca_code', 'status', 'phone', 'why_ca', 'class', 'registration_date', 'profile_picture')
+
+
+def _projection(fields):
+    return {field: 1 for field in fields}
+
+
+def _match_scanned(obj_id, rank):
+    """Pipeline picking the scanned document out of one collection, tagged with its priority"""
+    return [
+        {'$match': {'_id': obj_id}},
+        {'$project': {'user_id': '$_id' if rank == 0 else 1, 'rank': {'$literal': rank}}}
+    ]
+
+
+def _lookup_by_user(collection, fields, as_name):
+    return {'$lookup': {
+        'from': collection,
+        'let': {'uid': '$user_id'},
+        'pipeline': [
+            {'$match': {'$expr': {'$eq': ['$user_id', '$$uid']}}},
+            {'$sort': {'registration_date': -1}},
+            {'$project': _projection(fields)}
+        ],
+        'as': as_name
+    }}
+
+
+def resolve_scan(obj_id):
+    """Resolve a scanned user, registration or CA application ID in one aggregation.
+
+    The ID is looked up in users, then registrations, then ca_registrations
+    (first match wins, as before), and the owning user is joined with all
+    of their registrations and CA applications. Signed tickets always carry
+    the user ID; registration and CA IDs arrive as plain ObjectId codes
+    from emails sent before tickets were signed. Returns None if nothing
+    matches, otherwise a dict with scanned_kind, user, registrations and
+    ca_applications.
+
+    $unionWith needs MongoDB 4.4 or later.
+    """
+    pipeline = _match_scanned(obj_id, 0) + [
+        {'$unionWith': {'coll': 'registrations', 'pipeline': _match_scanned(obj_id, 1)}},
+        {'$unionWith': {'coll': 'ca_registrations', 'pipeline': _match_scanned(obj_id, 2)}},
+        {'$sort': {'rank': 1}},
+        {'$limit': 1},
+        {'$lookup': {
+            'from': 'users',
+            'let': {'uid': '$user_id'},
+            'pipeline': [
+                {'$match': {'$expr': {'$eq': ['$_id', '$$uid']}}},
+                {'$project': _projection(USER_SCAN_FIELDS)}
+            ],
+            'as': 'user'
+        }},
+        {'$unwind': '$user'},
+        _lookup_by_user('registrations', REGISTRATION_SCAN_FIELDS, 'registrations'),
+        _lookup_by_user('ca_registrations', CA_SCAN_FIELDS, 'ca_applications')
+    ]
+
+    result = next(extensions.db.users.aggregate(pipeline), None)
+    if not result:
+        return None
+
+    result['scanned_kind'] = ('user', 'registration', 'ca_application')[result['rank']]
+    return result
@@ -0,0 +1,138 @@
+import re
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+import extensions
+
+# Fields folded into each collection's search_keys
+SEARCH_FIELDS = {
+    'registrations': ('full_name', 'email', 'bkash_number', 'transaction_id'),
+    'ca_registrations': ('full_name', 'email', 'phone', 'institution', 'ca_code')
+}
+
+# Fields holding phone numbers, also indexed as bare digits
+PHONE_FIELDS = ('bkash_number', 'phone')
+
+# Longest prefix stored per token; longer search terms are matched on this prefix
+MAX_PREFIX_LENGTH = 24
+
+# Split on whitespace and ASCII punctuation only, so Bangla names with
+# combining vowel signs stay whole tokens
+_TOKEN_SPLIT = re.compile(r'[\s!-/:-@\[-`{-~]+')
+_PHONE_LIKE = re.compile(r'^[\d\s+\-()]+$')
+
+
+def _tokens(value):
+    return [token for token in _TOKEN_SPLIT.split(str(value).casefold()) if token]
+
+
+def _phone_digits(value):
+    """Digits of a phone number in local form (+880 17... -> 017...)"""
+    digits = re.sub(r'\D', '', str(value))
+    if digits.startswith('880'):
+        digits = digits[2:]
+    return digits
+
+
+def _prefixes(token):
+    return [token[:length] for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1)]
+
+
+def build_search_keys(doc, collection_name):
+    """Lowercased tokens of the searchable fields and all their leading prefixes"""
+    keys = set()
+    for field in SEARCH_FIELDS[collection_name]:
+        value = doc.get(field)
+        if not value:
+            continue
+        for token in _tokens(value):
+            keys.update(_prefixes(token))
+        if field in PHONE_FIELDS:
+            keys.update(_prefixes(_phone_digits(value)))
+    keys.discard('')
+    return sorted(keys)
+
+
+def with_search_keys(doc, collection_name):
+    """Set search_keys on a document about to be inserted"""
+    doc['search_keys'] = build_search_keys(doc, collection_name)
+    return doc
+
+
+def search_terms(search):
+    """Index keys a search string must all match"""
+    search = search.strip()
+    if _PHONE_LIKE.match(search) and re.search(r'\d', search):
+        terms = [_phone_digits(search)]
+    else:
+        terms = _tokens(search)
+    return sorted({term[:MAX_PREFIX_LENGTH] for term in terms if term})
+
+
+def search_query(search):
+    """Filter matching documents whose fields start with every term in `search`.
+
+    Served by the search_keys multikey index; a valid ObjectId also matches _id.
+    """
+    terms = search_terms(search)
+    conditions = [{'search_keys': {'$all': terms}}] if terms else []
+    try:
+        conditions.append({'_id': ObjectId(search.strip())})
+    except InvalidId:
+        pass
+
+    if not conditions:
+        return {'_id': None}
+    return conditions[0] if len(conditions) == 1 else {'$or': conditions}
+
+
+def ensure_search_indexes():
+    db = extensions.db
+    db.registrations.create_index([('search_keys', 1), ('registration_date', -1), ('_id', -1)])
+    db.ca_registrations.create_index([('search_keys', 1), ('registration_date', -1)])
+
+
+def backfill_search_keys(collection_name, rebuild=False, batch_size=500):
+    """Compute search_keys for existing documents; returns how many were updated.
+
+    Only documents without keys are touched unless `rebuild` is set (after
+    SEARCH_FIELDS or the tokenizer changes).
+    """
+    collection = extensions.db[collection_name]
+    query = {} if rebuild else {'search_keys': {'$exists': False}}
+    projection = {field: 1 for field in SEARCH_FIELDS[collection_name]}
+
+    updated = 0
+    batch = []
+    for doc in collection.find(query, projection).batch_size(batch_size):
+        batch.append(UpdateOne(
+            {'_id': doc['_id']},
+            {'$set': {'search_keys': build_search_keys(doc, collection_name)}}
+        ))
+        if len(batch) >= batch_size:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+    return updated
+
+
+def _plan_stages(plan):
+    stages = [plan.get('stage')]
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            stages += _plan_stages(child)
+    return stages
+
+
+def explain_search(collection_name, search, extra_query=None):
+    """Winning plan stages for a search, e.g. ['FETCH', 'IXSCAN']"""
+    query = search_query(search)
+    if extra_query:
+        query = {'$and': [extra_query, query]}
+    explain = extensions.db[collection_name].find(query).sort('registration_date', -1).explain()
+    winning_plan = explain['queryPlanner']['winningPlan']
+    # Slot-based engine (MongoDB 7+) nests the classic plan under queryPlan
+    return _plan_stages(winning_plan.get('queryPlan', winning_plan))
@@ -0,0 +1,68 @@
+from collections import defaultdict
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+import extensions
+from config import Config
+from utils.cache import VersionedCache, bump_version
+
+# Segments that are listed on /events but are not open for the generic /register form
+REGISTER_EXCLUDED_SEGMENT_IDS = {
+    ObjectId('6996cf26e7eb96d29e2010c6'),
+    ObjectId('6996cf26e7eb96d29e2010c8'),
+    ObjectId('6996cf26e7eb96d29e2010d4'),
+    # ObjectId('6996cf26e7eb96d29e2010cc')
+}
+
+SIGNATURE_EVENT_NAMES = ['ব্যাটল অব দ্য ব্যান্ডস', 'বিটবক্স ব্রল']
+
+
+class SegmentCatalog:
+    """Immutable snapshot of db.segments with the lookups the site needs"""
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.by_id = {seg['_id']: seg for seg in segments}
+        self.by_type = defaultdict(list)
+        for seg in segments:
+            self.by_type[seg.get('type')].append(seg)
+
+        self.signature_events = [seg for seg in segments if seg.get('name') in SIGNATURE_EVENT_NAMES]
+        self.solo_events = self.by_type['Solo']
+        self.team_events = self.by_type['Team']
+        self.submission_events = self.by_type['Submission']
+
+        self.register_segments = [seg for seg in segments if seg['_id'] not in REGISTER_EXCLUDED_SEGMENT_IDS]
+        self.register_choices = [(str(seg['_id']), f"{seg['name']} - ৳{seg['price']}") for seg in self.register_segments]
+        self.register_ids = {str(seg['_id']) for seg in self.register_segments}
+
+    def get(self, segment_id):
+        """Look up a segment by ObjectId or its string form, None if unknown"""
+        if not isinstance(segment_id, ObjectId):
+            try:
+                segment_id = ObjectId(segment_id)
+            except (InvalidId, TypeError):
+                return None
+        return self.by_id.get(segment_id)
+
+    def of_type(self, segment_type):
+        return self.by_type.get(segment_type, [])
+
+
+def _load_segment_catalog():
+    return SegmentCatalog(list(extensions.db.segments.find({})))
+
+
+segment_catalog_cache = VersionedCache('segments', _load_segment_catalog, Config.SEGMENT_CATALOG_TTL)
+
+
+def get_segment_catalog():
+    """Get this worker's segment catalog, reloading it if db.segments changed"""
+    return segment_catalog_cache.get()
+
+
+def invalidate_segment_catalog():
+    """Call after writing segment definitions so every worker reloads"""
+    bump_version('segments')
+    segment_catalog_cache.invalidate()
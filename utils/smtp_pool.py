@@ -0,0 +1,196 @@
+import os
+import smtplib
+import threading
+import time
+
+# Errors that mean the connection itself is unusable and the message can be retried on a fresh one
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+class RateLimiter:
+    """Token bucket shared by all threads: at most `rate` acquisitions per second"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            # Reserve a token now; if the bucket is empty, wait until it has refilled
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class PooledConnection:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.sent = 0
+
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP connections open and reuses them across messages.
+
+    At most ``max_connections`` connections exist at once, so bulk sends never
+    exceed the provider's concurrent-connection limit. Connections idle longer
+    than ``idle_timeout`` or that have sent ``max_messages`` messages are
+    closed and replaced. ``rate_limit`` caps messages per second across all
+    connections (0 disables it).
+    """
+
+    def __init__(self, host, port, username=None, password=None, use_tls=True,
+                 max_connections=3, idle_timeout=60, max_messages=100, timeout=30, rate_limit=0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate_limit)
+
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle = []
+        self.connects = 0
+        self.reconnects = 0
+        self.messages_sent = 0
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            self._close(smtp)
+            raise
+        with self._lock:
+            self.connects += 1
+        return PooledConnection(smtp)
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _acquire(self, fresh=False):
+        self._slots.acquire()
+        try:
+            if fresh:
+                return self._connect()
+            now = time.monotonic()
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._connect()
+                if now - conn.last_used < self.idle_timeout:
+                    return conn
+                self._close(conn.smtp)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, broken=False):
+        try:
+            if broken or conn.sent >= self.max_messages:
+                self._close(conn.smtp)
+            else:
+                conn.last_used = time.monotonic()
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def send_message(self, msg):
+        """Send msg on a pooled connection, retrying once on a new one if the server dropped it.
+
+        A dropped connection usually means the server timed out every idle
+        one at once (after a quiet period), so the idle connections are
+        discarded too and the retry always connects afresh.
+        """
+        self.rate_limiter.acquire()
+        for attempt in range(2):
+            conn = self._acquire(fresh=bool(attempt))
+            try:
+                conn.smtp.send_message(msg)
+            except RECONNECT_ERRORS:
+                self._release(conn, broken=True)
+                if attempt:
+                    raise
+                self.close_all()
+                with self._lock:
+                    self.reconnects += 1
+                continue
+            except Exception:
+                self._release(conn, broken=True)
+                raise
+
+            conn.sent += 1
+            self._release(conn)
+            with self._lock:
+                self.messages_sent += 1
+            return
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn.smtp)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_connections': self.max_connections,
+                'idle_connections': len(self._idle),
+                'connects': self.connects,
+                'reconnects': self.reconnects,
+                'messages_sent': self.messages_sent
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_smtp_pool(config):
+    """Process-wide SMTP pool built from the Flask config"""
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = SMTPConnectionPool(
+                config['MAIL_SERVER'],
+                config['MAIL_PORT'],
+                username=config.get('MAIL_USERNAME'),
+                password=config.get('MAIL_PASSWORD'),
+                use_tls=config.get('MAIL_USE_TLS', True),
+                max_connections=config.get('MAIL_POOL_SIZE', 3),
+                idle_timeout=config.get('MAIL_POOL_IDLE_TIMEOUT', 60),
+                max_messages=config.get('MAIL_MAX_MESSAGES_PER_CONNECTION', 100),
+                rate_limit=config.get('MAIL_RATE_LIMIT', 0)
+            )
+            _pool_pid = pid
+        return _pool
@@ -0,0 +1,121 @@
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import extensions
+from config import Config
+from utils.participant_counters import participant_counts
+
+DASHBOARD_SNAPSHOT_ID = 'dashboard'
+
+# Fields the dashboard's recent registrations table shows
+RECENT_REGISTRATION_FIELDS = ('full_name', 'email', 'segment_name', 'registration_date', 'verified')
+
+
+def _first_count(facet):
+    return facet[0]['count'] if facet else 0
+
+
+def compute_dashboard_stats():
+    """Every dashboard number in one aggregation per scanned collection.
+
+    Registrations (totals, verified, recent rows) come from a single $facet
+    and contact messages from a single $group; the remaining totals are read
+    from collection metadata.
+    """
+    db = extensions.db
+
+    registration_facets = next(db.registrations.aggregate([
+        {'$facet': {
+            'total': [{'$count': 'count'}],
+            'verified': [{'$match': {'verified': True}}, {'$count': 'count'}],
+            'recent': [
+                {'$sort': {'registration_date': -1}},
+                {'$limit': 10},
+                {'$project': {field: 1 for field in RECENT_REGISTRATION_FIELDS}}
+            ]
+        }}
+    ]))
+
+    contact = next(db.contact_messages.aggregate([
+        {'$group': {
+            '_id': None,
+            'total': {'$sum': 1},
+            'unread': {'$sum': {'$cond': [{'$eq': ['$status', 'unread']}, 1, 0]}}
+        }}
+    ]), {'total': 0, 'unread': 0})
+
+    participants = participant_counts()
+    segments = [
+        {'_id': str(seg['_id']), 'name': seg['name'], 'current_participants': participants.get(seg['_id'], 0)}
+        for seg in db.segments.find({}, {'name': 1}).sort('_id', 1)
+    ]
+
+    return {
+        'total_registrations': _first_count(registration_facets['total']),
+        'verified_registrations': _first_count(registration_facets['verified']),
+        'recent_registrations': registration_facets['recent'],
+        'total_bob_registrations': db.bob_registrations.estimated_document_count(),
+        'ca_registrations': db.ca_registrations.estimated_document_count(),
+        'bob_tickets': db.bob_ticket.estimated_document_count(),
+        'contact_messages_count': contact['total'],
+        'unread_contact_messages': contact['unread'],
+        'segments': segments
+    }
+
+
+def refresh_dashboard_snapshot():
+    """Recompute the dashboard stats and store them as the current snapshot"""
+    start = time.perf_counter()
+    stats = compute_dashboard_stats()
+    now = datetime.utcnow()
+    snapshot = {
+        'stats': stats,
+        'computed_at': now,
+        'compute_ms': round((time.perf_counter() - start) * 1000, 1),
+        'refreshing_until': None
+    }
+    extensions.db.stats_snapshots.update_one(
+        {'_id': DASHBOARD_SNAPSHOT_ID},
+        {'$set': snapshot},
+        upsert=True
+    )
+    return snapshot
+
+
+def _claim_refresh(stale_before):
+    """Take the right to refresh a stale snapshot, so only one process recomputes it"""
+    now = datetime.utcnow()
+    try:
+        return extensions.db.stats_snapshots.find_one_and_update(
+            {
+                '_id': DASHBOARD_SNAPSHOT_ID,
+                'computed_at': {'$lt': stale_before},
+                'refreshing_until': {'$not': {'$gt': now}}
+            },
+            {'$set': {'refreshing_until': now + timedelta(seconds=30)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Snapshot exists and is fresh or already being refreshed elsewhere
+        return None
+
+
+def get_dashboard_snapshot():
+    """The stored snapshot, as the dashboard sees it.
+
+    The scheduler keeps it fresh every DASHBOARD_SNAPSHOT_INTERVAL seconds.
+    Should that stop, a request finding it older than DASHBOARD_SNAPSHOT_MAX_AGE
+    refreshes it inline; other requests keep reading the stale copy meanwhile.
+    """
+    snapshot = extensions.db.stats_snapshots.find_one({'_id': DASHBOARD_SNAPSHOT_ID})
+    stale_before = datetime.utcnow() - timedelta(seconds=Config.DASHBOARD_SNAPSHOT_MAX_AGE)
+
+    if snapshot and snapshot.get('stats') and snapshot['computed_at'] >= stale_before:
+        return snapshot
+    if _claim_refresh(stale_before) or not (snapshot and snapshot.get('stats')):
+        return refresh_dashboard_snapshot()
+    return snapshot
@@ -0,0 +1,153 @@
+import base64
+import hashlib
+import hmac
+import struct
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+from config import Config
+
+# Token layout (before base64url): version, issued_at (uint32 epoch seconds),
+# user id, zero or more registration/CA application ids, Ed25519 signature.
+# Scanners hold only the public key, so they can check tickets offline
+# without being able to mint them.
+TICKET_VERSION = 2
+TICKET_SIGNATURE_BYTES = 64
+# v1 tickets (already emailed) carried a truncated HMAC-SHA256 instead and
+# can only be checked by the server.
+LEGACY_TICKET_VERSION = 1
+LEGACY_TICKET_MAC_BYTES = 12
+_HEADER = struct.Struct('>BI')
+_OID_BYTES = 12
+
+
+class InvalidTicket(ValueError):
+    """Raised for QR payloads that are not a validly signed ticket"""
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+@lru_cache(maxsize=1)
+def _private_key():
+    """Ed25519 key from QR_TICKET_KEY (base64url 32-byte seed), else derived from SECRET_KEY"""
+    if Config.QR_TICKET_KEY:
+        seed = base64.urlsafe_b64decode(Config.QR_TICKET_KEY + '=' * (-len(Config.QR_TICKET_KEY) % 4))
+    else:
+        seed = hashlib.sha256(b'qr-ticket:' + Config.SECRET_KEY.encode()).digest()
+    return Ed25519PrivateKey.from_private_bytes(seed)
+
+
+@lru_cache(maxsize=1)
+def _public_key():
+    return _private_key().public_key()
+
+
+def ticket_public_key():
+    """Raw public key, base64url, for scanners to verify tickets with"""
+    return _b64encode(_public_key().public_bytes(Encoding.Raw, PublicFormat.Raw))
+
+
+def _epoch_seconds(value):
+    if isinstance(value, datetime):
+        return int(value.replace(tzinfo=timezone.utc).timestamp())
+    return int(value)
+
+
+def sign_ticket(user_id, ref_ids=(), issued_at=None):
+    """Compact signed QR payload for a user and the registrations it admits.
+
+    Pass the document's own timestamp as issued_at so re-sending an email
+    produces the same code (Ed25519 signatures are deterministic), which
+    also hits the QR image cache.
+    """
+    issued_at = _epoch_seconds(issued_at or datetime.utcnow())
+    body = _HEADER.pack(TICKET_VERSION, issued_at) + ObjectId(user_id).binary
+    body += b''.join(ObjectId(ref_id).binary for ref_id in ref_ids)
+    return _b64encode(body + _private_key().sign(body))
+
+
+def document_ticket(document):
+    """Ticket for a registration or CA application, admitting that document"""
+    return sign_ticket(document['user_id'], [document['_id']], document.get('registration_date'))
+
+
+def _decode(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (ValueError, TypeError):
+        raise InvalidTicket('Malformed ticket')
+    if len(raw) < _HEADER.size:
+        raise InvalidTicket('Malformed ticket')
+    return raw
+
+
+def _split(raw, tag_length):
+    """Split a decoded ticket into (version, issued_at, ids, body, tag)"""
+    body, tag = raw[:-tag_length], raw[-tag_length:]
+    ids_length = len(body) - _HEADER.size
+    if ids_length < _OID_BYTES or ids_length % _OID_BYTES:
+        raise InvalidTicket('Malformed ticket')
+    version, issued_at = _HEADER.unpack_from(body)
+    ids = [ObjectId(body[start:start + _OID_BYTES]) for start in range(_HEADER.size, len(body), _OID_BYTES)]
+    return version, issued_at, ids, body, tag
+
+
+def _ticket(ids, issued_at):
+    return {
+        'user_id': ids[0],
+        'ref_ids': ids[1:],
+        'issued_at': datetime.utcfromtimestamp(issued_at)
+    }
+
+
+def verify_ticket(token):
+    """Check a ticket's signature without touching the database.
+
+    Returns {'user_id', 'ref_ids', 'issued_at'}; raises InvalidTicket if the
+    token is malformed or was not signed with the ticket key.
+    """
+    version, issued_at, ids, body, signature = _split(_decode(token), TICKET_SIGNATURE_BYTES)
+    if version != TICKET_VERSION:
+        raise InvalidTicket('Unknown ticket version')
+    try:
+        _public_key().verify(signature, body)
+    except InvalidSignature:
+        raise InvalidTicket('Bad ticket signature')
+    return _ticket(ids, issued_at)
+
+
+def verify_legacy_ticket(token):
+    """Check a v1 (HMAC, QR_SIGNING_KEY) ticket; same result and errors as verify_ticket"""
+    version, issued_at, ids, body, mac = _split(_decode(token), LEGACY_TICKET_MAC_BYTES)
+    expected = hmac.new(Config.QR_SIGNING_KEY.encode(), body, hashlib.sha256).digest()[:LEGACY_TICKET_MAC_BYTES]
+    if version != LEGACY_TICKET_VERSION or not hmac.compare_digest(mac, expected):
+        raise InvalidTicket('Bad ticket signature')
+    return _ticket(ids, issued_at)
+
+
+def parse_scan(code):
+    """Resolve scanned QR text (or a code typed from the email) to (user ObjectId, ticket).
+
+    Plain ObjectIds from QR codes sent before tickets were signed come back
+    with ticket=None; only a database lookup can tell whether they are
+    genuine. v1 tickets are still verified while they are in circulation.
+    """
+    code = code.strip()
+    if len(code) == 24 and Config.QR_ACCEPT_LEGACY_CODES:
+        try:
+            return ObjectId(code), None
+        except InvalidId:
+            pass
+    if _decode(code)[0] == LEGACY_TICKET_VERSION:
+        ticket = verify_legacy_ticket(code)
+    else:
+        ticket = verify_ticket(code)
+    return ticket['user_id'], ticket
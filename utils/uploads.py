@@ -0,0 +1,242 @@
+import hmac
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from io import BytesIO
+
+import cloudinary
+import cloudinary.uploader
+import cloudinary.utils
+from flask import url_for
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from pymongo.errors import DuplicateKeyError
+from werkzeug.security import safe_join
+
+import extensions
+from config import Config
+from utils.http_client import http_get
+
+# Upload kind -> (storage folder, public_id prefix)
+UPLOAD_KINDS = {
+    'receipt': ('receipt_pictures', ''),
+    'profile_picture': ('profile_pictures', 'ca_')
+}
+
+ALLOWED_FORMATS = ('jpg', 'jpeg', 'png')
+
+# Formats the image pipeline writes normalized variants in
+VARIANT_FORMATS = ('webp',)
+
+
+class InvalidUpload(ValueError):
+    """Raised for upload tickets or asset references that do not check out"""
+
+
+def _serializer():
+    return URLSafeTimedSerializer(Config.SECRET_KEY, salt='upload-ticket')
+
+
+def _is_local():
+    return Config.UPLOAD_BACKEND == 'local'
+
+
+def _api_secret():
+    """Secret the storage signs with; the local stand-in uses SECRET_KEY"""
+    return Config.SECRET_KEY if _is_local() else cloudinary.config().api_secret
+
+
+def issue_upload_ticket(kind, user_id):
+    """Signed parameters for the browser to upload one image straight to storage.
+
+    Returns the upload `url`, the form `fields` to post with the file, and
+    a `ticket` the registration form sends back with the upload result.
+    The storage rejects the signed fields after UPLOAD_TICKET_TTL (Cloudinary
+    fixes this at one hour).
+    """
+    folder, prefix = UPLOAD_KINDS[kind]
+    public_id = f"{prefix}{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    params = {
+        'folder': folder,
+        'public_id': public_id,
+        'timestamp': int(time.time()),
+        'allowed_formats': ','.join(ALLOWED_FORMATS)
+    }
+
+    if _is_local():
+        url = url_for('local_upload')
+        fields = dict(params, signature=cloudinary.utils.api_sign_request(params, _api_secret()))
+    else:
+        cloud = cloudinary.config()
+        url = f"https://api.cloudinary.com/v1_1/{cloud.cloud_name}/image/upload"
+        fields = dict(params, api_key=cloud.api_key,
+                      signature=cloudinary.utils.api_sign_request(params, cloud.api_secret))
+
+    ticket = _serializer().dumps({'kind': kind, 'asset': f'{folder}/{public_id}', 'user': str(user_id)})
+    return {'url': url, 'fields': fields, 'ticket': ticket, 'max_bytes': Config.UPLOAD_MAX_BYTES}
+
+
+def _response_signature_valid(asset, version, signature):
+    if not _is_local():
+        return cloudinary.utils.verify_api_response_signature(asset, version, signature)
+    expected = cloudinary.utils.api_sign_request({'public_id': asset, 'version': version},
+                                                 _api_secret(), signature_version=1)
+    return hmac.compare_digest(expected, signature)
+
+
+def asset_url(asset, version):
+    if _is_local():
+        # Matches the uploaded_file route; built by hand so workers need no request context
+        return f'/uploads/{asset}?v={version}'
+    return cloudinary.utils.cloudinary_url(asset, version=version, secure=True)[0]
+
+
+def verify_upload(reference, kind, user_id):
+    """URL of an uploaded image, given the asset reference a form submitted.
+
+    The reference is JSON with the ticket issued for this user and kind,
+    plus the version, signature and size (`bytes`) the storage returned for
+    the upload. Returns {'url', 'asset', 'version'}; raises InvalidUpload
+    unless both signatures check out and the upload is within
+    UPLOAD_MAX_BYTES. The storage's signature does not cover `bytes`, so the
+    image pipeline checks the stored original's real size again.
+    """
+    try:
+        reference = json.loads(reference)
+        ticket = _serializer().loads(reference['ticket'], max_age=Config.UPLOAD_REFERENCE_MAX_AGE)
+        version = str(int(reference['version']))
+        signature = str(reference['signature'])
+        size = int(reference['bytes'])
+    except (ValueError, KeyError, TypeError, BadSignature):
+        raise InvalidUpload('Upload reference is invalid or expired')
+
+    if ticket.get('kind') != kind or ticket.get('user') != str(user_id):
+        raise InvalidUpload('Upload reference belongs to another form')
+    if not _response_signature_valid(ticket['asset'], version, signature):
+        raise InvalidUpload('Upload signature does not match')
+    if size > Config.UPLOAD_MAX_BYTES:
+        raise InvalidUpload('File size too large')
+    return {'url': asset_url(ticket['asset'], version), 'asset': ticket['asset'], 'version': version}
+
+
+def ensure_upload_indexes():
+    # Claims only need to outlive the references that could still be replayed
+    extensions.db.upload_claims.create_index(
+        [('claimed_at', 1)], expireAfterSeconds=Config.UPLOAD_REFERENCE_MAX_AGE + 3600
+    )
+
+
+def claim_upload(upload):
+    """Mark a verified upload as used by the form being saved.
+
+    References stay valid for UPLOAD_REFERENCE_MAX_AGE, so without this one
+    upload could be attached to several documents, and the image pipeline
+    deleting its original for one would break the others. Raises
+    InvalidUpload if the upload was already used.
+    """
+    try:
+        extensions.db.upload_claims.insert_one({'_id': upload['asset'], 'claimed_at': datetime.utcnow()})
+    except DuplicateKeyError:
+        raise InvalidUpload('Upload reference was already used')
+
+
+def release_upload(upload):
+    """Give back a claimed upload whose document was not saved after all"""
+    extensions.db.upload_claims.delete_one({'_id': upload['asset']})
+
+
+def _local_path(asset, extension):
+    """Path under LOCAL_UPLOAD_DIR, or None if the asset name would escape it"""
+    return safe_join(Config.LOCAL_UPLOAD_DIR, f'{asset}.{extension}')
+
+
+def store_local_upload(form, file):
+    """Local stand-in for the storage's signed upload endpoint.
+
+    Checks the signed fields the way Cloudinary does, saves the file under
+    LOCAL_UPLOAD_DIR and answers with a Cloudinary-style signed result.
+    """
+    params = {key: value for key, value in form.items() if key not in ('signature', 'api_key', 'file')}
+    expected = cloudinary.utils.api_sign_request(params, _api_secret())
+    if not hmac.compare_digest(expected, form.get('signature', '')):
+        raise InvalidUpload('Invalid signature')
+    try:
+        stale = time.time() - int(params.get('timestamp', 0)) > Config.UPLOAD_TICKET_TTL
+    except ValueError:
+        stale = True
+    if stale:
+        raise InvalidUpload('Stale request')
+    if params.get('folder') not in {folder for folder, _ in UPLOAD_KINDS.values()}:
+        raise InvalidUpload('Unknown folder')
+
+    extension = os.path.splitext(file.filename or '')[1].lower().lstrip('.') if file else ''
+    if extension not in ALLOWED_FORMATS:
+        raise InvalidUpload('Only JPG, JPEG, and PNG files are allowed')
+    data = file.read(Config.UPLOAD_MAX_BYTES + 1)
+    if len(data) > Config.UPLOAD_MAX_BYTES:
+        raise InvalidUpload('File size too large')
+
+    asset = f"{params['folder']}/{os.path.basename(params['public_id'])}"
+    path = _local_path(asset, extension)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    version = str(int(time.time()))
+    return {
+        'public_id': asset,
+        'version': version,
+        'format': extension,
+        'bytes': len(data),
+        'signature': cloudinary.utils.api_sign_request({'public_id': asset, 'version': version},
+                                                       _api_secret(), signature_version=1),
+        'secure_url': asset_url(asset, version)
+    }
+
+
+def local_upload_path(asset):
+    """Path of a locally stored asset, whatever its extension; None if missing"""
+    for extension in ALLOWED_FORMATS + VARIANT_FORMATS:
+        path = _local_path(asset, extension)
+        if path and os.path.isfile(path):
+            return path
+    return None
+
+
+def read_asset(asset, version):
+    """Bytes of a stored original, for the image pipeline"""
+    if _is_local():
+        path = local_upload_path(asset)
+        if not path:
+            raise FileNotFoundError(asset)
+        with open(path, 'rb') as f:
+            return f.read()
+    response = http_get('cloudinary.asset', asset_url(asset, version))
+    response.raise_for_status()
+    return response.content
+
+
+def store_variant(asset, data, extension):
+    """Store an image the pipeline derived from an upload and return its URL"""
+    if _is_local():
+        path = _local_path(asset, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return asset_url(asset, int(time.time()))
+
+    result = cloudinary.uploader.upload(BytesIO(data), public_id=asset, overwrite=True,
+                                        format=extension, resource_type='image')
+    return result['secure_url']
+
+
+def delete_asset(asset):
+    """Remove a stored upload; missing assets are ignored"""
+    if not _is_local():
+        cloudinary.uploader.destroy(asset, invalidate=True)
+        return
+    for extension in ALLOWED_FORMATS:
+        path = _local_path(asset, extension)
+        if path and os.path.isfile(path):
+            os.remove(path)